@@ -0,0 +1,158 @@
+"""
+Filesystem stand-in for the boto3 S3 client, covering the calls made by `handler.storage`.
+
+Objects live under `<root>/<bucket>/<key>`, so transfers pay real disk I/O but no
+network latency, and benchmark numbers isolate the handler's own cost.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import threading
+from collections.abc import Callable, Iterator
+
+from botocore.exceptions import ClientError
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _error(code: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class _Body:
+    def __init__(self, data: bytes) -> None:
+        self._stream = io.BytesIO(data)
+
+    def read(self, amount: int | None = None) -> bytes:
+        return self._stream.read(amount)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        while chunk := self._stream.read(chunk_size):
+            yield chunk
+
+
+class _Paginator:
+    def __init__(self, client: "FilesystemS3") -> None:
+        self._client = client
+
+    def paginate(self, Bucket: str, Prefix: str = "") -> Iterator[dict]:
+        keys = self._client.keys(Bucket, Prefix)
+        yield {"Contents": [{"Key": key} for key in keys]} if keys else {}
+
+
+class FilesystemS3:
+    """
+    Minimal S3 client backed by a local directory, including conditional writes.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def keys(self, bucket: str, prefix: str = "") -> list[str]:
+        bucket_root = os.path.join(self.root, bucket)
+        keys = [
+            os.path.relpath(os.path.join(directory, name), bucket_root)
+            for directory, _, names in os.walk(bucket_root)
+            for name in names
+        ]
+        return sorted(key for key in keys if key.startswith(prefix))
+
+    def _read(self, bucket: str, key: str, operation: str) -> bytes:
+        try:
+            with open(self.path(bucket, key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            raise _error("NoSuchKey", operation) from None
+
+    def _write(self, bucket: str, key: str, data: bytes) -> str:
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        return self._etag(data)
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def download_file(
+        self, Bucket: str, Key: str, Filename: str, Config=None, Callback: Callable | None = None
+    ) -> None:
+        if not os.path.exists(self.path(Bucket, Key)):
+            raise _error("404", "HeadObject")
+        shutil.copyfile(self.path(Bucket, Key), Filename)
+        if Callback:
+            Callback(os.path.getsize(Filename))
+
+    def upload_file(
+        self, Filename: str, Bucket: str, Key: str, Config=None, Callback: Callable | None = None
+    ) -> None:
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+        if Callback:
+            Callback(os.path.getsize(path))
+
+    def upload_fileobj(
+        self, Fileobj, Bucket: str, Key: str, Config=None, Callback: Callable | None = None
+    ) -> None:
+        data = Fileobj.read()
+        self._write(Bucket, Key, data)
+        if Callback:
+            Callback(len(data))
+
+    def get_object(self, Bucket: str, Key: str, Range: str | None = None) -> dict:
+        if not Range:
+            data = self._read(Bucket, Key, "GetObject")
+            return {"Body": _Body(data), "ETag": self._etag(data), "ContentLength": len(data)}
+
+        start, end = (int(value) for value in Range.removeprefix("bytes=").split("-"))
+        try:
+            with open(self.path(Bucket, Key), "rb") as file:
+                file.seek(start)
+                data = file.read(end - start + 1)
+        except FileNotFoundError:
+            raise _error("NoSuchKey", "GetObject") from None
+        return {"Body": _Body(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        try:
+            return {"ContentLength": os.path.getsize(self.path(Bucket, Key))}
+        except FileNotFoundError:
+            raise _error("404", "HeadObject") from None
+
+    def put_object(
+        self, Bucket: str, Key: str, Body: bytes, IfMatch: str | None = None, IfNoneMatch=None
+    ) -> dict:
+        with self._lock:
+            exists = os.path.exists(self.path(Bucket, Key))
+            if IfNoneMatch == "*" and exists:
+                raise _error("PreconditionFailed", "PutObject")
+            if IfMatch is not None and (
+                not exists or self._etag(self._read(Bucket, Key, "PutObject")) != IfMatch
+            ):
+                raise _error("PreconditionFailed", "PutObject")
+            return {"ETag": self._write(Bucket, Key, Body)}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict) -> dict:
+        data = self._read(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        return {"CopyObjectResult": {"ETag": self._write(Bucket, Key, data)}}
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        for obj in Delete["Objects"]:
+            try:
+                os.remove(self.path(Bucket, obj["Key"]))
+            except FileNotFoundError:
+                pass
+        return {}
+
+    def get_paginator(self, operation: str) -> _Paginator:
+        if operation != "list_objects_v2":
+            raise NotImplementedError(operation)
+        return _Paginator(self)
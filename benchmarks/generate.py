@@ -0,0 +1,139 @@
+"""
+Synthetic credit card transaction data matching `EXPECTED_SCHEMA_MAPPING`.
+
+Values are derived from hashes of the row index, so a given (rows, seed, defect_rate)
+always produces the same file and generation is vectorised even at 10M rows.
+"""
+
+import argparse
+from datetime import datetime
+
+import polars as pl
+
+CATEGORIES = [
+    "entertainment",
+    "food_dining",
+    "gas_transport",
+    "grocery_net",
+    "grocery_pos",
+    "health_fitness",
+    "home",
+    "kids_pets",
+    "misc_net",
+    "misc_pos",
+    "personal_care",
+    "shopping_net",
+    "shopping_pos",
+    "travel",
+]
+FIRST_NAMES = ["Jennifer", "Stephanie", "Edward", "Jeremy", "Tyler", "Jessica", "Daniel", "Amy"]
+LAST_NAMES = ["Banks", "Gill", "Sanchez", "White", "Garcia", "Williams", "Murphy", "Smith"]
+STATES = ["NC", "WA", "ID", "MT", "VA", "PA", "KS", "TX", "NY", "CA"]
+JOBS = ["Psychologist", "Special educational needs teacher", "Nature conservation officer"]
+
+START = datetime(2020, 1, 1)
+SECONDS_PER_YEAR = 365 * 24 * 3600
+# Cards the transactions are spread over, about as many as in the Kaggle data set.
+CARD_COUNT = 1000
+
+# Defects injected into a row, chosen uniformly per defective row.
+DEFECTS = ("invalid_zip", "invalid_is_fraud", "null_merchant")
+
+
+def _random(seed: int, salt: int) -> pl.Expr:
+    return pl.int_range(pl.len(), dtype=pl.UInt64).hash(seed * 1_000_003 + salt)
+
+
+def _uniform(seed: int, salt: int) -> pl.Expr:
+    return (_random(seed, salt) % 1_000_000) / 1_000_000
+
+
+def _choice(values: list[str], seed: int, salt: int) -> pl.Expr:
+    return (_random(seed, salt) % len(values)).replace_strict(
+        dict(enumerate(values)), return_dtype=pl.Utf8
+    )
+
+
+def generate_transactions(rows: int, seed: int = 0, defect_rate: float = 0.0) -> pl.DataFrame:
+    """
+    Generate synthetic transactions with the columns and formats of the raw CSV files.
+
+    Args:
+        rows (int): Number of rows to generate.
+        seed (int): Seed of the pseudo-random values.
+        defect_rate (float): Fraction of rows that get one of DEFECTS injected.
+
+    Returns:
+        pl.DataFrame: The transactions, all columns as they appear in the CSV.
+    """
+    transacted_at = pl.lit(START) + pl.duration(seconds=_random(seed, 1) % SECONDS_PER_YEAR)
+    frame = pl.select(pl.repeat(None, rows).alias("_")).select(
+        transacted_at.dt.strftime("%Y-%m-%d %H:%M:%S").alias("trans_date_trans_time"),
+        (4_000_000_000_000_000 + (_random(seed, 2) % CARD_COUNT) * 1_000_003_000_007)
+        .cast(pl.Int64)
+        .alias("cc_num"),
+        pl.format("fraud_Merchant {}", _random(seed, 3) % 700).alias("merchant"),
+        _choice(CATEGORIES, seed, 4).alias("category"),
+        ((_random(seed, 5) % 100_000) / 100).alias("amt"),
+        _choice(FIRST_NAMES, seed, 6).alias("first"),
+        _choice(LAST_NAMES, seed, 7).alias("last"),
+        _choice(["F", "M"], seed, 8).alias("gender"),
+        pl.format("{} Main Street", _random(seed, 9) % 9999).alias("street"),
+        pl.format("City {}", _random(seed, 10) % 900).alias("city"),
+        _choice(STATES, seed, 11).alias("state"),
+        (501 + _random(seed, 12) % 99_000).cast(pl.Utf8).str.zfill(5).alias("zip"),
+        (25 + _uniform(seed, 13) * 24).round(4).alias("lat"),
+        (-125 + _uniform(seed, 14) * 58).round(4).alias("long"),
+        (100 + _random(seed, 15) % 2_000_000).cast(pl.Int64).alias("city_pop"),
+        _choice(JOBS, seed, 16).alias("job"),
+        (pl.lit(START.date()) - pl.duration(days=6570 + _random(seed, 17) % 21900))
+        .dt.strftime("%Y-%m-%d")
+        .alias("dob"),
+        pl.format("{}", _random(seed, 18)).alias("trans_num"),
+        transacted_at.dt.epoch("s").alias("unix_time"),
+        (25 + _uniform(seed, 19) * 24).round(6).alias("merch_lat"),
+        (-125 + _uniform(seed, 20) * 58).round(6).alias("merch_long"),
+        (_random(seed, 21) % 200 == 0).cast(pl.Int8).alias("is_fraud"),
+    )
+    if defect_rate <= 0:
+        return frame
+
+    defective = _uniform(seed, 22) < defect_rate
+    defect = _random(seed, 23) % len(DEFECTS)
+    return frame.with_columns(
+        pl.when(defective & (defect == 0)).then(pl.lit("ABCDE")).otherwise("zip").alias("zip"),
+        pl.when(defective & (defect == 1))
+        .then(pl.lit(2, dtype=pl.Int8))
+        .otherwise("is_fraud")
+        .alias("is_fraud"),
+        pl.when(defective & (defect == 2))
+        .then(pl.lit(None, dtype=pl.Utf8))
+        .otherwise("merchant")
+        .alias("merchant"),
+    )
+
+
+def write_transactions_csv(path: str, rows: int, seed: int = 0, defect_rate: float = 0.0) -> str:
+    """
+    Generate transactions and write them as a CSV file.
+
+    Returns:
+        str: The path of the written file.
+    """
+    generate_transactions(rows, seed, defect_rate).write_csv(path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic transactions CSV.")
+    parser.add_argument("path", help="Output CSV path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--defect-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    write_transactions_csv(args.path, args.rows, args.seed, args.defect_rate)
+    print(f"Wrote {args.rows} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Benchmark the handler pipeline on synthetic data and compare against a stored baseline.
+
+Every (scenario, size) case runs in a fresh spawned process, so its peak RSS is not
+inflated by earlier cases or by generating the input data.
+
+    python -m benchmarks.run --rows 10000 100000 --repeat 5
+    python -m benchmarks.run --save-baseline        # store the current results
+    python -m benchmarks.run --tolerance 0.2        # fail on a >20% regression
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.generate import write_transactions_csv
+
+SCENARIOS = (
+    "load_and_validate",
+    "transform",
+    "enrich",
+    "handle_event",
+    "stream",
+    "small_files",
+    "coalesce",
+)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+RAW_BUCKET = "raw-bench"
+REFINED_BUCKET = "refined-bench"
+# Rows per object of the small_files and coalesce scenarios.
+SMALL_FILE_ROWS = 100
+
+# Compared against the baseline; the other reported values are informational.
+REGRESSION_METRICS = ("p50_seconds", "peak_rss_bytes")
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile, defined for any number of samples.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _run_case(scenario: str, csv_path: str, repeat: int, workdir: str, expect_valid: bool) -> dict:
+    # Runs in the spawned process: configure the environment before importing the handler.
+    os.environ.setdefault("REFINED_BUCKET_NAME", REFINED_BUCKET)
+    os.environ.setdefault("IDEMPOTENCY_ENABLED", "false")
+    if scenario == "coalesce":
+        os.environ["COALESCE_ENABLED"] = "true"
+    if scenario == "stream":
+        os.environ["STREAMING_ENABLED"] = "true"
+
+    import logging
+    import resource
+
+    import polars as pl
+
+    import handler.metrics as metrics
+    import handler.storage as storage
+    from benchmarks.fake_s3 import FilesystemS3
+    from handler.features import add_features
+    from handler.handler import handle_event
+    from handler.transform import transform_dataframe_to_parquet
+    from handler.validator import _expected_schema, load_and_validate_csv
+
+    # The expected "log file not found" on the first run would otherwise flood the report.
+    logging.disable(logging.ERROR)
+    sink = metrics.JsonSink()
+    metrics.set_sink(sink)
+    storage.s3 = FilesystemS3(os.path.join(workdir, "s3"))  # type: ignore[assignment]
+
+    if scenario == "load_and_validate":
+
+        def run(_: int) -> None:
+            try:
+                load_and_validate_csv(csv_path)
+            except ValueError:
+                pass  # Injected defects fail validation, which is part of what is measured.
+
+    elif scenario == "transform":
+        frame = pl.read_csv(csv_path, schema=_expected_schema(), try_parse_dates=True)
+
+        def run(_: int) -> None:
+            transform_dataframe_to_parquet(frame, "benchmark.parquet")
+
+    elif scenario == "enrich":
+        frame = pl.read_csv(csv_path, schema=_expected_schema(), try_parse_dates=True)
+
+        def run(_: int) -> None:
+            add_features(frame)
+
+    elif scenario in ("handle_event", "stream"):
+        # stream refines the same object with the streaming pipeline, its peak RSS
+        # should stay flat across sizes.
+        raw_key = f"raw/{os.path.basename(csv_path)}"
+        storage.s3.upload_file(csv_path, RAW_BUCKET, raw_key)
+        s3_object = {"key": raw_key, "size": os.path.getsize(csv_path)}
+        event = {"Records": [{"s3": {"bucket": {"name": RAW_BUCKET}, "object": s3_object}}]}
+
+        def run(_: int) -> None:
+            response = handle_event(event, None)
+            # With injected defects the record is quarantined, which is what is measured.
+            if expect_valid and response["batchItemFailures"]:
+                raise RuntimeError(f"handle_event failed: {response}")
+
+    elif scenario in ("small_files", "coalesce"):
+        # The same data as many small objects in one event, refined one by one or coalesced.
+        rows = pl.read_csv(csv_path, infer_schema=False)
+        records = []
+        for index, part in enumerate(rows.iter_slices(SMALL_FILE_ROWS)):
+            raw_key = f"raw/small/part-{index:05d}.csv"
+            part_path = os.path.join(workdir, f"part-{index:05d}.csv")
+            part.write_csv(part_path)
+            storage.s3.upload_file(part_path, RAW_BUCKET, raw_key)
+            s3_object = {"key": raw_key, "size": os.path.getsize(part_path)}
+            records.append({"s3": {"bucket": {"name": RAW_BUCKET}, "object": s3_object}})
+        event = {"Records": records}
+
+        def run(_: int) -> None:
+            response = handle_event(event, None)
+            if expect_valid and response["batchItemFailures"]:
+                raise RuntimeError(f"handle_event failed: {response}")
+
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    latencies = []
+    for iteration in range(repeat):
+        started = time.perf_counter()
+        run(iteration)
+        latencies.append(time.perf_counter() - started)
+
+    stage_seconds: dict[str, float] = {}
+    for record in sink.records:
+        stage_seconds[record.stage] = stage_seconds.get(record.stage, 0.0) + record.wall_seconds
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "latencies": latencies,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit,
+        "stage_seconds": {name: total / repeat for name, total in stage_seconds.items()},
+    }
+
+
+def run_benchmarks(
+    sizes: list[int], scenarios: list[str], repeat: int, defect_rate: float, seed: int
+) -> dict:
+    """
+    Run every scenario at every size.
+
+    Returns:
+        dict: Results keyed by "<scenario>@<rows>".
+    """
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="handler-bench-") as workdir:
+        for rows in sizes:
+            csv_path = os.path.join(workdir, f"transactions-{rows}.csv")
+            write_transactions_csv(csv_path, rows, seed, defect_rate)
+            csv_bytes = os.path.getsize(csv_path)
+
+            for scenario in scenarios:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    raw = pool.submit(
+                        _run_case, scenario, csv_path, repeat, workdir, defect_rate <= 0
+                    ).result()
+
+                p50 = percentile(raw["latencies"], 50)
+                results[f"{scenario}@{rows}"] = {
+                    "scenario": scenario,
+                    "rows": rows,
+                    "csv_bytes": csv_bytes,
+                    "p50_seconds": p50,
+                    "p95_seconds": percentile(raw["latencies"], 95),
+                    "p99_seconds": percentile(raw["latencies"], 99),
+                    "rows_per_second": rows / p50 if p50 else 0.0,
+                    "mb_per_second": csv_bytes / 1024 / 1024 / p50 if p50 else 0.0,
+                    "peak_rss_bytes": raw["peak_rss_bytes"],
+                    "stage_seconds": raw["stage_seconds"],
+                }
+                print(_format_result(results[f"{scenario}@{rows}"]), flush=True)
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare results with a baseline.
+
+    Returns:
+        list[str]: One message per metric that is more than `tolerance` worse than the baseline.
+    """
+    regressions = []
+    for case, result in results.items():
+        previous = baseline.get("cases", {}).get(case)
+        if not previous:
+            continue
+        for metric in REGRESSION_METRICS:
+            if previous[metric] and result[metric] > previous[metric] * (1 + tolerance):
+                change = result[metric] / previous[metric] - 1
+                regressions.append(
+                    f"{case} {metric}: {previous[metric]:.4g} -> {result[metric]:.4g} "
+                    f"(+{change:.0%})"
+                )
+    return regressions
+
+
+def _environment() -> dict:
+    import polars as pl
+
+    return {
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _format_result(result: dict) -> str:
+    return (
+        f"{result['scenario']:<18} {result['rows']:>10} rows  "
+        f"p50 {result['p50_seconds']:.3f}s  p95 {result['p95_seconds']:.3f}s  "
+        f"p99 {result['p99_seconds']:.3f}s  {result['rows_per_second']:>12,.0f} rows/s  "
+        f"{result['mb_per_second']:>7.1f} MB/s  "
+        f"peak RSS {result['peak_rss_bytes'] / 1024 / 1024:.0f} MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the raw transactions handler.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--defect-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.rows, args.scenario, args.repeat, args.defect_rate, args.seed)
+    document = {"environment": _environment(), "cases": results}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline.get("environment") != document["environment"]:
+        print(f"Warning: baseline was recorded on {baseline.get('environment')}")
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+
+from handler import storage
+from handler.idempotency import ObjectIdentity
+from handler.logger import setup_logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MB = 1024 * 1024
+S3_SCHEME = "s3://"
+# Objects per task. Every task writes its log entries with one update per log file, so
+# larger batches mean fewer competing log updates, smaller ones a finer-grained checkpoint.
+DEFAULT_BATCH_SIZE = 16
+
+
+@dataclass
+class BackfillReport:
+    """
+    Outcome and throughput of a backfill run.
+    """
+
+    objects: int = 0
+    size_bytes: int = 0
+    seconds: float = 0.0
+    failed: list[str] = field(default_factory=list)
+
+    @property
+    def objects_per_second(self) -> float:
+        return self.objects / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.size_bytes / MB / self.seconds if self.seconds else 0.0
+
+
+class Checkpoint:
+    """
+    Append-only JSON Lines file of the objects a backfill has finished, so an interrupted
+    run resumes where it stopped. Failed objects are recorded too, but retried on resume.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def completed(self) -> set[str]:
+        """
+        The keys of all objects that were refined or skipped as duplicates.
+        """
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as file:
+            # The latest entry of a key wins, so a failure that was retried counts as done.
+            statuses = {entry["key"]: entry["status"] for entry in map(json.loads, file)}
+        return {key for key, status in statuses.items() if status == "done"}
+
+    def record(self, keys: list[str], failed: set[str]) -> None:
+        with open(self.path, "a") as file:
+            for key in keys:
+                status = "failed" if key in failed else "done"
+                file.write(json.dumps({"key": key, "status": status}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def discover_objects(
+    source: str, suffix: str = ".csv", key_prefix: str = "raw/"
+) -> list[ObjectIdentity]:
+    """
+    List the raw objects below an S3 prefix or a local directory.
+
+    Args:
+        source (str): s3://bucket/prefix, or the path of a local directory.
+        suffix (str): Only objects whose key ends with this suffix are listed.
+        key_prefix (str): Prepended to the relative path of local files to form their
+            object key, so their output is written to the same keys as for S3 objects.
+
+    Returns:
+        list[ObjectIdentity]: The objects in lexicographical order of their keys.
+    """
+    if source.startswith(S3_SCHEME):
+        bucket_name, _, prefix = source.removeprefix(S3_SCHEME).partition("/")
+        return [
+            # Listings quote ETags, S3 events do not; both must share idempotency markers.
+            ObjectIdentity(bucket_name, obj["Key"], etag=obj["ETag"].strip('"'), size=obj["Size"])
+            for obj in storage.list_objects(bucket_name, prefix)
+            if obj["Key"].endswith(suffix)
+        ]
+
+    root = os.path.abspath(source)
+    if not os.path.isdir(root):
+        raise ValueError(f"Not an S3 URI or a directory: {source}")
+    identities = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(directory, name)
+            key = key_prefix + os.path.relpath(path, root).replace(os.sep, "/")
+            identities.append(
+                ObjectIdentity(root, key, size=os.path.getsize(path), local_path=path)
+            )
+    return sorted(identities, key=lambda identity: identity.key)
+
+
+def run_backfill(
+    identities: list[ObjectIdentity],
+    executor: Executor,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    checkpoint: Checkpoint | None = None,
+) -> BackfillReport:
+    """
+    Refine the objects in batches on the executor, recording finished batches in the
+    checkpoint and logging the throughput as they complete.
+
+    Args:
+        identities (list[ObjectIdentity]): The objects to refine.
+        executor (Executor): Runs the batches, normally a process pool.
+        batch_size (int): Objects per batch.
+        checkpoint (Checkpoint | None): Where finished objects are recorded.
+
+    Returns:
+        BackfillReport: The number, size and duration of the processed objects and
+            the keys of those that failed.
+    """
+    report = BackfillReport()
+    total = len(identities)
+    started = time.perf_counter()
+    futures: dict[Future, list[ObjectIdentity]] = {
+        executor.submit(_process_batch, identities[start : start + batch_size]): identities[
+            start : start + batch_size
+        ]
+        for start in range(0, total, batch_size)
+    }
+
+    for future in as_completed(futures):
+        batch = futures[future]
+        keys = [identity.key for identity in batch]
+        try:
+            failed = set(future.result())
+        except Exception as e:
+            logger.error(f"Batch starting at {keys[0]} failed: {e}")
+            failed = set(keys)
+
+        if checkpoint:
+            checkpoint.record(keys, failed)
+        report.objects += len(batch)
+        report.size_bytes += sum(identity.size or 0 for identity in batch)
+        report.failed.extend(key for key in keys if key in failed)
+        report.seconds = time.perf_counter() - started
+        logger.info(
+            f"{report.objects}/{total} object(s) processed, {len(report.failed)} failed, "
+            f"{report.objects_per_second:.1f} objects/s, {report.mb_per_second:.1f} MB/s"
+        )
+
+    report.failed.sort()
+    return report
+
+
+def _process_batch(identities: list[ObjectIdentity]) -> list[str]:
+    # Runs in a worker process; the pipeline is imported there, not in the parent.
+    from handler.handler import process_records
+
+    return sorted(process_records([(identity.key, identity) for identity in identities]))
+
+
+def _init_worker(workers: int, verbose: bool, idempotency: bool = True) -> None:
+    import handler.handler as handler
+    import handler.metrics as metrics
+    from handler.scratch import scratch
+
+    setup_logging()
+    if not verbose:
+        # Per-record logs and CloudWatch metric lines would drown the progress report.
+        logging.disable(logging.INFO)
+        metrics.METRICS_ENABLED = False
+    if not idempotency:
+        # Reprocessing refines objects again even if they are marked as processed.
+        handler.IDEMPOTENCY_ENABLED = False
+    # Every process owns its scratch space, as the first use of one purges its root.
+    scratch.root = os.path.join(scratch.root, f"worker-{os.getpid()}")
+    scratch.budget_bytes //= workers
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Refine every raw CSV object below an S3 prefix or in a local directory, for
+    backfills and historical reprocessing, on all cores of the machine.
+    """
+    parser = argparse.ArgumentParser(prog="raw-transactions-handler", description=main.__doc__)
+    parser.add_argument("source", help="s3://bucket/prefix or a local directory")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="worker processes (all cores)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="objects per worker task"
+    )
+    parser.add_argument(
+        "--checkpoint", help="JSON Lines file to record progress in and resume from"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="list the objects and exit")
+    parser.add_argument("--suffix", default=".csv", help="only process keys with this suffix")
+    parser.add_argument(
+        "--key-prefix", default="raw/", help="object key prefix of local files (default raw/)"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="log and emit metrics for every record"
+    )
+    parser.add_argument(
+        "--no-idempotency",
+        dest="idempotency",
+        action="store_false",
+        help="refine objects even if they are marked as processed, without marking them",
+    )
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    identities = discover_objects(args.source, args.suffix, args.key_prefix)
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    completed = checkpoint.completed() if checkpoint else set()
+    pending = [identity for identity in identities if identity.key not in completed]
+    logger.info(
+        f"{len(pending)} of {len(identities)} object(s) to process "
+        f"({sum(identity.size or 0 for identity in pending)} bytes)"
+    )
+
+    if args.dry_run or not pending:
+        for identity in pending:
+            print(identity.key)
+        return 0
+
+    workers = max(1, min(args.workers, len(pending)))
+    # Spawned rather than forked, so workers never inherit the parent's S3 client.
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(workers, args.verbose, args.idempotency),
+    ) as executor:
+        report = run_backfill(pending, executor, args.batch_size, checkpoint)
+
+    logger.info(
+        f"Processed {report.objects} object(s) ({report.size_bytes} bytes) in "
+        f"{report.seconds:.1f}s: {report.objects_per_second:.1f} objects/s, "
+        f"{report.mb_per_second:.1f} MB/s, {len(report.failed)} failed"
+    )
+    for key in report.failed:
+        logger.error(f"Failed: {key}")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
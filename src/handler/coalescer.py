@@ -0,0 +1,125 @@
+import logging
+import os
+import posixpath
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import polars as pl
+
+from handler.idempotency import ObjectIdentity
+from handler.metrics import stage
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bounds of a coalescing window; whichever is reached first flushes it.
+COALESCE_MAX_FILES = int(os.getenv("COALESCE_MAX_FILES", "1000"))
+COALESCE_MAX_BYTES = int(os.getenv("COALESCE_MAX_MB", "128")) * 1024 * 1024
+COALESCE_MAX_SECONDS = float(os.getenv("COALESCE_MAX_SECONDS", "60"))
+
+# Writes the concatenated data to the given key and returns the keys it uploaded.
+Writer = Callable[[pl.DataFrame, str], list[str]]
+
+
+@dataclass
+class _Window:
+    directory: str
+    opened: float
+    sources: list[ObjectIdentity] = field(default_factory=list)
+    frames: list[pl.DataFrame] = field(default_factory=list)
+    size_bytes: int = 0
+
+
+class Coalescer:
+    """
+    Buffers the validated data of many small objects and writes it as one Parquet
+    file per refined directory and schema, instead of one file per object.
+
+    A window is flushed once it holds `max_files` objects or `max_bytes` of data in
+    memory, or once it has been open for `max_seconds` when the next object arrives;
+    `flush` writes what is left. A failed write only fails the objects of its window,
+    the outcome of every object is kept in `outputs` and `failures`.
+    """
+
+    def __init__(
+        self,
+        write: Writer,
+        max_files: int = COALESCE_MAX_FILES,
+        max_bytes: int = COALESCE_MAX_BYTES,
+        max_seconds: float = COALESCE_MAX_SECONDS,
+    ) -> None:
+        self._write = write
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self._windows: dict[tuple, _Window] = {}
+        self._lock = threading.Lock()
+        self.outputs: dict[ObjectIdentity, list[str]] = {}
+        self.failures: dict[ObjectIdentity, Exception] = {}
+
+    def add(self, source: ObjectIdentity, frame: pl.DataFrame, directory: str) -> None:
+        """
+        Buffer the data of an object, to be written to `directory` with the data of
+        other objects of the same directory and columns.
+
+        Args:
+            source (ObjectIdentity): The object the data was read from.
+            frame (pl.DataFrame): The validated data.
+            directory (str): The refined directory the object belongs to.
+        """
+        key = (directory, tuple(frame.schema.items()))
+        with self._lock:
+            now = time.monotonic()
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = _Window(directory, now)
+            window.sources.append(source)
+            window.frames.append(frame)
+            window.size_bytes += int(frame.estimated_size())
+            full = (
+                len(window.sources) >= self.max_files
+                or window.size_bytes >= self.max_bytes
+                or now - window.opened >= self.max_seconds
+            )
+            if full:
+                del self._windows[key]
+        logger.info(f"Buffered {len(frame)} rows of {source.key} for {directory}")
+
+        if full:
+            self._flush_window(window)
+
+    def flush(self) -> None:
+        """
+        Write all open windows.
+        """
+        with self._lock:
+            windows, self._windows = list(self._windows.values()), {}
+        for window in windows:
+            self._flush_window(window)
+
+    def _flush_window(self, window: _Window) -> None:
+        output_key = posixpath.join(
+            window.directory,
+            f"coalesced-{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet",
+        )
+        try:
+            with stage("coalesce") as measured:
+                frame = pl.concat(window.frames, how="vertical_relaxed", rechunk=True)
+                measured.rows = len(frame)
+                measured.bytes_in = window.size_bytes
+                keys = self._write(frame, output_key)
+        except Exception as e:
+            logger.exception(f"Error writing {len(window.sources)} coalesced file(s): {e}")
+            for source in window.sources:
+                self.failures[source] = e
+            return
+
+        for source in window.sources:
+            self.outputs[source] = keys
+        logger.info(
+            f"Coalesced {len(window.sources)} file(s) with {len(frame)} rows into {output_key}"
+        )
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import json
+import logging
+import posixpath
+from datetime import datetime
+from typing import IO
+
+from botocore.exceptions import ClientError
+
+from handler.idempotency import ObjectIdentity
+from handler.storage import get_bytes_from_s3, get_object_checksum, put_bytes_to_s3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CONTENT_INDEX_PREFIX = "content-index"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+# Checksums S3 stores per object that identify content, strongest first. CRCs only detect
+# accidental corruption and are easy to collide, so objects with nothing but a CRC are
+# hashed after the download. Only full-object checksums identify content; composite ones
+# depend on how a multipart upload was split into parts.
+S3_CHECKSUMS = (
+    ("ChecksumSHA256", "sha256"),
+    ("ChecksumSHA1", "sha1"),
+)
+
+# Layout in the refined bucket:
+#   content-index/<digest of the content ID>.json   one per refined content
+# A content ID is "<algorithm>:<hex digest>:<size in bytes>:<outputs digest>", e.g.
+# "sha256:9f86...:1024:5e88...". The outputs digest covers the schema and the options the
+# outputs were written with, so identical content refined differently is not confused.
+# Entries record the ETag of every output, outputs that changed since are not copied.
+
+
+def checksum_content_id(identity: ObjectIdentity, outputs: str) -> str | None:
+    """
+    Derive the content ID of an object from the full-object checksum S3 stored for it,
+    without downloading it.
+
+    Args:
+        identity (ObjectIdentity): The object.
+        outputs (str): Description of the schema and the output options.
+
+    Returns:
+        str | None: The content ID, or None if S3 has no full-object SHA checksum.
+    """
+    checksums = get_object_checksum(identity.bucket, identity.key)
+    if checksums.get("ChecksumType", "FULL_OBJECT") != "FULL_OBJECT":
+        return None
+    for field, algorithm in S3_CHECKSUMS:
+        value = checksums.get(field)
+        # Composite checksums of multipart uploads end in "-<part count>".
+        if value and "-" not in value:
+            digest = base64.b64decode(value).hex()
+            return f"{algorithm}:{digest}:{checksums['ContentLength']}:{_digest(outputs)}"
+    return None
+
+
+def hash_content_id(source: str | IO[bytes], outputs: str) -> str:
+    """
+    Compute the SHA-256 content ID of a downloaded file or buffer. It matches the
+    content ID of objects uploaded with a SHA-256 checksum.
+
+    Args:
+        source (str | IO[bytes]): Path of the file, or a buffer read from its start.
+        outputs (str): Description of the schema and the output options.
+
+    Returns:
+        str: The content ID.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            size = _update(digest, file)
+    else:
+        source.seek(0)
+        size = _update(digest, source)
+        source.seek(0)
+    return f"sha256:{digest.hexdigest()}:{size}:{_digest(outputs)}"
+
+
+def lookup(content_id: str) -> dict | None:
+    """
+    Find the refined outputs of content that was refined before.
+
+    Args:
+        content_id (str): The content ID.
+
+    Returns:
+        dict | None: The index entry with the raw object key, the refined keys and their
+            ETags, or None if the content is unknown.
+    """
+    try:
+        return json.loads(get_bytes_from_s3(_entry_key(content_id)))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def record(content_ids: list[str], object_key: str, refined_etags: dict[str, str]) -> None:
+    """
+    Index the refined outputs of an object under each of its content IDs.
+
+    Args:
+        content_ids (list[str]): The content IDs of the raw object.
+        object_key (str): The S3 object key of the raw object.
+        refined_etags (dict[str, str]): The ETag of each of its refined outputs.
+    """
+    for content_id in content_ids:
+        entry = {
+            "content_id": content_id,
+            "object_key": object_key,
+            "refined_keys": list(refined_etags),
+            "refined_etags": refined_etags,
+            "timestamp": datetime.now().isoformat(),
+        }
+        put_bytes_to_s3(_entry_key(content_id), json.dumps(entry).encode())
+    logger.info(f"Indexed {object_key} under {len(content_ids)} content ID(s)")
+
+
+def alias_key(refined_key: str, source_refined_key: str, source_output_key: str) -> str:
+    """
+    Map an output of the indexed object to the corresponding output of a new object,
+    keeping any partition path between the directory and the file name.
+
+    Args:
+        refined_key (str): The refined key of the new object.
+        source_refined_key (str): The refined key of the indexed object.
+        source_output_key (str): One output key of the indexed object.
+
+    Returns:
+        str: The output key for the new object.
+    """
+    source_directory = posixpath.dirname(source_refined_key)
+    partition_path = posixpath.dirname(posixpath.relpath(source_output_key, source_directory))
+    directory, filename = posixpath.split(refined_key)
+    return posixpath.join(directory, partition_path, filename) if partition_path else refined_key
+
+
+def _digest(outputs: str) -> str:
+    return hashlib.sha256(outputs.encode()).hexdigest()[:16]
+
+
+def _entry_key(content_id: str) -> str:
+    return f"{CONTENT_INDEX_PREFIX}/{hashlib.sha256(content_id.encode()).hexdigest()}.json"
+
+
+def _update(digest: "hashlib._Hash", file: IO[bytes]) -> int:
+    size = 0
+    while chunk := file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return size
@@ -0,0 +1,130 @@
+import logging
+import os
+from collections.abc import Callable
+
+import polars as pl
+
+from handler.metrics import stage
+from handler.transform import _split
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of the trailing per-card window, ending at (and including) each transaction.
+WINDOW_SECONDS = int(os.getenv("ENRICHMENT_WINDOW_SECONDS", str(24 * 60 * 60)))
+
+
+def _customer_age() -> pl.Expr:
+    # Completed years at the time of the transaction, one less before the birthday.
+    transaction, dob = pl.col("trans_date_trans_time"), pl.col("dob")
+    before_birthday = (transaction.dt.month() < dob.dt.month()) | (
+        (transaction.dt.month() == dob.dt.month()) & (transaction.dt.day() < dob.dt.day())
+    )
+    age = transaction.dt.year() - dob.dt.year() - before_birthday.cast(pl.Int32)
+    return age.cast(pl.Int16)
+
+
+def _distance_km() -> pl.Expr:
+    # Haversine distance between the customer's and the merchant's location.
+    lat, merch_lat = pl.col("lat").radians(), pl.col("merch_lat").radians()
+    delta_lat = merch_lat - lat
+    delta_long = pl.col("merch_long").radians() - pl.col("long").radians()
+    a = (delta_lat / 2).sin().pow(2) + lat.cos() * merch_lat.cos() * (delta_long / 2).sin().pow(2)
+    return 2 * EARTH_RADIUS_KM * a.sqrt().arcsin()
+
+
+def _trans_hour() -> pl.Expr:
+    return pl.col("trans_date_trans_time").dt.hour()
+
+
+def _trans_weekday() -> pl.Expr:
+    # ISO weekday, 1 is Monday and 7 is Sunday.
+    return pl.col("trans_date_trans_time").dt.weekday()
+
+
+def _cc_txn_count_window(window_seconds: int) -> pl.Expr:
+    return (
+        pl.col("unix_time")
+        .is_not_null()
+        .cast(pl.UInt32)
+        .rolling_sum_by("unix_time", f"{window_seconds}i")
+        .over("cc_num")
+    )
+
+
+def _cc_amt_sum_window(window_seconds: int) -> pl.Expr:
+    return pl.col("amt").rolling_sum_by("unix_time", f"{window_seconds}i").over("cc_num")
+
+
+# Feature column -> (columns it is derived from, expression).
+ROW_FEATURES: dict[str, tuple[tuple[str, ...], Callable[[], pl.Expr]]] = {
+    "customer_age": (("trans_date_trans_time", "dob"), _customer_age),
+    "distance_km": (("lat", "long", "merch_lat", "merch_long"), _distance_km),
+    "trans_hour": (("trans_date_trans_time",), _trans_hour),
+    "trans_weekday": (("trans_date_trans_time",), _trans_weekday),
+}
+# Feature column -> (columns it is derived from, expression for a window length).
+WINDOW_FEATURES: dict[str, tuple[tuple[str, ...], Callable[[int], pl.Expr]]] = {
+    "cc_txn_count_window": (("cc_num", "unix_time"), _cc_txn_count_window),
+    "cc_amt_sum_window": (("cc_num", "unix_time", "amt"), _cc_amt_sum_window),
+}
+# Feature column -> columns it is derived from, in the order the features are appended.
+FEATURES: dict[str, tuple[str, ...]] = {
+    **{name: columns for name, (columns, _) in ROW_FEATURES.items()},
+    **{name: columns for name, (columns, _) in WINDOW_FEATURES.items()},
+}
+
+
+def _check(features: tuple[str, ...]) -> tuple[str, ...]:
+    unknown = [name for name in features if name not in FEATURES]
+    if unknown:
+        raise ValueError(f"Unknown feature(s): {', '.join(unknown)}")
+    return features
+
+
+ENRICHMENT_FEATURES = _check(_split(os.getenv("ENRICHMENT_FEATURES", ""))) or tuple(FEATURES)
+
+
+def required_columns(features: tuple[str, ...] = ENRICHMENT_FEATURES) -> set[str]:
+    """
+    The input columns the given features are derived from.
+    """
+    return {column for name in _check(features) for column in FEATURES[name]}
+
+
+def add_features(
+    frame: pl.DataFrame | pl.LazyFrame,
+    features: tuple[str, ...] = ENRICHMENT_FEATURES,
+    window_seconds: int = WINDOW_SECONDS,
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Append derived feature columns, so models do not recompute them from the refined data.
+
+    All features are added in a single `with_columns`, which Polars evaluates in one
+    pass over the data. The per-card window features are rolling sums over `unix_time`
+    within each `cc_num`, so the rows keep their order.
+
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): The validated data.
+        features (tuple[str, ...]): Keys of FEATURES to add, all by default.
+        window_seconds (int): Length of the per-card window.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The data with the feature columns appended.
+    """
+    _check(features)
+    with stage("enrich") as measured:
+        enriched = frame.with_columns(
+            **{name: _feature_expr(name, window_seconds) for name in features}
+        )
+        if isinstance(enriched, pl.DataFrame):
+            measured.rows = len(enriched)
+        logger.info(f"Added {len(features)} feature column(s): {', '.join(features)}")
+        return enriched
+
+
+def _feature_expr(name: str, window_seconds: int) -> pl.Expr:
+    if name in WINDOW_FEATURES:
+        return WINDOW_FEATURES[name][1](window_seconds)
+    return ROW_FEATURES[name][1]()
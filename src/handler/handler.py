@@ -1,62 +1,879 @@
+import asyncio
+import json
 import logging
+import os
+import posixpath
 import urllib.parse
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, TYPE_CHECKING, cast
 
+import handler.content_index as content_index
+import handler.idempotency as idempotency
+import handler.ledger as ledger
 import handler.log_manager as log_manager
 import handler.storage as storage
-import handler.transform as transform
-import handler.validator as validator
+from handler import startup
 from handler.log_type import LogType
+from handler.metrics import instrumented, stage
+from handler.scratch import scratch
+
+if TYPE_CHECKING:
+    import polars as pl
+
+    import handler.coalescer as coalescer
+    import handler.schemas as schemas
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-REFINEMENT_LOG_KEY = "refinement-log.json"
-QUARANTINE_LOG_KEY = "quarantine-log.json"
+REFINEMENT_LOG_KEY = log_manager.LOG_FILE_KEYS[LogType.REFINEMENT]
+QUARANTINE_LOG_KEY = log_manager.LOG_FILE_KEYS[LogType.QUARANTINE]
+LOG_FILES = ((LogType.REFINEMENT, REFINEMENT_LOG_KEY), (LogType.QUARANTINE, QUARANTINE_LOG_KEY))
+MAX_CONCURRENT_RECORDS = int(os.getenv("MAX_CONCURRENT_RECORDS", "4"))
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "false").lower() == "true"
+IN_MEMORY_IO_ENABLED = os.getenv("IN_MEMORY_IO_ENABLED", "false").lower() == "true"
+LEDGER_ENABLED = os.getenv("LEDGER_ENABLED", "false").lower() == "true"
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "false").lower() == "true"
+ROW_QUARANTINE_ENABLED = os.getenv("ROW_QUARANTINE_ENABLED", "false").lower() == "true"
+MAX_ROW_ERROR_RATE = float(os.getenv("MAX_ROW_ERROR_RATE", "0.01"))
+CONTENT_DEDUP_ENABLED = os.getenv("CONTENT_DEDUP_ENABLED", "false").lower() == "true"
+ASYNC_IO_ENABLED = os.getenv("ASYNC_IO_ENABLED", "false").lower() == "true"
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "false").lower() == "true"
+PREFLIGHT_BYTES = int(os.getenv("PREFLIGHT_KB", "64")) * 1024
+ENRICHMENT_ENABLED = os.getenv("ENRICHMENT_ENABLED", "false").lower() == "true"
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "false").lower() == "true"
+SCRATCH_SIZE_FACTOR = 2
+
+# (log type, object key, key of the earlier output it is a copy of, source object key
+# of a coalesced output)
+LogEntry = tuple[LogType, str, str | None, str | None]
+
+
+def handle_event(event, context) -> dict:
+    """
+    Process every S3 object notification contained in the event.
 
+    SQS messages fail independently and are reported in the batch response, so only
+    the failed ones are retried. Lambda ignores the batch response of direct S3
+    invocations, so there the first error is raised to retry the event.
 
-def handle_event(event, context) -> None:
+    Args:
+        event (dict): S3 event, or SQS event wrapping S3 events.
+        context: Lambda context object.
+
+    Returns:
+        dict: SQS-style batch response listing the messages that failed.
+    """
     logger.debug("Starting event handling")
-    record = event.get("Records", [{}])[0]
-    logger.info(f"Processing record: {record}")
+    records, failed_items = _extract_records(event)
+    for item_identifier, error in process_records(records).items():
+        failed_items.setdefault(item_identifier, error)
+
+    if not _is_sqs_event(event) and failed_items:
+        raise next(iter(failed_items.values()))
+
+    message_ids = [record.get("messageId") for record in event.get("Records", [])]
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id}
+            for message_id in message_ids
+            if message_id in failed_items
+        ]
+    }
+
+
+def process_records(
+    records: list[tuple[str, idempotency.ObjectIdentity]],
+) -> dict[str, Exception]:
+    """
+    Refine a batch of objects.
+
+    Records are processed concurrently on a bounded worker pool and succeed or
+    fail independently of each other. Log entries of all records are written in
+    one conditional update per log file once the records are processed, after
+    which successful records are marked as processed so re-deliveries are skipped.
+    With COALESCE_ENABLED the data of the records is written to shared Parquet files,
+    the last of which are flushed before the log entries are written. The transfer
+    metrics are collected per batch, so long-running callers do not accumulate them.
+
+    Args:
+        records (list[tuple[str, ObjectIdentity]]): (item identifier, object identity)
+            tuples; several objects may share an item identifier.
+
+    Returns:
+        dict[str, Exception]: The item identifiers of the records that failed, with the
+            first error of each.
+    """
+    if ASYNC_IO_ENABLED:
+        return asyncio.run(process_records_async(records))
+
+    logger.info(f"Processing {len(records)} record(s)")
+    storage.reset_transfer_metrics()
+
+    failed_items: dict[str, Exception] = {}
+    pending_log_entries: list[tuple[str, list[LogEntry]]] = []
+    max_workers = max(1, min(MAX_CONCURRENT_RECORDS, len(records)))
+    refined: list[tuple[str, idempotency.ObjectIdentity]] = []
+    coalescing = _start_coalescing() if COALESCE_ENABLED else None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for item_identifier, identity in records:
+            log_entries: list[LogEntry] = []
+            pending_log_entries.append((item_identifier, log_entries))
+            futures.append(
+                (
+                    item_identifier,
+                    identity,
+                    executor.submit(_process_record, identity, log_entries, coalescing),
+                )
+            )
+        for item_identifier, identity, future in futures:
+            try:
+                if future.result():
+                    refined.append((item_identifier, identity))
+            except Exception as e:
+                logger.error(f"Record {item_identifier} failed: {e}")
+                failed_items.setdefault(item_identifier, e)
+
+    if coalescing is not None:
+        _add_failures(failed_items, _finish_coalescing(coalescing, records, pending_log_entries))
+    _add_failures(failed_items, _flush_log_entries(pending_log_entries))
+
+    for item_identifier, identity in refined:
+        if IDEMPOTENCY_ENABLED and item_identifier not in failed_items:
+            _mark_processed(identity)
+
+    _log_transfers()
+    logger.info(f"Processed {len(records)} record(s), {len(failed_items)} item(s) failed")
+    return failed_items
+
+
+async def process_records_async(
+    records: list[tuple[str, idempotency.ObjectIdentity]],
+) -> dict[str, Exception]:
+    """
+    Asyncio variant of process_records that overlaps independent I/O instead of
+    waiting for it: both log files are prefetched while the records are processed,
+    the log files are updated concurrently and processed markers are written
+    concurrently. The steps of a record stay in order, and log entries are only
+    written once the outputs they refer to are uploaded.
+
+    Args:
+        records (list[tuple[str, ObjectIdentity]]): (item identifier, object identity)
+            tuples; several objects may share an item identifier.
+
+    Returns:
+        dict[str, Exception]: The item identifiers of the records that failed, with the
+            first error of each.
+    """
+    logger.info(f"Processing {len(records)} record(s) asynchronously")
+    storage.reset_transfer_metrics()
+    # The blocking boto3 and Polars calls run on worker threads: one per concurrent
+    # record plus one per prefetched log file.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RECORDS + len(LOG_FILES))
+    )
+    prefetches = {}
+    if not LEDGER_ENABLED:
+        prefetches = {
+            log_key: asyncio.create_task(log_manager.prefetch_log_file(log_key))
+            for _, log_key in LOG_FILES
+        }
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_RECORDS)
+    coalescing = _start_coalescing() if COALESCE_ENABLED else None
+
+    async def process(identity: idempotency.ObjectIdentity, log_entries: list[LogEntry]) -> bool:
+        async with semaphore:
+            return await asyncio.to_thread(_process_record, identity, log_entries, coalescing)
+
+    pending_log_entries: list[tuple[str, list[LogEntry]]] = [
+        (item_identifier, []) for item_identifier, _ in records
+    ]
+    results = await asyncio.gather(
+        *(
+            process(identity, log_entries)
+            for (_, identity), (_, log_entries) in zip(records, pending_log_entries)
+        ),
+        return_exceptions=True,
+    )
+
+    failed_items: dict[str, Exception] = {}
+    refined: list[tuple[str, idempotency.ObjectIdentity]] = []
+    for (item_identifier, identity), result in zip(records, results):
+        if isinstance(result, Exception):
+            logger.error(f"Record {item_identifier} failed: {result}")
+            failed_items.setdefault(item_identifier, result)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result:
+            refined.append((item_identifier, identity))
+
+    if coalescing is not None:
+        _add_failures(
+            failed_items,
+            await asyncio.to_thread(_finish_coalescing, coalescing, records, pending_log_entries),
+        )
+    _add_failures(failed_items, await _flush_log_entries_async(pending_log_entries, prefetches))
+
+    if IDEMPOTENCY_ENABLED:
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(_mark_processed, identity)
+                for item_identifier, identity in refined
+                if item_identifier not in failed_items
+            )
+        )
+
+    _log_transfers()
+    logger.info(f"Processed {len(records)} record(s), {len(failed_items)} item(s) failed")
+    return failed_items
+
+
+def _log_transfers() -> None:
+    transfers = storage.drain_transfer_metrics()
+    logger.info(
+        f"Transferred {sum(t.size_bytes for t in transfers)} bytes in {len(transfers)} transfer(s)"
+    )
+
+
+def _is_sqs_event(event) -> bool:
+    return any(record.get("eventSource") == "aws:sqs" for record in event.get("Records", []))
+
+
+def _extract_records(
+    event,
+) -> tuple[list[tuple[str, idempotency.ObjectIdentity]], dict[str, Exception]]:
+    """
+    Flatten the event into (item identifier, object identity) tuples.
+
+    SQS records carry an S3 event in their body and are identified by their
+    message ID; a malformed message is returned as failed and the other messages
+    are still processed, and the s3:TestEvent S3 sends when notifications are
+    configured is dropped. Plain S3 records are identified by their object key,
+    and a malformed one fails the whole event.
 
-    bucket_name = record.get("s3", {}).get("bucket", {}).get("name")
-    object_key = urllib.parse.unquote_plus(record.get("s3", {}).get("object", {}).get("key"))
+    Returns:
+        tuple: The records, and the errors of the SQS messages that are malformed.
+    """
+    records = []
+    failed_items: dict[str, Exception] = {}
+    for record in event.get("Records", [{}]):
+        logger.info(f"Processing record: {record}")
+
+        if record.get("eventSource") != "aws:sqs":
+            records.append(_to_record(record))
+            continue
+
+        message_id = record.get("messageId")
+        try:
+            body = json.loads(record.get("body") or "{}")
+            if body.get("Event") == "s3:TestEvent":
+                logger.info(f"Dropping S3 test event in message {message_id}")
+                continue
+            records.extend(
+                [_to_record(s3_record, message_id) for s3_record in body.get("Records", [{}])]
+            )
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Message {message_id} is not a valid S3 event: {e}")
+            failed_items[message_id] = e
+
+    return records, failed_items
+
+
+def _to_record(
+    s3_record: dict, item_identifier: str | None = None
+) -> tuple[str, idempotency.ObjectIdentity]:
+    s3_object = s3_record.get("s3", {}).get("object", {})
+    bucket_name = s3_record.get("s3", {}).get("bucket", {}).get("name")
+    object_key = urllib.parse.unquote_plus(s3_object.get("key") or "")
 
     if not bucket_name or not object_key:
         logger.error("Missing bucket name or object key in event")
         raise ValueError("Invalid event structure")
 
-    file_path = None
+    identity = idempotency.ObjectIdentity(
+        bucket_name,
+        object_key,
+        s3_object.get("versionId"),
+        s3_object.get("eTag"),
+        s3_object.get("size"),
+    )
+    return item_identifier or object_key, identity
+
+
+def _add_failures(failed_items: dict[str, Exception], errors: dict[str, Exception]) -> None:
+    # The first error of an item is the one reported.
+    for item_identifier, error in errors.items():
+        failed_items.setdefault(item_identifier, error)
+
+
+def _process_record(
+    identity: idempotency.ObjectIdentity,
+    log_entries: list[LogEntry],
+    coalescing: "coalescer.Coalescer | None" = None,
+) -> bool:
+    """
+    Download, validate, transform and upload a single object, or hand its validated
+    data to `coalescing` to be written together with other objects.
+    On failure the raw file is moved to quarantine and the error is re-raised.
+    Log entries that are not written right away are added to `log_entries`; if one
+    cannot be written the record fails without quarantining the refined file.
+
+    Returns:
+        bool: True if the object was refined, False if it was skipped as a duplicate.
+    """
+    object_key = identity.key
+    if IDEMPOTENCY_ENABLED and idempotency.is_processed(identity):
+        logger.info(f"Skipping already refined file {object_key}")
+        return False
 
     try:
-        file_path = storage.download_file_from_s3(bucket_name, object_key)
-        logger.info(f"File downloaded to: {file_path}")
+        if IN_MEMORY_IO_ENABLED:
+            outputs = _refine(identity, None, coalescing)
+        else:
+            with scratch.task(os.path.basename(object_key), _scratch_bytes(identity)) as work_dir:
+                outputs = _refine(identity, work_dir, coalescing)
+    except Exception as e:
+        logger.exception(f"Error processing file {object_key}: {e}")
+        _quarantine(identity, log_entries)
+        raise
 
-        df = validator.load_and_validate_csv(file_path)
-        logger.info(f"File validated: {file_path}")
+    for log_type, key, alias_of, _ in outputs:
+        _log_entry(log_type, key, log_entries, alias_of)
+    return True
 
-        parquet_file_path = transform.transform_dataframe_to_parquet(df, "data.parquet")
-        logger.info(f"File transformed to Parquet: {parquet_file_path}")
 
-        refined_key = object_key.replace("raw/", "refined/").replace(".csv", ".parquet")
+def _refine(
+    identity: idempotency.ObjectIdentity,
+    work_dir: str | None,
+    coalescing: "coalescer.Coalescer | None" = None,
+) -> list[LogEntry]:
+    """
+    Refine a single object, through files in `work_dir` or, if it is None, in memory.
+    Content that was refined before is copied from its earlier outputs instead.
+    With `coalescing` the validated data is buffered there and written later.
+
+    Returns:
+        list[LogEntry]: The S3 object keys of the uploaded Parquet files, with the log
+            they belong in.
+    """
+    # Polars is imported on first use, so cold starts and rejected events do not pay for it.
+    with startup.timed("import_pipeline"):
+        import polars as pl
+
+        import handler.transform as transform
+        import handler.validator as validator
+
+    object_key = identity.key
+    refined_key = _refined_key(object_key)
+    outputs: list[LogEntry] = []
+
+    schema = None
+    if PREFLIGHT_ENABLED and not identity.local_path:
+        # A file with the wrong layout is rejected before it is transferred.
+        schema = _preflight(identity)
+
+    content_ids: list[str] = []
+    if CONTENT_DEDUP_ENABLED and not identity.local_path:
+        # The checksum S3 stored spares even the download of known content.
+        schema = schema or _resolve_schema(identity, None)
+        if content_id := _checksum_content_id(identity, schema):
+            content_ids.append(content_id)
+            if aliases := _alias_known_content(identity, content_id):
+                return aliases
+
+    source = _fetch(identity, work_dir)
+    schema = schema or _resolve_schema(identity, source)
+    if CONTENT_DEDUP_ENABLED and source is not None:
+        content_id = content_index.hash_content_id(source, _output_description(schema))
+        if content_id not in content_ids:
+            content_ids.append(content_id)
+            if aliases := _alias_known_content(identity, content_id):
+                return aliases
+
+    split_rows = ROW_QUARANTINE_ENABLED and not STREAMING_ENABLED
+    frame = _load(identity, source, schema, validate=not split_rows)
+    if split_rows:
+        frame, invalid_rows = validator.split_invalid_rows(
+            cast("pl.DataFrame", frame), MAX_ROW_ERROR_RATE, schema.rules
+        )
+        if not invalid_rows.is_empty():
+            rows_key = object_key.replace("raw/", "quarantine/").replace(".csv", ".parquet")
+            storage.upload_fileobj_to_s3(
+                rows_key, transform.transform_to_parquet_buffer(invalid_rows)
+            )
+            logger.info(f"{len(invalid_rows)} invalid row(s) moved to quarantine: {rows_key}")
+            outputs.append((LogType.QUARANTINE, rows_key, None, None))
+    logger.info(f"File validated: {object_key}")
+    if ENRICHMENT_ENABLED:
+        frame = _enrich(frame, schema)
+    if transform.PARQUET_OPTIONS.compact:
+        # The types come from the schema, so every file of the schema shares them.
+        frame = transform.compact_frame(frame, schema.compact_types)
+    if coalescing is not None:
+        # Small files are read eagerly anyway; a scanned one is materialized here.
+        coalescing.add(identity, frame.lazy().collect(), posixpath.dirname(refined_key))
+        return outputs
+
+    refined_keys = [refined_key]
+    if _partitioned(schema.columns, f"Schema {schema.id}"):
+        refined_keys = _upload_partitions(frame, refined_key, work_dir)
+    elif work_dir is None:
+        parquet_buffer = transform.transform_to_parquet_buffer(frame)
+        logger.info("File transformed to in-memory Parquet")
+        storage.upload_fileobj_to_s3(refined_key, parquet_buffer)
+    else:
+        parquet_filename = os.path.basename(refined_key)
+        if isinstance(frame, pl.LazyFrame):
+            parquet_file_path = transform.sink_lazyframe_to_parquet(
+                frame, parquet_filename, local_dir=work_dir
+            )
+        else:
+            parquet_file_path = transform.transform_dataframe_to_parquet(
+                frame, parquet_filename, local_dir=work_dir
+            )
+        logger.info(f"File transformed to Parquet: {parquet_file_path}")
         storage.upload_file_to_s3(refined_key, parquet_file_path)
 
-        logger.info(f"File uploaded to refined bucket: {refined_key}")
-        log_data = log_manager.download_log_file(REFINEMENT_LOG_KEY)
-        log_data = log_manager.update_log(log_data, LogType.REFINEMENT, refined_key)
-        log_manager.upload_log_file(REFINEMENT_LOG_KEY, log_data)
+    logger.info(f"File uploaded to refined bucket: {refined_key}")
+    # Outputs that left rows behind in quarantine are not a complete copy of the content.
+    if content_ids and not outputs:
+        _index_content(content_ids, object_key, refined_keys)
+    return [*((LogType.REFINEMENT, key, None, None) for key in refined_keys), *outputs]
+
+
+def _fetch(identity: idempotency.ObjectIdentity, work_dir: str | None) -> "str | IO[bytes] | None":
+    """
+    Download the object to `work_dir` or, with IN_MEMORY_IO_ENABLED, into memory.
+
+    Returns:
+        str | IO[bytes] | None: The local path or buffer, the path of a local object as
+            is, or None if the object is to be read with ranged GETs: because it is large
+            or because it did not fit the scratch budget (`work_dir` is None).
+    """
+    import handler.ranged_reader as ranged_reader
+
+    bucket_name, object_key = identity.bucket, identity.key
+    if identity.local_path:
+        return identity.local_path
+    if not STREAMING_ENABLED and (identity.size or 0) >= ranged_reader.RANGED_READ_THRESHOLD:
+        return None
+    if work_dir is None and not IN_MEMORY_IO_ENABLED:
+        logger.info(f"{object_key} does not fit the scratch budget, streaming it in ranges")
+        return None
+    if work_dir is None:
+        buffer = storage.download_fileobj_from_s3(bucket_name, object_key)
+        logger.info(f"File downloaded into memory: {object_key}")
+        return buffer
+    local_path = storage.download_file_from_s3(bucket_name, object_key, work_dir)
+    logger.info(f"File downloaded to: {local_path}")
+    return local_path
+
+
+def _enrich(
+    frame: "pl.DataFrame | pl.LazyFrame", schema: "schemas.SchemaVersion"
+) -> "pl.DataFrame | pl.LazyFrame":
+    """
+    Append the derived feature columns, unless the schema lacks their input columns.
+    """
+    import handler.features as features
+
+    missing = features.required_columns() - set(schema.columns)
+    if missing:
+        logger.warning(f"Schema {schema.id} has no {', '.join(sorted(missing))}, not enriched")
+        return frame
+    return features.add_features(frame)
+
+
+def _preflight(identity: idempotency.ObjectIdentity) -> "schemas.SchemaVersion":
+    """
+    Read the first PREFLIGHT_BYTES of the object with a ranged GET, route it to its
+    schema and check its header and sample rows against it.
+
+    Returns:
+        schemas.SchemaVersion: The schema the object is routed to.
+    """
+    import handler.validator as validator
+
+    sample = storage.get_object_range(identity.bucket, identity.key, 0, PREFLIGHT_BYTES - 1)
+    schema = _resolve_schema(identity, sample)
+    # A short read means the range covered the whole object.
+    validator.preflight_csv(sample, schema, complete=len(sample) < PREFLIGHT_BYTES)
+    return schema
+
+
+def _resolve_schema(
+    identity: idempotency.ObjectIdentity, source: "str | bytes | IO[bytes] | None"
+) -> "schemas.SchemaVersion":
+    """
+    Route the object to a schema by its key or, if that is ambiguous, by its header,
+    which is read from the start of the object if it is not fetched.
+    """
+    import handler.schemas as schemas
+
+    def read_header() -> list[str]:
+        if source is None:
+            start = storage.get_object_range(
+                identity.bucket, identity.key, 0, schemas.HEADER_SNIFF_BYTES - 1
+            )
+            return schemas.read_header(start)
+        return schemas.read_header(source)
+
+    schema = schemas.get_registry().resolve(identity.key, read_header)
+    logger.info(f"{identity.key} is read with schema {schema.id}")
+    return schema
+
+
+def _load(
+    identity: idempotency.ObjectIdentity,
+    source: "str | IO[bytes] | None",
+    schema: "schemas.SchemaVersion",
+    validate: bool,
+) -> "pl.DataFrame | pl.LazyFrame":
+    """
+    Load the fetched object, or read it with ranged GETs if `source` is None.
+    Without `validate` the data is loaded as is (not when streaming); validated
+    ranged reads are scanned, so their parts are written as they arrive.
+    """
+    import handler.ranged_reader as ranged_reader
+    import handler.validator as validator
+
+    if source is None:
+        if validate:
+            return ranged_reader.scan_csv_ranges(
+                identity.bucket, identity.key, identity.size, schema
+            )
+        return ranged_reader.read_csv_ranges(identity.bucket, identity.key, identity.size, schema)
+    if STREAMING_ENABLED:
+        return validator.scan_and_validate_csv(source, schema)
+    if validate:
+        return validator.load_and_validate_csv(source, schema)
+    return validator.read_csv(source, schema)
+
+
+def _alias_known_content(
+    identity: idempotency.ObjectIdentity, content_id: str
+) -> list[LogEntry] | None:
+    """
+    Copy the refined outputs of identical content refined before to the keys of this
+    object, server-side. Only outputs that still have the ETag they were indexed with
+    are copied, the refined keys of an object are overwritten when it is re-uploaded.
+    A failed lookup or copy is logged and the object is refined instead.
+
+    Returns:
+        list[LogEntry] | None: The copied outputs with the keys they alias, or None if
+            the content is unknown or could not be copied.
+    """
+    try:
+        entry = content_index.lookup(content_id)
     except Exception as e:
-        logger.exception(f"Error processing file {object_key}: {e}")
+        logger.warning(f"Could not look up the content of {identity.key}, refining: {e}")
+        return None
+    if entry is None:
+        return None
+
+    refined_key = _refined_key(identity.key)
+    source_refined_key = _refined_key(entry["object_key"])
+    outputs: list[LogEntry] = []
+    try:
+        for source_key, etag in entry["refined_etags"].items():
+            key = content_index.alias_key(refined_key, source_refined_key, source_key)
+            if key == source_key:
+                # A re-upload under the same key already has its outputs in place.
+                if storage.get_object_etag(key) != etag:
+                    raise ValueError(f"{key} changed since it was indexed")
+            else:
+                storage.copy_object_to_refined_bucket(
+                    cast(str, storage.REFINED_BUCKET_NAME), source_key, key, if_match=etag
+                )
+            outputs.append((LogType.REFINEMENT, key, source_key, None))
+    except Exception as e:
+        logger.warning(f"Could not copy the outputs of {entry['object_key']}, refining: {e}")
+        return None
+
+    logger.info(f"{identity.key} has the same content as {entry['object_key']}, outputs copied")
+    return outputs
+
+
+def _checksum_content_id(
+    identity: idempotency.ObjectIdentity, schema: "schemas.SchemaVersion"
+) -> str | None:
+    """
+    Derive the content ID from the checksum S3 stored for the object. Deduplication is
+    an optimization, so a failure is logged and the object is refined normally.
+    """
+    try:
+        return content_index.checksum_content_id(identity, _output_description(schema))
+    except Exception as e:
+        logger.warning(f"Could not read the checksum of {identity.key}, refining: {e}")
+        return None
+
+
+def _output_description(schema: "schemas.SchemaVersion") -> str:
+    """
+    Describe what the refined outputs of an object depend on besides its content.
+    """
+    import handler.features as features
+    import handler.transform as transform
+
+    enrichment = (
+        f"{features.ENRICHMENT_FEATURES}@{features.WINDOW_SECONDS}s" if ENRICHMENT_ENABLED else ""
+    )
+    return f"{schema.id};{transform.PARQUET_OPTIONS};enrichment={enrichment}"
+
+
+def _index_content(content_ids: list[str], object_key: str, refined_keys: list[str]) -> None:
+    """
+    Index the refined outputs by content, with their current ETags. A failure only
+    costs a full refinement of identical content later, so it is logged rather than
+    failing the record.
+    """
+    try:
+        refined_etags = {key: storage.get_object_etag(key) for key in refined_keys}
+        content_index.record(content_ids, object_key, refined_etags)
+    except Exception as e:
+        logger.warning(f"Could not index the content of {object_key}: {e}")
+
+
+def _start_coalescing() -> "coalescer.Coalescer":
+    import handler.coalescer as coalescer
+
+    return coalescer.Coalescer(_write_coalesced)
+
+
+def _write_coalesced(frame: "pl.DataFrame", output_key: str) -> list[str]:
+    """
+    Write the data of several objects to `output_key`, or to one file per partition.
+
+    Returns:
+        list[str]: The S3 object keys of the uploaded files.
+    """
+    import handler.transform as transform
+
+    # The data of every object was compacted by _refine already.
+    if _partitioned(frame.columns, output_key):
+        return _upload_partitions(frame, output_key, None)
+    storage.upload_fileobj_to_s3(output_key, transform.transform_to_parquet_buffer(frame))
+    logger.info(f"Coalesced file uploaded to refined bucket: {output_key}")
+    return [output_key]
+
+
+def _finish_coalescing(
+    coalescing: "coalescer.Coalescer",
+    records: list[tuple[str, idempotency.ObjectIdentity]],
+    pending: list[tuple[str, list[LogEntry]]],
+) -> dict[str, Exception]:
+    """
+    Write the remaining buffered data and log the coalesced outputs once per source.
 
-        if file_path:
-            quarantine_key = object_key.replace("raw/", "quarantine/")
-            storage.upload_file_to_s3(quarantine_key, file_path)
+    Returns:
+        dict[str, Exception]: Item identifiers whose data could not be written or logged.
+    """
+    coalescing.flush()
+    failed_items: dict[str, Exception] = {}
+    for (item_identifier, identity), (_, log_entries) in zip(records, pending):
+        if identity in coalescing.failures:
+            failed_items.setdefault(item_identifier, coalescing.failures[identity])
+        try:
+            for key in coalescing.outputs.get(identity, []):
+                _log_entry(LogType.REFINEMENT, key, log_entries, source=identity.key)
+        except Exception as e:
+            logger.exception(f"Error logging coalesced output of {identity.key}: {e}")
+            failed_items.setdefault(item_identifier, e)
+    return failed_items
 
-            logger.info(f"File moved to quarantine: {quarantine_key}")
-            quarantine_log_data = log_manager.download_log_file(QUARANTINE_LOG_KEY)
-            quarantine_log_data = log_manager.update_log(
-                quarantine_log_data, LogType.QUARANTINE, quarantine_key
+
+def _scratch_bytes(identity: idempotency.ObjectIdentity) -> int:
+    # The CSV plus its Parquet output, which is practically always smaller than the CSV.
+    # Objects read with ranged GETs never touch the disk, but their output still does.
+    return SCRATCH_SIZE_FACTOR * identity.size if identity.size else 0
+
+
+def _refined_key(object_key: str) -> str:
+    return object_key.replace("raw/", "refined/").replace(".csv", ".parquet")
+
+
+def _partitioned(columns: Iterable[str], description: str) -> bool:
+    """
+    Whether the output is split into partitions: only if partition keys are configured
+    and the data has the columns they are derived from.
+    """
+    import handler.transform as transform
+
+    if not transform.PARQUET_OPTIONS.partition_by:
+        return False
+    missing = transform.partition_input_columns(transform.PARQUET_OPTIONS) - set(columns)
+    if missing:
+        logger.warning(f"{description} has no {', '.join(sorted(missing))}, not partitioned")
+        return False
+    return True
+
+
+def _upload_partitions(
+    frame: "pl.DataFrame | pl.LazyFrame", refined_key: str, work_dir: str | None
+) -> list[str]:
+    """
+    Write and upload one Parquet file per hive-style partition. The partition path is
+    inserted in front of the file name, so the files of all objects in a directory of
+    the refined prefix share one partitioned table.
+
+    Returns:
+        list[str]: The S3 object keys of the uploaded files.
+    """
+    import handler.transform as transform
+
+    directory, filename = posixpath.split(refined_key)
+    partitions = transform.partition_frame(frame, transform.PARQUET_OPTIONS)
+    refined_keys = []
+    for partition_path, partition in partitions.items():
+        key = posixpath.join(directory, partition_path, filename)
+        if work_dir is None:
+            storage.upload_fileobj_to_s3(key, transform.transform_to_parquet_buffer(partition))
+        else:
+            local_name = f"{partition_path.replace('/', '_')}_{filename}"
+            local_path = transform.transform_dataframe_to_parquet(
+                partition, local_name, local_dir=work_dir
             )
-            log_manager.upload_log_file(QUARANTINE_LOG_KEY, quarantine_log_data)
+            storage.upload_file_to_s3(key, local_path)
+        refined_keys.append(key)
+    logger.info(f"{len(refined_keys)} partition(s) written for {refined_key}")
+    return refined_keys
 
-        raise
+
+def _mark_processed(identity: idempotency.ObjectIdentity) -> None:
+    """
+    Mark a refined object as processed. A failure only costs a re-run on re-delivery,
+    so it is logged rather than failing the record.
+    """
+    try:
+        idempotency.mark_processed(identity, _refined_key(identity.key))
+    except Exception as e:
+        logger.warning(f"Could not mark {identity.key} as processed: {e}")
+
+
+def _quarantine(identity: idempotency.ObjectIdentity, log_entries: list[LogEntry]) -> None:
+    """
+    Move the raw object to quarantine with a server-side copy, or upload it if it is a
+    local file, and log it. Works regardless of whether the object was downloaded;
+    quarantine errors are logged so the original processing error is the one reported.
+    """
+    object_key = identity.key
+    quarantine_key = object_key.replace("raw/", "quarantine/")
+    try:
+        if identity.local_path:
+            storage.upload_file_to_s3(quarantine_key, identity.local_path)
+        else:
+            storage.copy_object_to_refined_bucket(identity.bucket, object_key, quarantine_key)
+
+        logger.info(f"File moved to quarantine: {quarantine_key}")
+        _log_entry(LogType.QUARANTINE, quarantine_key, log_entries)
+    except Exception as e:
+        logger.exception(f"Error quarantining file {object_key}: {e}")
+
+
+def _log_entry(
+    log_type: LogType,
+    object_key: str,
+    log_entries: list[LogEntry],
+    alias_of: str | None = None,
+    source: str | None = None,
+) -> None:
+    """
+    Record the outcome right away in the append-only ledger, or queue it for the
+    batched update of the JSON log file.
+    """
+    if LEDGER_ENABLED:
+        ledger.append_entry(log_type, object_key, alias_of, source)
+    else:
+        log_entries.append((log_type, object_key, alias_of, source))
+
+
+@instrumented("log_update")
+def _flush_log_entries(pending: list[tuple[str, list[LogEntry]]]) -> dict[str, Exception]:
+    """
+    Write the queued entries with one conditional update per log file.
+
+    Returns:
+        dict[str, Exception]: Item identifiers whose entries could not be written.
+    """
+    failed_items: dict[str, Exception] = {}
+    for log_type, log_key in LOG_FILES:
+        entries = _log_file_entries(pending, log_type)
+        if not entries:
+            continue
+
+        try:
+            log_manager.append_log_entries(
+                log_key,
+                log_type,
+                [key for _, key, _, _ in entries],
+                aliases={key: alias_of for _, key, alias_of, _ in entries if alias_of},
+                sources=[source for _, _, _, source in entries],
+            )
+        except Exception as e:
+            logger.exception(f"Error updating log file {log_key}: {e}")
+            for item_identifier, _, _, _ in entries:
+                failed_items.setdefault(item_identifier, e)
+
+    return failed_items
+
+
+async def _flush_log_entries_async(
+    pending: list[tuple[str, list[LogEntry]]], prefetches: dict[str, asyncio.Task]
+) -> dict[str, Exception]:
+    """
+    Asyncio variant of _flush_log_entries that updates the log files concurrently,
+    starting from their prefetched versions.
+
+    Returns:
+        dict[str, Exception]: Item identifiers whose entries could not be written.
+    """
+
+    async def flush(log_type: LogType, log_key: str) -> dict[str, Exception]:
+        prefetched = None
+        if log_key in prefetches:
+            try:
+                prefetched = await prefetches[log_key]
+            except Exception as e:
+                logger.warning(f"Prefetching log file {log_key} failed, reading it again: {e}")
+
+        entries = _log_file_entries(pending, log_type)
+        if not entries:
+            return {}
+
+        try:
+            await log_manager.append_log_entries_async(
+                log_key,
+                log_type,
+                [key for _, key, _, _ in entries],
+                aliases={key: alias_of for _, key, alias_of, _ in entries if alias_of},
+                prefetched=prefetched,
+                sources=[source for _, _, _, source in entries],
+            )
+            return {}
+        except Exception as e:
+            logger.exception(f"Error updating log file {log_key}: {e}")
+            return {item_identifier: e for item_identifier, _, _, _ in entries}
+
+    with stage("log_update"):
+        failed = await asyncio.gather(
+            *(flush(log_type, log_key) for log_type, log_key in LOG_FILES)
+        )
+    failed_items: dict[str, Exception] = {}
+    for errors in failed:
+        _add_failures(failed_items, errors)
+    return failed_items
+
+
+def _log_file_entries(
+    pending: list[tuple[str, list[LogEntry]]], log_type: LogType
+) -> list[tuple[str, str, str | None, str | None]]:
+    # (item identifier, object key, alias of, source) of all queued entries of one log file.
+    return [
+        (item_identifier, object_key, alias_of, source)
+        for item_identifier, log_entries in pending
+        for entry_type, object_key, alias_of, source in log_entries
+        if entry_type == log_type
+    ]
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from handler.storage import object_exists, put_bytes_to_s3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+IDEMPOTENCY_PREFIX = "idempotency"
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+IDEMPOTENCY_CACHE_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_CACHE_TTL_SECONDS", "3600"))
+
+
+@dataclass(frozen=True)
+class ObjectIdentity:
+    """
+    Identifies one version of a raw object as announced by its S3 event.
+    Objects of a local backfill carry the path of their file instead of an S3 location.
+    """
+
+    bucket: str
+    key: str
+    version_id: str | None = None
+    etag: str | None = None
+    size: int | None = field(default=None, compare=False)
+    local_path: str | None = field(default=None, compare=False)
+
+    @property
+    def is_versioned(self) -> bool:
+        """
+        Whether the identity pins down the object's content. Without an ETag or version
+        ID a re-upload under the same key cannot be told apart from a re-delivery.
+        """
+        return bool(self.etag or self.version_id)
+
+    @property
+    def digest(self) -> str:
+        parts = (self.bucket, self.key, self.version_id or "", self.etag or "")
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time to live.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl_seconds
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Lives as long as the container, so warm invocations skip duplicates without any S3 call.
+_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL_SECONDS)
+
+
+def is_processed(identity: ObjectIdentity) -> bool:
+    """
+    Check whether this version of the object was already refined, first in the
+    in-memory cache and then through its persistent marker object.
+
+    Args:
+        identity (ObjectIdentity): The object version to check.
+
+    Returns:
+        bool: True if the object version was already refined.
+    """
+    if not identity.is_versioned:
+        return False
+    if identity.digest in _cache:
+        logger.info(f"{identity.key} found in idempotency cache")
+        return True
+    if object_exists(_marker_key(identity)):
+        logger.info(f"{identity.key} found in idempotency markers")
+        _cache.add(identity.digest)
+        return True
+    return False
+
+
+def mark_processed(identity: ObjectIdentity, refined_key: str) -> None:
+    """
+    Record that this version of the object was refined, in the cache and as a marker object.
+
+    Args:
+        identity (ObjectIdentity): The object version that was refined.
+        refined_key (str): The S3 object key of the refined output.
+    """
+    if not identity.is_versioned:
+        return
+    marker = {
+        "bucket": identity.bucket,
+        "key": identity.key,
+        "version_id": identity.version_id,
+        "etag": identity.etag,
+        "refined_key": refined_key,
+        "timestamp": datetime.now().isoformat(),
+    }
+    put_bytes_to_s3(_marker_key(identity), json.dumps(marker).encode())
+    _cache.add(identity.digest)
+
+
+def _marker_key(identity: ObjectIdentity) -> str:
+    return f"{IDEMPOTENCY_PREFIX}/{identity.digest}.json"
@@ -0,0 +1,140 @@
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from handler.log_type import LogType
+from handler.storage import (
+    MAX_CONCURRENCY,
+    delete_objects_from_s3,
+    get_bytes_from_s3,
+    list_object_keys,
+    put_bytes_to_s3,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LEDGER_PREFIX = "ledger"
+
+# Layout in the refined bucket:
+#   ledger/<log type>/records/dt=<date>/hour=<hour>/<timestamp>-<id>.json   one per entry
+#   ledger/<log type>/segments/dt=<date>/segment-<timestamp>-<id>.jsonl     compacted entries
+# Records are immutable and uniquely named, so any number of writers can append concurrently.
+
+
+def append_entry(
+    log_type: LogType, object_key: str, alias_of: str | None = None, source: str | None = None
+) -> dict:
+    """
+    Append an entry to the ledger by writing it as its own immutable record.
+
+    Args:
+        log_type (LogType): The ledger to append to.
+        object_key (str): The S3 object key (path) the entry refers to.
+        alias_of (str | None): The output the object is a copy of, if it was copied
+            from identical content.
+        source (str | None): The source object, if the output was coalesced from
+            several objects.
+
+    Returns:
+        dict: The appended entry.
+    """
+    now = datetime.now()
+    entry = {"id": uuid.uuid4().hex, "timestamp": now.isoformat(), "file": object_key}
+    if alias_of:
+        entry["alias_of"] = alias_of
+    if source:
+        entry["source"] = source
+    record_key = (
+        f"{_records_prefix(log_type, now.date())}hour={now:%H}/"
+        f"{now:%Y%m%dT%H%M%S%f}-{entry['id']}.json"
+    )
+    put_bytes_to_s3(record_key, json.dumps(entry).encode())
+    logger.info(f"Ledger entry for {object_key} written to {record_key}")
+    return entry
+
+
+def compact_ledger(log_type: LogType, day: date) -> str | None:
+    """
+    Merge all records of one day into a single JSONL segment and delete the records.
+
+    Readers de-duplicate entries by ID, so an entry that is briefly present both as a
+    record and in a segment is only reported once.
+
+    Args:
+        log_type (LogType): The ledger to compact.
+        day (date): The date partition to compact.
+
+    Returns:
+        str | None: The key of the new segment, or None if there was nothing to compact.
+    """
+    record_keys = list_object_keys(_records_prefix(log_type, day))
+    if not record_keys:
+        logger.info(f"No {log_type.value} ledger records to compact for {day}")
+        return None
+
+    entries = sorted(_read_entries(record_keys), key=lambda entry: entry["timestamp"])
+    segment_key = (
+        f"{LEDGER_PREFIX}/{log_type.value}/segments/dt={day.isoformat()}/"
+        f"segment-{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex}.jsonl"
+    )
+    put_bytes_to_s3(segment_key, "".join(json.dumps(entry) + "\n" for entry in entries).encode())
+    delete_objects_from_s3(record_keys)
+
+    logger.info(f"Compacted {len(record_keys)} {log_type.value} record(s) into {segment_key}")
+    return segment_key
+
+
+def compact_ledgers(day: date) -> list[str]:
+    """
+    Compact the given day of every ledger.
+
+    Returns:
+        list[str]: The keys of the new segments.
+    """
+    segment_keys = [compact_ledger(log_type, day) for log_type in LogType]
+    return [key for key in segment_keys if key]
+
+
+def read_ledger(log_type: LogType, start: date | None = None, end: date | None = None) -> list:
+    """
+    Read the merged view of compacted segments and not yet compacted records.
+
+    Args:
+        log_type (LogType): The ledger to read.
+        start (date | None): First date partition to include, unbounded if None.
+        end (date | None): Last date partition to include, unbounded if None.
+
+    Returns:
+        list: The entries, ordered by timestamp.
+    """
+    keys = [
+        key
+        for key in list_object_keys(f"{LEDGER_PREFIX}/{log_type.value}/")
+        if _in_range(_partition_date(key), start, end)
+    ]
+    entries = {entry["id"]: entry for entry in _read_entries(keys)}
+    return sorted(entries.values(), key=lambda entry: entry["timestamp"])
+
+
+def _records_prefix(log_type: LogType, day: date) -> str:
+    return f"{LEDGER_PREFIX}/{log_type.value}/records/dt={day.isoformat()}/"
+
+
+def _partition_date(key: str) -> date:
+    partition = next(part for part in key.split("/") if part.startswith("dt="))
+    return date.fromisoformat(partition.removeprefix("dt="))
+
+
+def _in_range(day: date, start: date | None, end: date | None) -> bool:
+    return (start is None or day >= start) and (end is None or day <= end)
+
+
+def _read_entries(keys: list[str]) -> list[dict]:
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        bodies = list(executor.map(get_bytes_from_s3, keys))
+    return [
+        json.loads(line) for body in bodies for line in body.decode().splitlines() if line.strip()
+    ]
@@ -0,0 +1,273 @@
+import io
+import logging
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import polars as pl
+from botocore.exceptions import ClientError
+
+from handler.log_manager import (
+    LOG_FIELDS,
+    LOG_FILE_KEYS,
+    LOG_WRITE_BASE_DELAY,
+    LOG_WRITE_MAX_DELAY,
+    MAX_LOG_WRITE_ATTEMPTS,
+    download_log_file_with_etag,
+    remove_log_entries,
+)
+from handler.log_type import LogType
+from handler.storage import (
+    MAX_CONCURRENCY,
+    PRECONDITION_ERROR_CODES,
+    get_bytes_from_s3,
+    get_bytes_with_etag_from_s3,
+    put_bytes_to_s3,
+    upload_fileobj_to_s3,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LOG_INDEX_PREFIX = "log-index"
+# Entries per segment, the unit a lookup reads with one GET.
+LOG_INDEX_BLOCK_ROWS = int(os.getenv("LOG_INDEX_BLOCK_ROWS", "10000"))
+
+ENTRY_SCHEMA = {
+    "timestamp": pl.Datetime("us"),
+    "file": pl.Utf8(),
+    "alias_of": pl.Utf8(),
+    "source": pl.Utf8(),
+}
+# Every compaction writes its entries twice: sorted by timestamp and sorted by file key.
+ORDERS = ("timestamp", "file")
+INDEX_SCHEMA = {
+    "segment": pl.Utf8(),
+    "order": pl.Utf8(),
+    "rows": pl.Int64(),
+    "min_file": pl.Utf8(),
+    "max_file": pl.Utf8(),
+    "start": pl.Datetime("us"),
+    "end": pl.Datetime("us"),
+}
+
+# Layout in the refined bucket:
+#   log-index/<log type>/segments/segment-<timestamp>-<id>-by-<order>-<n>.parquet   entries
+#   log-index/<log type>/index.parquet                             key and time range -> segment
+# A compaction writes its entries as Parquet segments of up to LOG_INDEX_BLOCK_ROWS entries
+# each, once sorted by timestamp and once sorted by file key. The index has one row per
+# segment: its key, order, number of entries and the range of file keys and timestamps it
+# holds. Lookups by file key read the file-sorted segments, whose key ranges do not
+# overlap within a compaction, so they read about one segment per compaction however
+# entries arrived; other lookups read the timestamp-sorted segments of their time range.
+# The index is replaced with a conditional write, so it always points to complete segments.
+
+
+def compact_log(log_type: LogType) -> list[str]:
+    """
+    Move the entries of a JSON log file into new Parquet segments of the log index.
+
+    The segments are uploaded and indexed before the entries are removed from the log
+    file, so an interrupted compaction never loses entries; lookups de-duplicate
+    entries that are briefly present in both.
+
+    Args:
+        log_type (LogType): The log to compact.
+
+    Returns:
+        list[str]: The keys of the new segments, empty if the log file had no entries.
+    """
+    log_key = LOG_FILE_KEYS[log_type]
+    log_data, _ = download_log_file_with_etag(log_key)
+    entries = log_data.get(LOG_FIELDS[log_type], [])
+    if not entries:
+        logger.info(f"No entries to compact in log file {log_key}")
+        return []
+
+    frame = _entries_to_frame(entries)
+    name = f"segment-{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex}"
+    segments = [
+        (f"{_prefix(log_type)}segments/{name}-by-{order}-{number:05d}.parquet", order, block)
+        for order in ORDERS
+        for number, block in enumerate(
+            frame.sort(order, "timestamp").iter_slices(LOG_INDEX_BLOCK_ROWS)
+        )
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        sizes = list(executor.map(_write_segment, segments))
+
+    _add_to_index(log_type, pl.concat([_index_row(*segment) for segment in segments]))
+    remove_log_entries(
+        log_key, log_type, [(entry["timestamp"], entry["file"]) for entry in entries]
+    )
+
+    logger.info(
+        f"Compacted {len(entries)} {log_type.value} log entr(ies) into {len(segments)} "
+        f"segment(s) ({sum(sizes)} bytes)"
+    )
+    return [key for key, _, _ in segments]
+
+
+def compact_logs() -> list[str]:
+    """
+    Compact every JSON log file into the log index.
+
+    Returns:
+        list[str]: The keys of the new segments.
+    """
+    return [key for log_type in LogType for key in compact_log(log_type)]
+
+
+def lookup(
+    log_type: LogType,
+    file: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> list[dict]:
+    """
+    Find log entries by file key and time range, e.g. "was this file ingested?" or
+    "what was quarantined yesterday?".
+
+    Only the index and the segments that can contain matching entries are read, plus the
+    entries that are still in the JSON log file because they were not compacted yet.
+
+    Args:
+        log_type (LogType): The log to search.
+        file (str | None): The object key the entries refer to, any if None.
+        start (datetime | None): Earliest timestamp to include, unbounded if None.
+        end (datetime | None): Latest timestamp to include, unbounded if None.
+
+    Returns:
+        list: The entries in the format of the JSON log file, ordered by timestamp.
+    """
+    index, _ = _read_index(log_type)
+    if file is not None:
+        index = index.filter(
+            pl.col("order") == "file", pl.col("min_file") <= file, pl.col("max_file") >= file
+        )
+    else:
+        index = index.filter(pl.col("order") == "timestamp")
+    if start is not None:
+        index = index.filter(pl.col("end") >= start)
+    if end is not None:
+        index = index.filter(pl.col("start") <= end)
+    segment_keys = index.get_column("segment").sort().to_list()
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        frames = list(executor.map(_read_segment, segment_keys))
+    log_data, _ = download_log_file_with_etag(LOG_FILE_KEYS[log_type])
+    frames.append(_entries_to_frame(log_data.get(LOG_FIELDS[log_type], [])))
+
+    # Segments written before entries had a source lack the column.
+    entries = pl.concat(frames, how="diagonal")
+    if file is not None:
+        entries = entries.filter(pl.col("file") == file)
+    if start is not None:
+        entries = entries.filter(pl.col("timestamp") >= start)
+    if end is not None:
+        entries = entries.filter(pl.col("timestamp") <= end)
+    # A coalesced output has one entry per source, possibly with the same timestamp.
+    entries = entries.unique(["timestamp", "file", "source"], keep="first").sort(
+        "timestamp", "file", "source"
+    )
+
+    logger.info(
+        f"Found {entries.height} {log_type.value} log entr(ies) in {len(segment_keys)} segment(s)"
+    )
+    return [_entry_to_dict(row) for row in entries.iter_rows(named=True)]
+
+
+def _index_key(log_type: LogType) -> str:
+    return f"{_prefix(log_type)}index.parquet"
+
+
+def _prefix(log_type: LogType) -> str:
+    return f"{LOG_INDEX_PREFIX}/{log_type.value}/"
+
+
+def _read_index(log_type: LogType) -> tuple[pl.DataFrame, str | None]:
+    try:
+        body, etag = get_bytes_with_etag_from_s3(_index_key(log_type))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return pl.DataFrame(schema=INDEX_SCHEMA), None
+        raise
+    return pl.read_parquet(body), etag
+
+
+def _add_to_index(log_type: LogType, index_rows: pl.DataFrame) -> None:
+    # The same optimistic read-modify-write cycle as log_manager._update_log_file.
+    index_key = _index_key(log_type)
+    attempt = 1
+    while True:
+        index, etag = _read_index(log_type)
+        index = pl.concat([index, index_rows]).sort("start", "segment")
+        try:
+            put_bytes_to_s3(
+                index_key, _to_parquet(index), if_match=etag, if_none_match=etag is None
+            )
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in PRECONDITION_ERROR_CODES:
+                raise
+            if attempt >= MAX_LOG_WRITE_ATTEMPTS:
+                logger.error(f"Giving up on log index {index_key} after {attempt} attempts")
+                raise
+
+            delay = random.uniform(0, min(LOG_WRITE_MAX_DELAY, LOG_WRITE_BASE_DELAY * 2**attempt))
+            logger.warning(f"Log index {index_key} changed concurrently, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def _index_row(segment_key: str, order: str, block: pl.DataFrame) -> pl.DataFrame:
+    return block.select(
+        segment=pl.lit(segment_key),
+        order=pl.lit(order),
+        rows=pl.len().cast(pl.Int64),
+        min_file=pl.col("file").min(),
+        max_file=pl.col("file").max(),
+        start=pl.col("timestamp").min(),
+        end=pl.col("timestamp").max(),
+    )
+
+
+def _write_segment(segment: tuple[str, str, pl.DataFrame]) -> int:
+    segment_key, _, block = segment
+    data = _to_parquet(block)
+    upload_fileobj_to_s3(segment_key, io.BytesIO(data))
+    return len(data)
+
+
+def _read_segment(segment_key: str) -> pl.DataFrame:
+    return pl.read_parquet(get_bytes_from_s3(segment_key))
+
+
+def _to_parquet(frame: pl.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    frame.write_parquet(buffer, compression="zstd", statistics=True)
+    return buffer.getvalue()
+
+
+def _entries_to_frame(entries: list[dict]) -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "timestamp": [datetime.fromisoformat(entry["timestamp"]) for entry in entries],
+            "file": [entry["file"] for entry in entries],
+            "alias_of": [entry.get("alias_of") for entry in entries],
+            "source": [entry.get("source") for entry in entries],
+        },
+        schema=ENTRY_SCHEMA,
+    )
+
+
+def _entry_to_dict(row: dict) -> dict:
+    entry = {"timestamp": row["timestamp"].isoformat(), "file": row["file"]}
+    if row["alias_of"]:
+        entry["alias_of"] = row["alias_of"]
+    if row.get("source"):
+        entry["source"] = row["source"]
+    return entry
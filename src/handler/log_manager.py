@@ -1,16 +1,37 @@
+import asyncio
 import json
 import logging
 import os
+import random
+import time
+from collections.abc import Callable, Collection
 from datetime import datetime
 
 from botocore.exceptions import ClientError
 
 from handler.log_type import LogType
-from handler.storage import REFINED_BUCKET_NAME, download_file_from_s3, upload_file_to_s3
+from handler.scratch import scratch
+from handler.storage import (
+    PRECONDITION_ERROR_CODES,
+    REFINED_BUCKET_NAME,
+    download_file_from_s3,
+    get_bytes_with_etag_from_s3,
+    put_bytes_to_s3,
+    upload_file_to_s3,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+MAX_LOG_WRITE_ATTEMPTS = int(os.getenv("LOG_WRITE_MAX_ATTEMPTS", "8"))
+LOG_WRITE_BASE_DELAY = 0.1
+LOG_WRITE_MAX_DELAY = 5.0
+LOG_FILE_KEYS = {
+    LogType.REFINEMENT: "refinement-log.json",
+    LogType.QUARANTINE: "quarantine-log.json",
+}
+LOG_FIELDS = {LogType.REFINEMENT: "ingested_files", LogType.QUARANTINE: "quarantined_files"}
+
 
 def download_log_file(log_key: str) -> dict:
     """
@@ -20,9 +41,10 @@ def download_log_file(log_key: str) -> dict:
     try:
         if not REFINED_BUCKET_NAME:
             raise ValueError("REFINED_BUCKET_NAME environment variable is not set")
-        local_path = download_file_from_s3(REFINED_BUCKET_NAME, log_key)
-        with open(local_path, "r") as file:
-            return json.load(file)
+        with scratch.task(os.path.basename(log_key)) as work_dir:
+            local_path = download_file_from_s3(REFINED_BUCKET_NAME, log_key, work_dir or "/tmp")
+            with open(local_path, "r") as file:
+                return json.load(file)
     except ClientError as e:
         if e.response["Error"]["Code"] == "NoSuchKey":
             logger.warning(f"Log file {log_key} not found, creating a new one.")
@@ -34,14 +56,25 @@ def download_log_file(log_key: str) -> dict:
         raise
 
 
-def update_log(log_data: dict, log_type: LogType, object_key: str) -> dict:
+def update_log(
+    log_data: dict,
+    log_type: LogType,
+    object_key: str,
+    alias_of: str | None = None,
+    source: str | None = None,
+) -> dict:
     """
     Update the log data with the new entry.
+    Entries of outputs copied from identical content name the copied output in alias_of,
+    entries of outputs coalesced from several objects name one of them in source.
     """
     entry = {"timestamp": datetime.now().isoformat(), "file": object_key}
+    if alias_of:
+        entry["alias_of"] = alias_of
+    if source:
+        entry["source"] = source
 
-    log_key = "ingested_files" if log_type == LogType.REFINEMENT else "quarantined_files"
-    log_data.setdefault(log_key, []).append(entry)
+    log_data.setdefault(LOG_FIELDS[log_type], []).append(entry)
 
     return log_data
 
@@ -50,13 +83,164 @@ def upload_log_file(log_key: str, log_data: dict) -> None:
     """
     Upload the updated log file to S3.
     """
-    local_path = f"/tmp/{os.path.basename(log_key)}"
     try:
-        with open(local_path, "w") as file:
-            json.dump(log_data, file, indent=2)
+        with scratch.task(os.path.basename(log_key)) as work_dir:
+            local_path = os.path.join(work_dir or "/tmp", os.path.basename(log_key))
+            with open(local_path, "w") as file:
+                json.dump(log_data, file, indent=2)
 
-        upload_file_to_s3(log_key, local_path)
+            upload_file_to_s3(log_key, local_path)
         logger.info(f"Log file {log_key} successfully updated in bucket {REFINED_BUCKET_NAME}.")
     except Exception as e:
         logger.exception(f"Error uploading log file {log_key}: {e}")
         raise
+
+
+def download_log_file_with_etag(log_key: str) -> tuple[dict, str | None]:
+    """
+    Download the log file and return its contents together with its ETag.
+    If the log file doesn't exist, return an empty dictionary and no ETag.
+    """
+    if not REFINED_BUCKET_NAME:
+        raise ValueError("REFINED_BUCKET_NAME environment variable is not set")
+    try:
+        body, etag = get_bytes_with_etag_from_s3(log_key)
+        return json.loads(body), etag
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            logger.warning(f"Log file {log_key} not found, creating a new one.")
+            return {}, None
+        logger.error(f"Error downloading log file {log_key}: {e}")
+        raise
+
+
+def append_log_entries(
+    log_key: str,
+    log_type: LogType,
+    object_keys: list[str],
+    aliases: dict[str, str] | None = None,
+    prefetched: tuple[dict, str | None] | None = None,
+    sources: list[str | None] | None = None,
+) -> dict:
+    """
+    Append entries to the log file with an optimistic read-modify-write cycle.
+
+    The write is conditional on the ETag of the version that was read (or on the file
+    not existing yet), so concurrent writers never overwrite each other's entries. When
+    another writer got there first, the cycle is retried with jittered exponential backoff.
+
+    Args:
+        log_key (str): The S3 object key of the log file.
+        log_type (LogType): The type of the entries.
+        object_keys (list[str]): The S3 object keys to log, written in a single update.
+        aliases (dict[str, str] | None): The output each copied object key is a copy of.
+        prefetched (tuple[dict, str | None] | None): The log data and ETag read earlier,
+            used for the first attempt instead of reading the log file again. If the
+            file changed since, the conditional write fails and the cycle is retried.
+        sources (list[str | None] | None): The source object of each object key, for
+            outputs coalesced from several objects, which are logged once per source.
+
+    Returns:
+        dict: The log data as written.
+    """
+
+    def append(log_data: dict) -> dict:
+        for object_key, source in zip(object_keys, sources or [None] * len(object_keys)):
+            log_data = update_log(
+                log_data, log_type, object_key, (aliases or {}).get(object_key), source
+            )
+        return log_data
+
+    log_data = _update_log_file(log_key, append, prefetched)
+    logger.info(f"Appended {len(object_keys)} entr(ies) to log file {log_key}.")
+    return log_data
+
+
+def remove_log_entries(
+    log_key: str, log_type: LogType, entries: Collection[tuple[str, str]]
+) -> dict:
+    """
+    Remove entries from the log file with the same optimistic read-modify-write cycle
+    as append_log_entries, e.g. once they are compacted into the log index.
+
+    Args:
+        log_key (str): The S3 object key of the log file.
+        log_type (LogType): The type of the entries.
+        entries (Collection[tuple[str, str]]): The (timestamp, file) of each entry.
+
+    Returns:
+        dict: The log data as written.
+    """
+    removed = set(entries)
+
+    def remove(log_data: dict) -> dict:
+        field = LOG_FIELDS[log_type]
+        log_data[field] = [
+            entry
+            for entry in log_data.get(field, [])
+            if (entry["timestamp"], entry["file"]) not in removed
+        ]
+        return log_data
+
+    log_data = _update_log_file(log_key, remove)
+    logger.info(f"Removed {len(removed)} entr(ies) from log file {log_key}.")
+    return log_data
+
+
+def _update_log_file(
+    log_key: str,
+    modify: Callable[[dict], dict],
+    prefetched: tuple[dict, str | None] | None = None,
+) -> dict:
+    attempt = 1
+    while True:
+        if prefetched is not None:
+            (log_data, etag), prefetched = prefetched, None
+        else:
+            log_data, etag = download_log_file_with_etag(log_key)
+        log_data = modify(log_data)
+
+        try:
+            put_bytes_to_s3(
+                log_key,
+                json.dumps(log_data, indent=2).encode(),
+                if_match=etag,
+                if_none_match=etag is None,
+            )
+            return log_data
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in PRECONDITION_ERROR_CODES:
+                raise
+            if attempt >= MAX_LOG_WRITE_ATTEMPTS:
+                logger.error(f"Giving up on log file {log_key} after {attempt} attempts")
+                raise
+
+            delay = random.uniform(0, min(LOG_WRITE_MAX_DELAY, LOG_WRITE_BASE_DELAY * 2**attempt))
+            logger.warning(f"Log file {log_key} changed concurrently, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def prefetch_log_file(log_key: str) -> tuple[dict, str | None]:
+    """
+    Read the log file and its ETag on a worker thread, so the read overlaps with
+    other work of the event loop.
+    """
+    return await asyncio.to_thread(download_log_file_with_etag, log_key)
+
+
+async def append_log_entries_async(
+    log_key: str,
+    log_type: LogType,
+    object_keys: list[str],
+    aliases: dict[str, str] | None = None,
+    prefetched: tuple[dict, str | None] | None = None,
+    sources: list[str | None] | None = None,
+) -> dict:
+    """
+    Asyncio variant of append_log_entries, running the read-modify-write cycle on a
+    worker thread so updates of different log files overlap.
+    """
+    return await asyncio.to_thread(
+        append_log_entries, log_key, log_type, object_keys, aliases, prefetched, sources
+    )
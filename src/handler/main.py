@@ -1,13 +1,41 @@
 import logging
+import os
+import time
+from datetime import date, timedelta
 
+import handler
+from handler import startup
 from handler.handler import handle_event
+from handler.ledger import compact_ledgers
 from handler.logger import setup_logging
 
+LOG_INDEX_ENABLED = os.getenv("LOG_INDEX_ENABLED", "false").lower() == "true"
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+startup.record("import", time.perf_counter() - handler.IMPORT_STARTED)
+
 
-def main(event, context) -> None:
+def main(event, context) -> dict:
     setup_logging()
     logger.debug("Starting main function")
-    return handle_event(event, context)
+    with startup.timed("first_invocation"):
+        return handle_event(event, context)
+
+
+def compact(event, context) -> dict:
+    """
+    Scheduled entry point compacting the ledger partitions of one day, yesterday by default,
+    and, with LOG_INDEX_ENABLED, the JSON log files into the log index.
+    """
+    setup_logging()
+    day = event.get("date")
+    day = date.fromisoformat(day) if day else date.today() - timedelta(days=1)
+    logger.info(f"Compacting ledgers for {day}")
+    result = {"segments": compact_ledgers(day)}
+    if LOG_INDEX_ENABLED:
+        from handler.log_index import compact_logs
+
+        result["log_index_segments"] = compact_logs()
+    return result
@@ -0,0 +1,175 @@
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Protocol, TypeVar
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "RawTransactionsHandler")
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_METRIC_UNITS = {
+    "wall_seconds": ("WallTime", "Seconds"),
+    "cpu_seconds": ("CpuTime", "Seconds"),
+    "peak_rss_delta_bytes": ("PeakRssDelta", "Bytes"),
+    "bytes_in": ("BytesIn", "Bytes"),
+    "bytes_out": ("BytesOut", "Bytes"),
+    "rows": ("Rows", "Count"),
+}
+
+F = TypeVar("F", bound=Callable)
+
+
+@dataclass
+class StageMetrics:
+    """
+    Measurements of one pipeline stage. `bytes_in`, `bytes_out`, `rows` and
+    `properties` are filled in by the instrumented code.
+
+    CPU time is process-wide, as Polars and boto3 do their work on their own
+    threads; stages running concurrently therefore see each other's CPU time.
+    The peak RSS delta is the growth of the process high-water mark during the
+    stage, so it is 0 unless the stage set a new peak.
+    """
+
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_delta_bytes: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    rows: int = 0
+    failed: bool = False
+    properties: dict = field(default_factory=dict)
+
+
+class MetricsSink(Protocol):
+    def emit(self, metrics: StageMetrics) -> None: ...
+
+
+class EmfSink:
+    """
+    Writes every stage as a CloudWatch Embedded Metric Format line to stdout,
+    where Lambda picks it up and extracts the metrics asynchronously.
+    """
+
+    def __init__(self, namespace: str = METRICS_NAMESPACE) -> None:
+        self.namespace = namespace
+
+    def emit(self, metrics: StageMetrics) -> None:
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Stage"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, unit in _METRIC_UNITS.values()
+                        ],
+                    }
+                ],
+            },
+            "Stage": metrics.stage,
+            "Failed": metrics.failed,
+            **{name: getattr(metrics, attr) for attr, (name, _) in _METRIC_UNITS.items()},
+            **metrics.properties,
+        }
+        print(json.dumps(document, default=str), flush=True)
+
+
+class JsonSink:
+    """
+    Keeps every stage in memory and optionally appends it as a JSON line to a
+    local file. Intended for tests and local runs.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self.records: list[StageMetrics] = []
+        self._lock = threading.Lock()
+
+    def emit(self, metrics: StageMetrics) -> None:
+        with self._lock:
+            self.records.append(metrics)
+            if self.path:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(asdict(metrics), default=str) + "\n")
+
+
+_sink: MetricsSink = EmfSink()
+
+
+def set_sink(sink: MetricsSink) -> MetricsSink:
+    """
+    Replace the sink all stages are emitted to.
+
+    Returns:
+        MetricsSink: The previous sink, so it can be restored.
+    """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+@contextmanager
+def stage(name: str, **properties) -> Iterator[StageMetrics]:
+    """
+    Measure the wrapped block as one pipeline stage and emit it to the sink.
+
+    Args:
+        name (str): The stage name, emitted as the metric dimension.
+        **properties: Additional non-dimension properties, e.g. the object key.
+
+    Yields:
+        StageMetrics: The metrics, to be completed with bytes and rows by the caller.
+    """
+    metrics = StageMetrics(name, properties=properties)
+    if not METRICS_ENABLED:
+        yield metrics
+        return
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        yield metrics
+    except BaseException:
+        metrics.failed = True
+        raise
+    finally:
+        metrics.wall_seconds = time.perf_counter() - wall_start
+        metrics.cpu_seconds = time.process_time() - cpu_start
+        rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        metrics.peak_rss_delta_bytes = (rss_end - rss_start) * _RSS_UNIT
+        try:
+            _sink.emit(metrics)
+        except Exception as e:
+            logger.warning(f"Could not emit metrics for stage {name}: {e}")
+
+
+def instrumented(name: str) -> Callable[[F], F]:
+    """
+    Decorator form of `stage` for functions that do not report bytes or rows.
+    """
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
@@ -0,0 +1,245 @@
+import logging
+import os
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import cast
+
+import polars as pl
+from polars.io.plugins import register_io_source
+
+from handler import storage, validator
+from handler.metrics import stage
+from handler.rules import ValidationReport, merge_reports
+from handler.schemas import SchemaVersion
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MB = 1024 * 1024
+# Objects of at least this size are read with concurrent ranged GETs.
+RANGED_READ_THRESHOLD = int(os.getenv("RANGED_READ_THRESHOLD_MB", "256")) * MB
+RANGE_SIZE = int(os.getenv("RANGED_READ_PART_MB", "64")) * MB
+MAX_RANGE_CONCURRENCY = int(os.getenv("RANGED_READ_CONCURRENCY", str(storage.MAX_CONCURRENCY)))
+
+QUOTE = b'"'
+NEWLINE = b"\n"
+
+
+def plan_ranges(size: int, range_size: int = RANGE_SIZE) -> list[tuple[int, int]]:
+    """
+    Split an object into byte ranges.
+
+    Returns:
+        list[tuple[int, int]]: (first byte, last byte) of every range, inclusive.
+    """
+    return [(start, min(start + range_size, size) - 1) for start in range(0, size, range_size)]
+
+
+def find_record_start(chunk: bytes, in_quotes: bool) -> int | None:
+    """
+    Find the offset of the first record that starts inside the chunk.
+
+    A newline only ends a record when it is outside a quoted field, i.e. when an even
+    number of quote characters precedes it. Escaped quotes ("") count twice and so
+    keep the parity intact.
+
+    Args:
+        chunk (bytes): The bytes of one range.
+        in_quotes (bool): Whether the chunk starts inside a quoted field.
+
+    Returns:
+        int | None: Offset just past the first record-ending newline, or None if the
+            chunk lies entirely inside one record.
+    """
+    position = chunk.find(NEWLINE)
+    while position != -1:
+        if (chunk.count(QUOTE, 0, position) % 2 == 1) == in_quotes:
+            return position + 1
+        position = chunk.find(NEWLINE, position + 1)
+    return None
+
+
+def find_record_end(chunk: bytes, in_quotes: bool) -> int | None:
+    """
+    Find the offset just past the last record-ending newline of the chunk, with the
+    same quote parity rule as find_record_start.
+
+    Args:
+        chunk (bytes): The bytes of one range.
+        in_quotes (bool): Whether the chunk starts inside a quoted field.
+
+    Returns:
+        int | None: Offset just past the last record-ending newline, or None if no
+            record ends inside the chunk.
+    """
+    position = chunk.rfind(NEWLINE)
+    while position != -1:
+        if (chunk.count(QUOTE, 0, position) % 2 == 1) == in_quotes:
+            return position + 1
+        position = chunk.rfind(NEWLINE, 0, position)
+    return None
+
+
+def iter_records(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Re-cut consecutive chunks of a CSV file at record boundaries as they arrive.
+
+    Every chunk is cut after its last complete record and the rest is carried over
+    to the next one. The carried-over bytes start a record, so their quote count
+    gives the quote parity at the start of the next chunk.
+
+    Args:
+        chunks (Iterable[bytes]): The ranges of the file in order.
+
+    Yields:
+        bytes: The header line, then the record-aligned parts.
+    """
+    header: bytes | None = None
+    rest = b""
+    for chunk in chunks:
+        in_quotes = rest.count(QUOTE) % 2 == 1
+        if header is None:
+            start = find_record_start(chunk, in_quotes)
+            if start is None:
+                rest += chunk
+                continue
+            header, chunk, rest, in_quotes = rest + chunk[:start], chunk[start:], b"", False
+            yield header
+
+        end = find_record_end(chunk, in_quotes)
+        if end is None:
+            rest += chunk
+            continue
+        if part := rest + chunk[:end]:
+            yield part
+        rest = chunk[end:]
+
+    # A file without a complete line is all header, a last record may lack its newline.
+    if header is None or rest:
+        yield rest
+
+
+def scan_csv_ranges(
+    bucket_name: str,
+    object_key: str,
+    size: int | None = None,
+    schema: SchemaVersion = validator.DEFAULT_SCHEMA,
+) -> pl.LazyFrame:
+    """
+    Lazily read and validate a large CSV object with pipelined ranged GETs.
+    Counterpart of validator.scan_and_validate_csv that never holds the whole object:
+    when the LazyFrame is sunk, every part is parsed and validated as its ranges
+    arrive and written before later ranges are fetched. The merged report of all
+    parts raises once the last part is read, before the output can be uploaded.
+    Every collection of the LazyFrame reads the object again.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The S3 object key (path) of the CSV file.
+        size (int | None): The object size, looked up with head_object if None.
+        schema (SchemaVersion): The schema to read and validate the object with.
+
+    Returns:
+        pl.LazyFrame: The validated data.
+    """
+
+    def source(
+        with_columns: list[str] | None,
+        predicate: pl.Expr | None,
+        n_rows: int | None,
+        batch_size: int | None,
+    ) -> Iterator[pl.DataFrame]:
+        reports = []
+        for frame, report in _parse_ranges(bucket_name, object_key, size, schema, validate=True):
+            reports.append(cast(ValidationReport, report))
+            if with_columns is not None:
+                frame = frame.select(with_columns)
+            if predicate is not None:
+                frame = frame.filter(predicate)
+            if n_rows is not None:
+                frame = frame.head(n_rows)
+                n_rows -= len(frame)
+            yield frame
+            if n_rows == 0:
+                return
+        validator.raise_for_report(merge_reports(reports))
+
+    return register_io_source(source, schema=schema.polars_schema)
+
+
+def read_csv_ranges(
+    bucket_name: str,
+    object_key: str,
+    size: int | None = None,
+    schema: SchemaVersion = validator.DEFAULT_SCHEMA,
+) -> pl.DataFrame:
+    """
+    Load a large CSV object with concurrent ranged GETs, without validating it.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The S3 object key (path) of the CSV file.
+        size (int | None): The object size, looked up with head_object if None.
+        schema (SchemaVersion): The schema of the object.
+
+    Returns:
+        pl.DataFrame: The data, one chunk per part.
+    """
+    frames = [frame for frame, _ in _parse_ranges(bucket_name, object_key, size, schema, False)]
+    return pl.concat(frames, rechunk=False)
+
+
+def _parse_ranges(
+    bucket_name: str, object_key: str, size: int | None, schema: SchemaVersion, validate: bool
+) -> Iterator[tuple[pl.DataFrame, ValidationReport | None]]:
+    """
+    Fetch, re-cut and parse the ranges of an object as a pipeline on one thread pool.
+    At most MAX_RANGE_CONCURRENCY ranges are fetched and as many parts parsed ahead of
+    the part the consumer is at, so memory is bound by the concurrency, not the size.
+
+    Yields:
+        tuple[pl.DataFrame, ValidationReport | None]: Every part in order of the file,
+            with its report if `validate`.
+    """
+    size = size if size is not None else storage.get_object_size(bucket_name, object_key)
+    ranges = plan_ranges(size, RANGE_SIZE)
+    logger.info(f"Reading {object_key} ({size} bytes) in {len(ranges)} range(s)")
+
+    def fetch(byte_range: tuple[int, int]) -> bytes:
+        with stage("download", object_key=object_key) as measured:
+            chunk = storage.get_object_range(bucket_name, object_key, *byte_range)
+            measured.bytes_in = len(chunk)
+            return chunk
+
+    with ThreadPoolExecutor(max_workers=MAX_RANGE_CONCURRENCY) as executor:
+
+        def chunks() -> Iterator[bytes]:
+            fetches: deque[Future[bytes]] = deque()
+            for byte_range in ranges:
+                fetches.append(executor.submit(fetch, byte_range))
+                if len(fetches) >= MAX_RANGE_CONCURRENCY:
+                    yield fetches.popleft().result()
+            while fetches:
+                yield fetches.popleft().result()
+
+        records = iter_records(chunks())
+        header = next(records)
+
+        def load_part(part: bytes) -> tuple[pl.DataFrame, ValidationReport | None]:
+            frame = validator.read_csv(header + part, schema)
+            return frame, validator.validate_dataframe(frame, schema.rules) if validate else None
+
+        parses: deque[Future[tuple[pl.DataFrame, ValidationReport | None]]] = deque()
+        parsed = 0
+        for part in records:
+            parses.append(executor.submit(load_part, part))
+            if len(parses) >= MAX_RANGE_CONCURRENCY:
+                parsed += 1
+                yield parses.popleft().result()
+        while parses:
+            parsed += 1
+            yield parses.popleft().result()
+        if not parsed:
+            # A file without records still gets validated, like by load_and_validate_csv.
+            yield load_part(b"")
@@ -0,0 +1,324 @@
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+from functools import cache
+
+import polars as pl
+
+from handler.metrics import stage
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_SAMPLE_SIZE = 10
+
+
+@dataclass(frozen=True)
+class Rule(ABC):
+    """
+    Base class for declarative validation rules.
+
+    Row-level rules describe their violations as a boolean expression that is
+    true for every offending row, so any number of rules can be compiled into a
+    single Polars `select`.
+    """
+
+    column: str
+    message: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.column}:{type(self).__name__}"
+
+    @abstractmethod
+    def violation_expr(self) -> pl.Expr:
+        """
+        Boolean expression that is true for every row violating the rule.
+        """
+
+    def is_violated(self, violations: int, rows: int) -> bool:
+        return violations > 0
+
+    @property
+    def row_level(self) -> bool:
+        """
+        Whether a violation condemns only the offending row rather than the whole file.
+        """
+        return True
+
+
+@dataclass(frozen=True)
+class NonNullRule(Rule):
+    """
+    Flags null values. With `allow_partial` (the default) the rule only fails when
+    the column is null in every row, i.e. it is missing from the file.
+    """
+
+    message: str = "Missing column in the DataFrame"
+    allow_partial: bool = True
+
+    def violation_expr(self) -> pl.Expr:
+        return pl.col(self.column).is_null()
+
+    def is_violated(self, violations: int, rows: int) -> bool:
+        return violations == rows if self.allow_partial else violations > 0
+
+    @property
+    def row_level(self) -> bool:
+        return not self.allow_partial
+
+
+@dataclass(frozen=True)
+class InSetRule(Rule):
+    """
+    Flags values that are not part of the allowed set.
+    """
+
+    values: tuple = ()
+
+    def violation_expr(self) -> pl.Expr:
+        return ~pl.col(self.column).is_in(list(self.values))
+
+
+@dataclass(frozen=True)
+class RegexRule(Rule):
+    """
+    Flags string values that do not match the pattern, optionally after
+    left-padding them with zeros to `zfill` characters.
+    """
+
+    pattern: str = ""
+    zfill: int | None = None
+
+    def violation_expr(self) -> pl.Expr:
+        values = pl.col(self.column).cast(pl.Utf8)
+        if self.zfill is not None:
+            values = values.str.zfill(self.zfill)
+        return ~values.str.contains(self.pattern)
+
+
+@dataclass(frozen=True)
+class RangeRule(Rule):
+    """
+    Flags values outside the inclusive [min_value, max_value] range.
+    """
+
+    min_value: float | None = None
+    max_value: float | None = None
+
+    def violation_expr(self) -> pl.Expr:
+        in_range = pl.lit(True)
+        if self.min_value is not None:
+            in_range &= pl.col(self.column) >= self.min_value
+        if self.max_value is not None:
+            in_range &= pl.col(self.column) <= self.max_value
+        return ~in_range
+
+
+@dataclass(frozen=True)
+class SchemaRule:
+    """
+    Checks column names and data types against the expected schema. It only
+    inspects the frame's schema and never scans the data.
+    """
+
+    expected: dict[str, pl.DataType]
+    message: str = "Schema mismatch"
+    name: str = "schema"
+
+    def mismatches(self, schema: pl.Schema) -> list[str]:
+        return [
+            col for col, dtype in self.expected.items() if col not in schema or schema[col] != dtype
+        ]
+
+
+@dataclass
+class RuleResult:
+    rule: Rule | SchemaRule
+    violations: int
+    failed: bool
+    sample: pl.DataFrame = field(default_factory=pl.DataFrame)
+
+    def as_dict(self) -> dict:
+        return {
+            "rule": self.rule.name,
+            "violations": self.violations,
+            "failed": self.failed,
+            "sample": self.sample.to_dicts(),
+        }
+
+
+@dataclass
+class ValidationReport:
+    rows: int
+    results: list[RuleResult]
+
+    @property
+    def passed(self) -> bool:
+        return not self.failures
+
+    @property
+    def failures(self) -> list[RuleResult]:
+        return [result for result in self.results if result.failed]
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "passed": self.passed,
+            "results": [result.as_dict() for result in self.results],
+        }
+
+
+def evaluate_rules(
+    frame: pl.DataFrame | pl.LazyFrame,
+    rules: Iterable[Rule | SchemaRule],
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+) -> ValidationReport:
+    """
+    Evaluate all rules against the frame in a single pass.
+
+    The pass only aggregates the violation counts, so a LazyFrame is validated with
+    bounded memory by the streaming engine. Sample rows are gathered afterwards, and
+    only for the rules that failed.
+
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): Data to validate. LazyFrames are evaluated
+            with the streaming engine.
+        rules (Iterable[Rule | SchemaRule]): Rules to evaluate.
+        sample_size (int): Maximum number of offending rows kept per failed rule.
+
+    Returns:
+        ValidationReport: Violation counts and sample rows per rule.
+    """
+    rules = list(rules)
+    schema_rules = [rule for rule in rules if isinstance(rule, SchemaRule)]
+    row_rules = [rule for rule in rules if isinstance(rule, Rule)]
+    is_lazy = isinstance(frame, pl.LazyFrame)
+
+    results = []
+    if schema_rules:
+        schema = frame.collect_schema()
+        for schema_rule in schema_rules:
+            mismatches = schema_rule.mismatches(schema)
+            if mismatches:
+                logger.error(f"Schema mismatch for columns: {mismatches}")
+            results.append(RuleResult(schema_rule, len(mismatches), bool(mismatches)))
+
+    aggregates = _compile(tuple(row_rules))
+    with stage("validate") as measured:
+        try:
+            logger.info(f"Evaluating {len(row_rules)} rule(s) in a single pass")
+            plan = frame.lazy().select(aggregates)
+            collected = plan.collect(engine="streaming") if is_lazy else plan.collect()
+            row = collected.row(0, named=True)
+        except Exception as e:
+            logger.exception(f"Rule evaluation failed: {e}")
+            raise
+
+        rows = row["__rows"]
+        for i, rule in enumerate(row_rules):
+            violations = row[f"__violations_{i}"]
+            failed = rule.is_violated(violations, rows)
+            sample = _sample(frame, rule, sample_size) if failed else pl.DataFrame()
+            results.append(RuleResult(rule, violations, failed, sample))
+            logger.info(f"Rule {rule.name}: {violations} violation(s)")
+
+        # All rules share one pass, so they are reported as violation counts of one stage.
+        measured.rows = rows
+        measured.properties["violations"] = {
+            result.rule.name: result.violations for result in results
+        }
+
+    return ValidationReport(rows, results)
+
+
+def split_rows(
+    frame: pl.DataFrame, rules: Iterable[Rule], reason_column: str = "reason"
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Split the rows violating any of the rules from the valid rows, with vectorized masks.
+
+    Args:
+        frame (pl.DataFrame): Data to split.
+        rules (Iterable[Rule]): Row-level rules to apply.
+        reason_column (str): Name of the column holding, for every invalid row, the
+            names of the violated rules separated by ";".
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: The valid rows and the invalid rows.
+    """
+    rules = list(rules)
+    if not rules:
+        return frame, frame.clear().with_columns(pl.lit(None, pl.Utf8).alias(reason_column))
+
+    labeled = frame.with_columns(_reason(tuple(rules)).alias(reason_column))
+    # concat_str yields an empty string when no rule is violated.
+    invalid_mask = pl.col(reason_column) != ""
+    valid = labeled.filter(~invalid_mask).drop(reason_column)
+    invalid = labeled.filter(invalid_mask)
+    logger.info(f"Split {len(invalid)} invalid row(s) from {len(frame)} row(s)")
+    return valid, invalid
+
+
+def merge_reports(
+    reports: Sequence[ValidationReport], sample_size: int = DEFAULT_SAMPLE_SIZE
+) -> ValidationReport:
+    """
+    Combine the reports of consecutive parts of one file into the report of the whole
+    file. Violations are summed and every rule is re-judged on the totals, so e.g. a
+    column that is null in only some parts does not count as missing.
+
+    Args:
+        reports (Sequence[ValidationReport]): Reports of the parts, evaluated with the same rules.
+        sample_size (int): Maximum number of offending rows kept per failed rule.
+
+    Returns:
+        ValidationReport: The combined report.
+    """
+    rows = sum(report.rows for report in reports)
+    results = []
+    for part_results in zip(*(report.results for report in reports)):
+        rule = part_results[0].rule
+        if isinstance(rule, SchemaRule):
+            violations = max(result.violations for result in part_results)
+            failed = any(result.failed for result in part_results)
+        else:
+            violations = sum(result.violations for result in part_results)
+            failed = rule.is_violated(violations, rows)
+        samples = [result.sample for result in part_results if not result.sample.is_empty()]
+        sample = pl.concat(samples).head(sample_size) if failed and samples else pl.DataFrame()
+        results.append(RuleResult(rule, violations, failed, sample))
+    return ValidationReport(rows, results)
+
+
+@cache
+def _compile(rules: tuple[Rule, ...]) -> list[pl.Expr]:
+    """
+    Compile the rules into aggregation expressions for one `select`. Rules are immutable,
+    so the expressions are built once per rule set and reused by warm invocations.
+    """
+    aggregates = [pl.len().alias("__rows")]
+    for i, rule in enumerate(rules):
+        aggregates.append(rule.violation_expr().sum().alias(f"__violations_{i}"))
+    return aggregates
+
+
+@cache
+def _reason(rules: tuple[Rule, ...]) -> pl.Expr:
+    """
+    Compile the rules into one expression naming the rules each row violates.
+    """
+    return pl.concat_str(
+        [pl.when(rule.violation_expr().fill_null(False)).then(pl.lit(rule.name)) for rule in rules],
+        separator=";",
+        ignore_nulls=True,
+    )
+
+
+def _sample(frame: pl.DataFrame | pl.LazyFrame, rule: Rule, sample_size: int) -> pl.DataFrame:
+    # The first offending rows; a scan stops once it found them.
+    offending = frame.filter(rule.violation_expr()).head(sample_size)
+    if isinstance(offending, pl.LazyFrame):
+        return offending.collect(engine="streaming")
+    return offending
@@ -0,0 +1,293 @@
+import csv
+import json
+import logging
+import os
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from functools import cache, cached_property
+from typing import IO
+
+import polars as pl
+
+from handler.rules import InSetRule, NonNullRule, RangeRule, RegexRule, Rule, SchemaRule
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# A JSON file, or a directory of JSON files, with additional schema definitions.
+SCHEMA_DEFINITIONS_PATH = os.getenv("SCHEMA_DEFINITIONS_PATH")
+# Bytes read from the start of an object to sniff its header when it is not downloaded.
+HEADER_SNIFF_BYTES = 64 * 1024
+
+DTYPES: dict[str, Callable[[], pl.DataType]] = {
+    "Utf8": pl.Utf8,
+    "String": pl.String,
+    "Boolean": pl.Boolean,
+    "Int8": pl.Int8,
+    "Int16": pl.Int16,
+    "Int32": pl.Int32,
+    "Int64": pl.Int64,
+    "Float32": pl.Float32,
+    "Float64": pl.Float64,
+    "Date": pl.Date,
+    "Datetime": pl.Datetime,
+    "Categorical": pl.Categorical,
+}
+RULE_TYPES: dict[str, type[Rule]] = {
+    "non_null": NonNullRule,
+    "in_set": InSetRule,
+    "regex": RegexRule,
+    "range": RangeRule,
+}
+
+
+# The credit card transactions of https://www.kaggle.com/datasets/kartik2112/fraud-detection
+EXPECTED_SCHEMA_MAPPING = {
+    "trans_date_trans_time": pl.Datetime(),
+    "cc_num": pl.Int64(),
+    "merchant": pl.Utf8(),
+    "category": pl.Utf8(),
+    "amt": pl.Float64(),
+    "first": pl.Utf8(),
+    "last": pl.Utf8(),
+    "gender": pl.Utf8(),
+    "street": pl.Utf8(),
+    "city": pl.Utf8(),
+    "state": pl.Utf8(),
+    "zip": pl.Utf8(),
+    "lat": pl.Float64(),
+    "long": pl.Float64(),
+    "city_pop": pl.Int64(),
+    "job": pl.Utf8(),
+    "dob": pl.Date(),
+    "trans_num": pl.Utf8(),
+    "unix_time": pl.Int64(),
+    "merch_lat": pl.Float64(),
+    "merch_long": pl.Float64(),
+    "is_fraud": pl.Int8(),
+}
+
+ZIP_PATTERN = r"^\d{5}(-\d{4})?$"
+
+IS_FRAUD_RULE = InSetRule("is_fraud", "Invalid values found in is_fraud column", values=(0, 1))
+ZIP_RULE = RegexRule("zip", "Invalid ZIP codes found", pattern=ZIP_PATTERN, zfill=5)
+DEFAULT_RULES: tuple[Rule | SchemaRule, ...] = (
+    *(NonNullRule(col) for col in EXPECTED_SCHEMA_MAPPING),
+    IS_FRAUD_RULE,
+    ZIP_RULE,
+)
+# Types the columns are stored in with PARQUET_COMPACT: low-cardinality strings become
+# categoricals, and city populations fit 32 bits.
+COMPACT_TYPES = {
+    "merchant": pl.Categorical(),
+    "category": pl.Categorical(),
+    "gender": pl.Categorical(),
+    "city": pl.Categorical(),
+    "state": pl.Categorical(),
+    "city_pop": pl.Int32(),
+    "job": pl.Categorical(),
+}
+
+
+@dataclass(frozen=True)
+class SchemaVersion:
+    """
+    One version of a raw file layout: its columns with their types, the rules its data
+    must satisfy, the object key prefixes routed to it and the types its columns are
+    stored in when compacted. Versions are identified by name and version number.
+    """
+
+    name: str
+    version: int
+    columns: dict[str, pl.DataType] = field(compare=False)
+    rules: tuple[Rule | SchemaRule, ...] = field(default=(), compare=False)
+    prefixes: tuple[str, ...] = field(default=(), compare=False)
+    compact_types: dict[str, pl.DataType] = field(default_factory=dict, compare=False)
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}/v{self.version}"
+
+    @cached_property
+    def polars_schema(self) -> pl.Schema:
+        """
+        The schema the CSV reader is given, built once per warm container.
+        """
+        return pl.Schema(self.columns, check_dtypes=True)
+
+    def matches_header(self, header: Sequence[str]) -> bool:
+        return set(header) == set(self.columns)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SchemaVersion":
+        """
+        Build a schema from its JSON definition, e.g.
+
+            {"name": "processor-b", "version": 2, "prefixes": ["raw/processor-b/"],
+             "columns": {"txn_time": "Datetime", "card": "Int64", "is_fraud": "Int8"},
+             "rules": [{"type": "in_set", "column": "is_fraud", "values": [0, 1]}],
+             "compact": {"card": "Int32"}}
+
+        Every column gets a NonNullRule that flags it as missing, like in the built-in
+        schema; `rules` lists the checks on top of that. `compact` holds the types
+        columns are stored in with PARQUET_COMPACT.
+        """
+        compact = data.get("compact", {})
+        unknown = [
+            dtype for dtype in [*data["columns"].values(), *compact.values()] if dtype not in DTYPES
+        ]
+        if unknown:
+            raise ValueError(f"Unknown data type(s) in schema {data['name']}: {unknown}")
+        missing = [column for column in compact if column not in data["columns"]]
+        if missing:
+            raise ValueError(f"Compact type(s) of unknown column(s) in {data['name']}: {missing}")
+        columns = {column: DTYPES[dtype]() for column, dtype in data["columns"].items()}
+        rules: list[Rule] = [NonNullRule(column) for column in columns]
+        rules.extend(_rule_from_dict(rule) for rule in data.get("rules", []))
+        return cls(
+            data["name"],
+            int(data["version"]),
+            columns,
+            tuple(rules),
+            tuple(data.get("prefixes", [])),
+            {column: DTYPES[dtype]() for column, dtype in compact.items()},
+        )
+
+
+TRANSACTIONS_V1 = SchemaVersion(
+    "transactions", 1, EXPECTED_SCHEMA_MAPPING, DEFAULT_RULES, compact_types=COMPACT_TYPES
+)
+
+
+class SchemaRegistry:
+    """
+    Holds all schema versions and routes raw objects to one of them.
+    """
+
+    def __init__(self, default: SchemaVersion) -> None:
+        self.default = default
+        self._versions: dict[str, dict[int, SchemaVersion]] = {}
+        self.register(default)
+
+    @property
+    def schemas(self) -> list[SchemaVersion]:
+        return [schema for versions in self._versions.values() for schema in versions.values()]
+
+    def register(self, schema: SchemaVersion) -> None:
+        versions = self._versions.setdefault(schema.name, {})
+        if schema.version in versions:
+            raise ValueError(f"Schema {schema.id} is already registered")
+        versions[schema.version] = schema
+        logger.info(f"Registered schema {schema.id}")
+
+    def get(self, name: str, version: int | None = None) -> SchemaVersion:
+        """
+        Return a schema version, the latest one if `version` is None.
+        """
+        versions = self._versions.get(name, {})
+        if not versions or (version is not None and version not in versions):
+            raise ValueError(f"Unknown schema: {name} version {version or 'latest'}")
+        return versions[version if version is not None else max(versions)]
+
+    def resolve(
+        self, object_key: str, read_header: Callable[[], Sequence[str]] | None = None
+    ) -> SchemaVersion:
+        """
+        Route an object to a schema version.
+
+        The longest key prefix that matches selects the schema; the file's header then
+        selects the version. Objects outside all prefixes are routed by header alone.
+        The header is only read when more than one version is a candidate.
+
+        Args:
+            object_key (str): The S3 object key of the raw object.
+            read_header (Callable[[], Sequence[str]] | None): Returns the column names
+                in the file's header.
+
+        Returns:
+            SchemaVersion: The matching version; the latest version of the routed
+                schema, or the default schema, if no version matches the header.
+        """
+        prefix_matches = [
+            (len(prefix), name)
+            for name, versions in self._versions.items()
+            for schema in versions.values()
+            for prefix in schema.prefixes
+            if object_key.startswith(prefix)
+        ]
+        routed = max(prefix_matches)[1] if prefix_matches else None
+        candidates = list(self._versions[routed].values()) if routed else self.schemas
+        fallback = self.get(routed) if routed else self.default
+        if len(candidates) == 1 or read_header is None:
+            return fallback
+
+        header = read_header()
+        matching = [schema for schema in candidates if schema.matches_header(header)]
+        if not matching:
+            logger.warning(f"No schema matches the header of {object_key}, using {fallback.id}")
+            return fallback
+        return max(matching, key=lambda schema: schema.version)
+
+
+def read_header(source: str | bytes | IO[bytes]) -> list[str]:
+    """
+    Read the column names from the first line of a CSV file, its content or a buffer.
+    Buffers are left at their position.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            line = file.readline()
+    elif isinstance(source, bytes):
+        line = source.split(b"\n", 1)[0]
+    else:
+        position = source.tell()
+        line = source.readline()
+        source.seek(position)
+    return next(csv.reader([line.decode("utf-8-sig").rstrip("\r\n")]), [])
+
+
+def load_definitions(path: str) -> list[SchemaVersion]:
+    """
+    Load schema definitions from a JSON file, or from all JSON files in a directory.
+    A file holds one definition or a list of them.
+    """
+    if os.path.isdir(path):
+        paths = sorted(
+            os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")
+        )
+    else:
+        paths = [path]
+
+    schemas: list[SchemaVersion] = []
+    for definition_path in paths:
+        with open(definition_path) as file:
+            data = json.load(file)
+        schemas.extend(
+            SchemaVersion.from_dict(item) for item in (data if isinstance(data, list) else [data])
+        )
+    return schemas
+
+
+@cache
+def get_registry() -> SchemaRegistry:
+    """
+    The registry of the built-in schema and the definitions at SCHEMA_DEFINITIONS_PATH,
+    created on first use and shared by all warm invocations.
+    """
+    registry = SchemaRegistry(TRANSACTIONS_V1)
+    if SCHEMA_DEFINITIONS_PATH:
+        for schema in load_definitions(SCHEMA_DEFINITIONS_PATH):
+            registry.register(schema)
+    return registry
+
+
+def _rule_from_dict(data: dict) -> Rule:
+    data = dict(data)
+    rule_type = data.pop("type")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Unknown rule type: {rule_type}")
+    if "values" in data:
+        data["values"] = tuple(data["values"])
+    if rule_type != "non_null":
+        data.setdefault("message", f"Invalid values found in {data['column']} column")
+    return RULE_TYPES[rule_type](**data)
@@ -0,0 +1,112 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MB = 1024 * 1024
+SCRATCH_ROOT = os.getenv("SCRATCH_ROOT", "/tmp")
+# Lambda provides 512MB of ephemeral storage by default; leave headroom for libraries.
+SCRATCH_BUDGET_BYTES = int(os.getenv("SCRATCH_BUDGET_MB", "400")) * MB
+
+
+class ScratchSpace:
+    """
+    Hands out unique working directories below a common root and keeps the bytes
+    reserved by concurrent tasks within a disk budget.
+
+    Directories are removed when their task ends. Directories left behind by a
+    previous process, e.g. after a Lambda timeout, are removed on first use.
+    """
+
+    def __init__(self, root: str, budget_bytes: int) -> None:
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._reserved_bytes = 0
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    @property
+    def reserved_bytes(self) -> int:
+        with self._lock:
+            return self._reserved_bytes
+
+    def disk_usage(self) -> int:
+        """
+        Bytes currently stored in all working directories.
+        """
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(self.root)
+            for name in names
+        )
+
+    def reserve(self, size_bytes: int) -> bool:
+        """
+        Reserve disk space for a task if it fits both the budget and the free disk space.
+
+        Returns:
+            bool: True if the space was reserved.
+        """
+        with self._lock:
+            self._initialize()
+            free_bytes = shutil.disk_usage(self.root).free
+            if self._reserved_bytes + size_bytes > self.budget_bytes or size_bytes > free_bytes:
+                return False
+            self._reserved_bytes += size_bytes
+            return True
+
+    def release(self, size_bytes: int) -> None:
+        with self._lock:
+            self._reserved_bytes = max(0, self._reserved_bytes - size_bytes)
+
+    @contextmanager
+    def task(self, name: str, size_bytes: int = 0) -> Iterator[str | None]:
+        """
+        Provide a unique working directory for the duration of a task.
+
+        Args:
+            name (str): Prefix of the directory name, for readable paths.
+            size_bytes (int): Disk space the task expects to use.
+
+        Yields:
+            str | None: The directory, or None if the space does not fit the budget,
+                in which case the caller should keep its data off the disk.
+        """
+        if not self.reserve(size_bytes):
+            logger.warning(
+                f"Scratch budget exceeded for {name}: {size_bytes} bytes requested, "
+                f"{self.reserved_bytes} of {self.budget_bytes} bytes reserved"
+            )
+            yield None
+            return
+
+        directory = tempfile.mkdtemp(prefix=f"{_safe_name(name)}-", dir=self.root)
+        try:
+            yield directory
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            self.release(size_bytes)
+            logger.debug(f"Scratch directory {directory} removed")
+
+    def _initialize(self) -> None:
+        if self._initialized:
+            return
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+            logger.info(f"Removed leftover scratch space {self.root}")
+        os.makedirs(self.root, exist_ok=True)
+        self._initialized = True
+
+
+def _safe_name(name: str) -> str:
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in name)[:64]
+
+
+# One scratch space per container, shared by all concurrently processed records.
+scratch = ScratchSpace(os.path.join(SCRATCH_ROOT, "handler-scratch"), SCRATCH_BUDGET_BYTES)
@@ -0,0 +1,50 @@
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds spent per cold start phase, e.g. "import", "s3_client" or "first_invocation".
+# Only the first occurrence of a phase is recorded, later ones are warm reuse.
+_phases: dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def record(phase: str, seconds: float) -> None:
+    """
+    Record the duration of a cold start phase, unless it was recorded before.
+    """
+    with _lock:
+        if phase in _phases:
+            return
+        _phases[phase] = seconds
+    logger.info(f"Cold start phase {phase} took {seconds:.3f}s")
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Record the duration of the wrapped block as a cold start phase.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def get_startup_report() -> dict[str, float]:
+    """
+    Returns:
+        dict[str, float]: Seconds per cold start phase recorded so far in this process.
+    """
+    with _lock:
+        return dict(_phases)
+
+
+def reset() -> None:
+    with _lock:
+        _phases.clear()
@@ -1,33 +1,173 @@
+import io
 import logging
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cache
+from typing import IO, TYPE_CHECKING, Any
 
-import boto3
+from botocore.exceptions import ClientError
+
+from handler import startup
+from handler.metrics import stage
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client("s3")
+MB = 1024 * 1024
 REFINED_BUCKET_NAME = os.getenv("REFINED_BUCKET_NAME")
+STREAM_CHUNK_SIZE = 8 * MB
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "64")) * MB
+MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "16")) * MB
+MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+# copy_object only supports sources up to 5GB; larger objects need a multipart copy.
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * MB
+COPY_PART_SIZE = 512 * MB
+MAX_MULTIPART_PARTS = 10_000
+MAX_DELETE_BATCH = 1000
+# Returned by conditional writes whose If-Match/If-None-Match condition does not hold,
+# or that raced with another conditional write of the same key.
+PRECONDITION_ERROR_CODES = {"PreconditionFailed", "ConditionalRequestConflict"}
+# Every record processed concurrently by the handler runs its own transfer threads,
+# so the connection pool is sized for all of them by default.
+MAX_POOL_CONNECTIONS = int(
+    os.getenv(
+        "S3_MAX_POOL_CONNECTIONS",
+        str(MAX_CONCURRENCY * int(os.getenv("MAX_CONCURRENT_RECORDS", "4"))),
+    )
+)
 
+# Created on first use, so cold starts and rejected events do not pay for boto3, and
+# reused with its connection pool across warm invocations.
+s3: Any = None
+_s3_lock = threading.Lock()
 
-def download_file_from_s3(bucket_name: str, object_key: str) -> str:
+
+def get_s3_client() -> Any:
+    """
+    Return the shared S3 client, creating it on first use.
+    Creation is serialized, as boto3 sessions are not thread-safe.
+    """
+    global s3
+    if s3 is None:
+        with _s3_lock:
+            if s3 is None:
+                with startup.timed("s3_client"):
+                    import boto3
+                    from botocore.config import Config
+
+                    s3 = boto3.client(
+                        "s3", config=Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+                    )
+    return s3
+
+
+@cache
+def get_transfer_config() -> "TransferConfig":
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=MAX_CONCURRENCY,
+        use_threads=True,
+    )
+
+
+@dataclass(frozen=True)
+class TransferMetrics:
+    operation: str
+    object_key: str
+    size_bytes: int
+    seconds: float
+
+    @property
+    def throughput_mb_per_second(self) -> float:
+        return self.size_bytes / MB / self.seconds if self.seconds > 0 else 0.0
+
+
+_transfer_metrics: list[TransferMetrics] = []
+_transfer_metrics_lock = threading.Lock()
+
+
+def get_transfer_metrics() -> list[TransferMetrics]:
+    """
+    Return the metrics of all transfers recorded since the last reset.
+    """
+    with _transfer_metrics_lock:
+        return list(_transfer_metrics)
+
+
+def reset_transfer_metrics() -> None:
+    with _transfer_metrics_lock:
+        _transfer_metrics.clear()
+
+
+def drain_transfer_metrics() -> list[TransferMetrics]:
+    """
+    Return the metrics of all transfers recorded since the last reset, and reset them.
+    """
+    with _transfer_metrics_lock:
+        transfers = list(_transfer_metrics)
+        _transfer_metrics.clear()
+        return transfers
+
+
+class _ByteCounter:
+    """
+    Transfer callback counting the bytes moved by all threads of a managed transfer.
+    """
+
+    def __init__(self) -> None:
+        self.size_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self._lock:
+            self.size_bytes += bytes_amount
+
+
+def _record_transfer(operation: str, object_key: str, size_bytes: int, started: float) -> None:
+    metrics = TransferMetrics(operation, object_key, size_bytes, time.perf_counter() - started)
+    with _transfer_metrics_lock:
+        _transfer_metrics.append(metrics)
+    logger.info(
+        f"{operation} of {object_key}: {size_bytes} bytes in {metrics.seconds:.3f}s "
+        f"({metrics.throughput_mb_per_second:.2f} MB/s)"
+    )
+
+
+def download_file_from_s3(bucket_name: str, object_key: str, local_dir: str = "/tmp") -> str:
     """
     Download a file from an S3 bucket.
 
     Args:
         bucket_name (str): The name of the S3 bucket.
         object_key (str): The S3 object key (path) of the file to download.
+        local_dir (str): Directory to download into, e.g. a scratch directory of the task.
     Returns:
         str: The local path where the file is downloaded.
     """
-    local_path = f"/tmp/{os.path.basename(object_key)}"
+    local_path = os.path.join(local_dir, os.path.basename(object_key))
 
-    try:
-        s3.download_file(bucket_name, object_key, local_path)
-        logger.info(f"File successfully downloaded to {local_path}")
-    except Exception as e:
-        logger.exception(f"Error downloading {object_key} from bucket {bucket_name}: {e}")
-        raise
+    with stage("download", object_key=object_key) as measured:
+        try:
+            counter, started = _ByteCounter(), time.perf_counter()
+            get_s3_client().download_file(
+                bucket_name, object_key, local_path, Config=get_transfer_config(), Callback=counter
+            )
+            logger.info(f"File successfully downloaded to {local_path}")
+            _record_transfer("download", object_key, counter.size_bytes, started)
+            measured.bytes_in = counter.size_bytes
+        except Exception as e:
+            logger.exception(f"Error downloading {object_key} from bucket {bucket_name}: {e}")
+            raise
     return local_path
 
 
@@ -43,11 +183,411 @@ def upload_file_to_s3(object_key: str, file_path: str) -> None:
         None
     """
     logger.info(f"Attempting to upload {file_path} to s3://{REFINED_BUCKET_NAME}/{object_key}")
+    with stage("upload", object_key=object_key) as measured:
+        try:
+            counter, started = _ByteCounter(), time.perf_counter()
+            get_s3_client().upload_file(
+                file_path,
+                REFINED_BUCKET_NAME,
+                object_key,
+                Config=get_transfer_config(),
+                Callback=counter,
+            )
+            logger.info(f"File successfully uploaded to s3://{REFINED_BUCKET_NAME}/{object_key}")
+            _record_transfer("upload", object_key, counter.size_bytes, started)
+            measured.bytes_out = counter.size_bytes
+        except Exception as e:
+            logger.exception(
+                f"Error uploading {file_path} to s3://{REFINED_BUCKET_NAME}/{object_key}: {e}"
+            )
+            raise
+
+
+def download_fileobj_from_s3(bucket_name: str, object_key: str) -> io.BytesIO:
+    """
+    Download a file from an S3 bucket into memory, without touching the local disk.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The S3 object key (path) of the file to download.
+    Returns:
+        io.BytesIO: Buffer holding the object body, positioned at the start.
+    """
+    buffer = io.BytesIO()
+
+    with stage("download", object_key=object_key) as measured:
+        try:
+            started = time.perf_counter()
+            response = get_s3_client().get_object(Bucket=bucket_name, Key=object_key)
+            for chunk in response["Body"].iter_chunks(chunk_size=STREAM_CHUNK_SIZE):
+                buffer.write(chunk)
+            buffer.seek(0)
+            logger.info(
+                f"File successfully downloaded into memory ({buffer.getbuffer().nbytes} bytes)"
+            )
+            _record_transfer("download", object_key, buffer.getbuffer().nbytes, started)
+            measured.bytes_in = buffer.getbuffer().nbytes
+        except Exception as e:
+            logger.exception(f"Error downloading {object_key} from bucket {bucket_name}: {e}")
+            raise
+    return buffer
+
+
+def get_object_size(bucket_name: str, object_key: str) -> int:
+    """
+    Return the size of an object in bytes with a head_object call.
+    """
+    try:
+        return get_s3_client().head_object(Bucket=bucket_name, Key=object_key)["ContentLength"]
+    except Exception as e:
+        logger.exception(f"Error reading size of {object_key} in bucket {bucket_name}: {e}")
+        raise
+
+
+def get_object_etag(object_key: str) -> str:
+    """
+    Return the ETag of an object in the refined bucket with a head_object call.
+    """
+    try:
+        return get_s3_client().head_object(Bucket=REFINED_BUCKET_NAME, Key=object_key)["ETag"]
+    except Exception as e:
+        logger.exception(f"Error reading ETag of {object_key} in bucket {REFINED_BUCKET_NAME}: {e}")
+        raise
+
+
+def get_object_checksum(bucket_name: str, object_key: str) -> dict:
+    """
+    Return the checksum S3 stored for an object, with a head_object call.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The S3 object key (path) of the object.
+
+    Returns:
+        dict: The Checksum* fields and ChecksumType of the object (empty if S3 stored
+            no checksum), and its ContentLength.
+    """
+    try:
+        response = get_s3_client().head_object(
+            Bucket=bucket_name, Key=object_key, ChecksumMode="ENABLED"
+        )
+        return {
+            name: value
+            for name, value in response.items()
+            if name.startswith("Checksum") or name == "ContentLength"
+        }
+    except Exception as e:
+        logger.exception(f"Error reading checksum of {object_key} in bucket {bucket_name}: {e}")
+        raise
+
+
+def get_object_range(bucket_name: str, object_key: str, start: int, end: int) -> bytes:
+    """
+    Read a byte range of an object with a ranged GET.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The S3 object key (path) of the object.
+        start (int): Offset of the first byte.
+        end (int): Offset of the last byte, inclusive.
+
+    Returns:
+        bytes: The bytes of the range.
+    """
     try:
-        s3.upload_file(file_path, REFINED_BUCKET_NAME, object_key)
-        logger.info(f"File successfully uploaded to s3://{REFINED_BUCKET_NAME}/{object_key}")
+        started = time.perf_counter()
+        response = get_s3_client().get_object(
+            Bucket=bucket_name, Key=object_key, Range=f"bytes={start}-{end}"
+        )
+        data = response["Body"].read()
+        _record_transfer("ranged_get", object_key, len(data), started)
+        return data
     except Exception as e:
         logger.exception(
-            f"Error uploading {file_path} to s3://{REFINED_BUCKET_NAME}/{object_key}: {e}"
+            f"Error reading bytes {start}-{end} of {object_key} from bucket {bucket_name}: {e}"
         )
         raise
+
+
+def upload_fileobj_to_s3(object_key: str, buffer: IO[bytes]) -> None:
+    """
+    Upload an in-memory buffer to an S3 bucket.
+    Large buffers are transferred as a multipart upload.
+
+    Args:
+        object_key (str): The S3 object key (path) where the file will be uploaded.
+        buffer (IO[bytes]): The buffer to upload, read from its start.
+
+    Returns:
+        None
+    """
+    logger.info(f"Attempting to upload buffer to s3://{REFINED_BUCKET_NAME}/{object_key}")
+    with stage("upload", object_key=object_key) as measured:
+        try:
+            buffer.seek(0)
+            counter, started = _ByteCounter(), time.perf_counter()
+            get_s3_client().upload_fileobj(
+                buffer,
+                REFINED_BUCKET_NAME,
+                object_key,
+                Config=get_transfer_config(),
+                Callback=counter,
+            )
+            logger.info(f"Buffer successfully uploaded to s3://{REFINED_BUCKET_NAME}/{object_key}")
+            _record_transfer("upload", object_key, counter.size_bytes, started)
+            measured.bytes_out = counter.size_bytes
+        except Exception as e:
+            logger.exception(
+                f"Error uploading buffer to s3://{REFINED_BUCKET_NAME}/{object_key}: {e}"
+            )
+            raise
+
+
+def copy_object_to_refined_bucket(
+    source_bucket: str, source_key: str, object_key: str, if_match: str | None = None
+) -> None:
+    """
+    Copy an object into the refined bucket with a server-side copy, so the payload
+    never travels through the Lambda function.
+    Objects larger than 5GB are copied as a multipart upload with upload_part_copy.
+    With `if_match` the copy fails with PreconditionFailed unless the source object
+    still has that ETag.
+
+    Args:
+        source_bucket (str): The name of the bucket holding the source object.
+        source_key (str): The S3 object key (path) of the source object.
+        object_key (str): The S3 object key (path) of the copy in the refined bucket.
+        if_match (str | None): ETag the source object must have.
+
+    Returns:
+        None
+    """
+    source = f"s3://{source_bucket}/{source_key}"
+    destination = f"s3://{REFINED_BUCKET_NAME}/{object_key}"
+    logger.info(f"Attempting server-side copy of {source} to {destination}")
+    with stage("copy", object_key=object_key) as measured:
+        try:
+            started, client = time.perf_counter(), get_s3_client()
+            head_conditions = {"IfMatch": if_match} if if_match else {}
+            conditions = {"CopySourceIfMatch": if_match} if if_match else {}
+            size = client.head_object(Bucket=source_bucket, Key=source_key, **head_conditions)[
+                "ContentLength"
+            ]
+            copy_source = {"Bucket": source_bucket, "Key": source_key}
+            if size <= MAX_COPY_OBJECT_SIZE:
+                client.copy_object(
+                    Bucket=REFINED_BUCKET_NAME,
+                    Key=object_key,
+                    CopySource=copy_source,
+                    **conditions,
+                )
+            else:
+                _multipart_copy(copy_source, object_key, size, conditions)
+            logger.info(f"Object successfully copied to {destination}")
+            _record_transfer("copy", object_key, size, started)
+            measured.bytes_out = size
+        except Exception as e:
+            logger.exception(f"Error copying {source} to {destination}: {e}")
+            raise
+
+
+def _multipart_copy(copy_source: dict, object_key: str, size: int, conditions: dict) -> None:
+    part_size = max(COPY_PART_SIZE, math.ceil(size / MAX_MULTIPART_PARTS))
+    client = get_s3_client()
+    upload_id = client.create_multipart_upload(Bucket=REFINED_BUCKET_NAME, Key=object_key)[
+        "UploadId"
+    ]
+
+    def copy_part(part_number: int) -> dict:
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = client.upload_part_copy(
+            Bucket=REFINED_BUCKET_NAME,
+            Key=object_key,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+            PartNumber=part_number,
+            UploadId=upload_id,
+            **conditions,
+        )
+        return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            parts = list(executor.map(copy_part, range(1, math.ceil(size / part_size) + 1)))
+        client.complete_multipart_upload(
+            Bucket=REFINED_BUCKET_NAME,
+            Key=object_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        client.abort_multipart_upload(
+            Bucket=REFINED_BUCKET_NAME, Key=object_key, UploadId=upload_id
+        )
+        raise
+
+
+def put_bytes_to_s3(
+    object_key: str, data: bytes, if_match: str | None = None, if_none_match: bool = False
+) -> str:
+    """
+    Write a small object to the refined bucket with a single put_object call.
+    Optionally the write is conditional: `if_match` only overwrites the object if its
+    ETag still matches, `if_none_match` only creates it if it does not exist yet. A
+    failed condition raises a ClientError with code PreconditionFailed.
+
+    Args:
+        object_key (str): The S3 object key (path) of the object.
+        data (bytes): The object body.
+        if_match (str | None): ETag the current object must have.
+        if_none_match (bool): Whether the object must not exist yet.
+
+    Returns:
+        str: The ETag of the written object.
+    """
+    conditions: dict = {}
+    if if_match:
+        conditions["IfMatch"] = if_match
+    if if_none_match:
+        conditions["IfNoneMatch"] = "*"
+
+    try:
+        response = get_s3_client().put_object(
+            Bucket=REFINED_BUCKET_NAME, Key=object_key, Body=data, **conditions
+        )
+        logger.debug(f"Object written to s3://{REFINED_BUCKET_NAME}/{object_key}")
+        return response.get("ETag", "")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in PRECONDITION_ERROR_CODES:
+            logger.warning(f"Conditional write of s3://{REFINED_BUCKET_NAME}/{object_key} failed")
+        else:
+            logger.exception(f"Error writing s3://{REFINED_BUCKET_NAME}/{object_key}: {e}")
+        raise
+    except Exception as e:
+        logger.exception(f"Error writing s3://{REFINED_BUCKET_NAME}/{object_key}: {e}")
+        raise
+
+
+def object_exists(object_key: str) -> bool:
+    """
+    Check whether an object exists in the refined bucket with a head_object call.
+
+    Args:
+        object_key (str): The S3 object key (path) of the object.
+
+    Returns:
+        bool: True if the object exists.
+    """
+    try:
+        get_s3_client().head_object(Bucket=REFINED_BUCKET_NAME, Key=object_key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        logger.exception(f"Error checking s3://{REFINED_BUCKET_NAME}/{object_key}: {e}")
+        raise
+
+
+def get_bytes_with_etag_from_s3(object_key: str) -> tuple[bytes, str]:
+    """
+    Read a small object from the refined bucket together with its ETag.
+
+    Args:
+        object_key (str): The S3 object key (path) of the object.
+
+    Returns:
+        tuple[bytes, str]: The object body and its ETag.
+    """
+    try:
+        response = get_s3_client().get_object(Bucket=REFINED_BUCKET_NAME, Key=object_key)
+        return response["Body"].read(), response["ETag"]
+    except Exception as e:
+        logger.exception(f"Error reading s3://{REFINED_BUCKET_NAME}/{object_key}: {e}")
+        raise
+
+
+def get_bytes_from_s3(object_key: str) -> bytes:
+    """
+    Read a small object from the refined bucket into memory.
+
+    Args:
+        object_key (str): The S3 object key (path) of the object.
+
+    Returns:
+        bytes: The object body.
+    """
+    try:
+        return get_s3_client().get_object(Bucket=REFINED_BUCKET_NAME, Key=object_key)["Body"].read()
+    except Exception as e:
+        logger.exception(f"Error reading s3://{REFINED_BUCKET_NAME}/{object_key}: {e}")
+        raise
+
+
+def list_object_keys(prefix: str) -> list[str]:
+    """
+    List the keys of all objects under a prefix of the refined bucket.
+
+    Args:
+        prefix (str): The key prefix to list.
+
+    Returns:
+        list[str]: The object keys, in lexicographical order.
+    """
+    try:
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        return [
+            obj["Key"]
+            for page in paginator.paginate(Bucket=REFINED_BUCKET_NAME, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        ]
+    except Exception as e:
+        logger.exception(f"Error listing s3://{REFINED_BUCKET_NAME}/{prefix}: {e}")
+        raise
+
+
+def list_objects(bucket_name: str, prefix: str) -> list[dict]:
+    """
+    List all objects under a prefix of any bucket, e.g. the raw bucket.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        prefix (str): The key prefix to list.
+
+    Returns:
+        list[dict]: The list_objects_v2 entries (Key, Size, ETag, ...), in
+            lexicographical order of their keys.
+    """
+    try:
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        return [
+            obj
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        ]
+    except Exception as e:
+        logger.exception(f"Error listing s3://{bucket_name}/{prefix}: {e}")
+        raise
+
+
+def delete_objects_from_s3(object_keys: list[str]) -> None:
+    """
+    Delete objects from the refined bucket in batches of up to 1000 keys.
+
+    Args:
+        object_keys (list[str]): The S3 object keys to delete.
+
+    Returns:
+        None
+    """
+    try:
+        for start in range(0, len(object_keys), MAX_DELETE_BATCH):
+            batch = object_keys[start : start + MAX_DELETE_BATCH]
+            get_s3_client().delete_objects(
+                Bucket=REFINED_BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        logger.info(f"Deleted {len(object_keys)} object(s) from s3://{REFINED_BUCKET_NAME}")
+    except Exception as e:
+        logger.exception(f"Error deleting objects from s3://{REFINED_BUCKET_NAME}: {e}")
+        raise
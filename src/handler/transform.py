@@ -1,28 +1,251 @@
+import io
 import logging
+import os
+from dataclasses import dataclass
+from typing import TypeVar
 
 import polars as pl
 
+from handler.metrics import stage
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+FrameT = TypeVar("FrameT", pl.DataFrame, pl.LazyFrame)
+
+PARTITION_COLUMNS = {
+    "date": ("trans_date", pl.col("trans_date_trans_time").dt.date()),
+    "category": ("category", pl.col("category")),
+}
+# Directory value of null partition keys, as written and read by Hive, Athena and Spark.
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+@dataclass(frozen=True)
+class ParquetOptions:
+    """
+    Options for writing Parquet files. The defaults match the Polars defaults.
 
-def transform_dataframe_to_parquet(dataframe: pl.DataFrame, filename: str) -> str:
+    `dictionary_columns` are cast to Categorical before writing, which makes Polars
+    dictionary-encode them; the native writer has no per-column dictionary switch.
+    `partition_by` holds keys of PARTITION_COLUMNS to split the output into
+    hive-style partitions by. `compact` stores columns in the compact types their
+    schema declares, see compact_frame.
+    """
+
+    compression: str = "zstd"
+    compression_level: int | None = None
+    row_group_size: int | None = None
+    statistics: bool = True
+    dictionary_columns: tuple[str, ...] = ()
+    partition_by: tuple[str, ...] = ()
+    compact: bool = False
+
+    def __post_init__(self) -> None:
+        unknown = [key for key in self.partition_by if key not in PARTITION_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown partition key(s): {', '.join(unknown)}")
+
+    def write_kwargs(self) -> dict:
+        return {
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "row_group_size": self.row_group_size,
+            "statistics": self.statistics,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ParquetOptions":
+        level = os.getenv("PARQUET_COMPRESSION_LEVEL")
+        row_group_size = os.getenv("PARQUET_ROW_GROUP_SIZE")
+        return cls(
+            compression=os.getenv("PARQUET_COMPRESSION", "zstd"),
+            compression_level=int(level) if level else None,
+            row_group_size=int(row_group_size) if row_group_size else None,
+            statistics=os.getenv("PARQUET_STATISTICS", "true").lower() == "true",
+            dictionary_columns=_split(os.getenv("PARQUET_DICTIONARY_COLUMNS", "")),
+            partition_by=_split(os.getenv("PARQUET_PARTITION_BY", "")),
+            compact=os.getenv("PARQUET_COMPACT", "false").lower() == "true",
+        )
+
+
+def _split(value: str) -> tuple[str, ...]:
+    return tuple(part.strip() for part in value.split(",") if part.strip())
+
+
+PARQUET_OPTIONS = ParquetOptions.from_env()
+
+
+def transform_dataframe_to_parquet(
+    dataframe: pl.DataFrame,
+    filename: str,
+    options: ParquetOptions = PARQUET_OPTIONS,
+    local_dir: str = "/tmp",
+) -> str:
     """
     Transform DataFrame to Parquet file.
 
     Args:
         dataframe (pl.DataFrame): DataFrame containing the loaded CSV data.
         filename (str): Filename for the output Parquet file.
+        options (ParquetOptions): Compression, row group and statistics settings.
+        local_dir (str): Directory to write into, e.g. a scratch directory of the task.
 
     Returns:
         str: Path to the output Parquet file.
     """
     logger.info(f"Transforming data into {filename}")
-    tmp_path = f"/tmp/{filename}"
-    try:
-        dataframe.write_parquet(tmp_path)
-        logger.info(f"File written to {tmp_path}")
-        return tmp_path
-    except Exception as e:
-        logger.exception(f"Failed to write Parquet file: {e}")
-        raise
+    tmp_path = os.path.join(local_dir, filename)
+    with stage("write_parquet") as measured:
+        try:
+            measured.rows = len(dataframe)
+            _encode(dataframe, options).write_parquet(tmp_path, **options.write_kwargs())
+            logger.info(f"File written to {tmp_path}")
+            return tmp_path
+        except Exception as e:
+            logger.exception(f"Failed to write Parquet file: {e}")
+            raise
+
+
+def sink_lazyframe_to_parquet(
+    lazyframe: pl.LazyFrame,
+    filename: str,
+    options: ParquetOptions = PARQUET_OPTIONS,
+    local_dir: str = "/tmp",
+) -> str:
+    """
+    Stream LazyFrame to Parquet file without materializing it in memory.
+
+    Args:
+        lazyframe (pl.LazyFrame): LazyFrame over the validated CSV data.
+        filename (str): Filename for the output Parquet file.
+        options (ParquetOptions): Compression, row group and statistics settings.
+        local_dir (str): Directory to write into, e.g. a scratch directory of the task.
+
+    Returns:
+        str: Path to the output Parquet file.
+    """
+    logger.info(f"Streaming data into {filename}")
+    tmp_path = os.path.join(local_dir, filename)
+    with stage("write_parquet"):
+        try:
+            _encode(lazyframe, options).sink_parquet(tmp_path, **options.write_kwargs())
+            logger.info(f"File written to {tmp_path}")
+            return tmp_path
+        except Exception as e:
+            logger.exception(f"Failed to sink Parquet file: {e}")
+            raise
+
+
+def transform_to_parquet_buffer(
+    frame: pl.DataFrame | pl.LazyFrame, options: ParquetOptions = PARQUET_OPTIONS
+) -> io.BytesIO:
+    """
+    Transform DataFrame or LazyFrame to an in-memory Parquet file.
+
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): Validated data. LazyFrames are streamed
+            into the buffer with sink_parquet.
+        options (ParquetOptions): Compression, row group and statistics settings.
+
+    Returns:
+        io.BytesIO: Buffer holding the Parquet file, positioned at the start.
+    """
+    logger.info("Transforming data into in-memory Parquet buffer")
+    buffer = io.BytesIO()
+    with stage("write_parquet") as measured:
+        try:
+            if isinstance(frame, pl.LazyFrame):
+                _encode(frame, options).sink_parquet(buffer, **options.write_kwargs())
+            else:
+                measured.rows = len(frame)
+                _encode(frame, options).write_parquet(buffer, **options.write_kwargs())
+            buffer.seek(0)
+            measured.bytes_out = buffer.getbuffer().nbytes
+            logger.info(f"Parquet buffer written ({measured.bytes_out} bytes)")
+            return buffer
+        except Exception as e:
+            logger.exception(f"Failed to write Parquet buffer: {e}")
+            raise
+
+
+def partition_input_columns(options: ParquetOptions = PARQUET_OPTIONS) -> set[str]:
+    """
+    The input columns the partition keys in `options.partition_by` are derived from.
+    """
+    return {
+        column
+        for key in options.partition_by
+        for column in PARTITION_COLUMNS[key][1].meta.root_names()
+    }
+
+
+def partition_frame(
+    frame: pl.DataFrame | pl.LazyFrame, options: ParquetOptions = PARQUET_OPTIONS
+) -> dict[str, pl.DataFrame]:
+    """
+    Split the data into hive-style partitions by the keys in `options.partition_by`.
+    Partition values are encoded in the path and dropped from the data, as query
+    engines expect for partitioned tables; null values become HIVE_DEFAULT_PARTITION.
+    A LazyFrame is collected first.
+
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): Validated data.
+        options (ParquetOptions): Settings holding the partition keys.
+
+    Returns:
+        dict[str, pl.DataFrame]: The partitions keyed by their relative path,
+            e.g. "trans_date=2020-06-21/category=travel".
+    """
+    dataframe = frame.collect() if isinstance(frame, pl.LazyFrame) else frame
+    columns = [PARTITION_COLUMNS[key] for key in options.partition_by]
+    names = [name for name, _ in columns]
+    with_keys = dataframe.with_columns(expr.alias(name) for name, expr in columns)
+
+    partitions = with_keys.partition_by(names, as_dict=True, include_key=False)
+    logger.info(f"Split {len(dataframe)} rows into {len(partitions)} partition(s) by {names}")
+    return {
+        "/".join(
+            f"{name}={HIVE_DEFAULT_PARTITION if value is None else value}"
+            for name, value in zip(names, values)
+        ): partition
+        for values, partition in partitions.items()
+    }
+
+
+def compact_frame(
+    frame: pl.DataFrame | pl.LazyFrame, compact_types: dict[str, pl.DataType]
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Cast the data to the compact types its schema declares, shrinking it in memory and
+    in the Parquet files. As the types come from the schema and not from the values,
+    every file of a schema has the same Parquet schema. A value that does not fit its
+    compact type fails the cast instead of being truncated.
+
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): Validated data.
+        compact_types (dict[str, pl.DataType]): The type of every column to compact.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The data with the compact types.
+    """
+    with stage("compact") as measured:
+        columns = frame.collect_schema()
+        casts = {col: dtype for col, dtype in compact_types.items() if col in columns}
+        compacted = frame.with_columns(
+            pl.col(col).cast(dtype, strict=True) for col, dtype in casts.items()
+        )
+        if isinstance(compacted, pl.DataFrame):
+            measured.rows = len(compacted)
+        logger.info(
+            "Compacted column types: "
+            + (", ".join(f"{col}={dtype}" for col, dtype in casts.items()) or "none")
+        )
+        return compacted
+
+
+def _encode(frame: FrameT, options: ParquetOptions) -> FrameT:
+    columns = [col for col in options.dictionary_columns if col in frame.collect_schema()]
+    if not columns:
+        return frame
+    return frame.with_columns(pl.col(columns).cast(pl.Categorical))
@@ -1,115 +1,298 @@
 import logging
+import os
+from collections.abc import Iterator, Sequence
+from contextlib import nullcontext
+from functools import cache
+from typing import IO
 
 import polars as pl
 
+from handler.metrics import stage
+from handler.rules import (
+    NonNullRule,
+    Rule,
+    SchemaRule,
+    ValidationReport,
+    evaluate_rules,
+    merge_reports,
+    split_rows,
+)
+
+# The built-in schema and its rules are re-exported, they used to be defined here.
+from handler.schemas import (  # noqa: F401
+    DEFAULT_RULES,
+    EXPECTED_SCHEMA_MAPPING,
+    IS_FRAUD_RULE,
+    TRANSACTIONS_V1,
+    ZIP_PATTERN,
+    ZIP_RULE,
+    SchemaVersion,
+    read_header,
+)
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Files that are not routed through the schema registry are read with this schema.
+DEFAULT_SCHEMA = TRANSACTIONS_V1
+
+# Streaming validation parses the file in record-aligned blocks of about this size.
+STREAMING_BLOCK_SIZE = int(os.getenv("STREAMING_BLOCK_MB", "16")) * 1024 * 1024
+
+
+@cache
+def _expected_schema() -> pl.Schema:
+    return DEFAULT_SCHEMA.polars_schema
 
-def load_and_validate_csv(input_path: str) -> pl.DataFrame:
+
+def load_and_validate_csv(
+    input_path: str | IO[bytes], schema: SchemaVersion = DEFAULT_SCHEMA
+) -> pl.DataFrame:
     """
     Load and validate CSV file.
     This function reads a CSV file, validates its schema, and checks for null-only columns.
 
     Args:
-        input_path (str): Path to the input CSV file.
+        input_path (str | IO[bytes]): Path to the input CSV file, or an in-memory buffer.
+        schema (SchemaVersion): The schema to read and validate the file with.
 
     Returns:
         pl.DataFrame: DataFrame containing the loaded CSV data.
     """
     logger.info(f"Loading and validating file from: {input_path}")
-    expected_schema_mapping = {
-        "trans_date_trans_time": pl.Datetime(),
-        "cc_num": pl.Int64(),
-        "merchant": pl.Utf8(),
-        "category": pl.Utf8(),
-        "amt": pl.Float64(),
-        "first": pl.Utf8(),
-        "last": pl.Utf8(),
-        "gender": pl.Utf8(),
-        "street": pl.Utf8(),
-        "city": pl.Utf8(),
-        "state": pl.Utf8(),
-        "zip": pl.Utf8(),
-        "lat": pl.Float64(),
-        "long": pl.Float64(),
-        "city_pop": pl.Int64(),
-        "job": pl.Utf8(),
-        "dob": pl.Date(),
-        "trans_num": pl.Utf8(),
-        "unix_time": pl.Int64(),
-        "merch_lat": pl.Float64(),
-        "merch_long": pl.Float64(),
-        "is_fraud": pl.Int8(),
-    }
-    expected_schema = pl.Schema(expected_schema_mapping, check_dtypes=True)
-    try:
-        df = pl.read_csv(input_path, schema=expected_schema, try_parse_dates=True, quote_char='"')
-        logger.info(f"Loaded {len(df)} rows from {input_path}")
-    except Exception as e:
-        logger.exception(f"Failed to load CSV with Polars: {e}")
-        raise
+    df = read_csv(input_path, schema)
 
-    expected_columns = set(expected_schema_mapping.keys())
+    report = validate_dataframe(df, schema.rules)
+    raise_for_report(report)
 
-    try:
-        logger.info("Checking for null-only columns")
-        null_only_columns = {
-            col for col in expected_columns if col in df.columns and df[col].null_count() == len(df)
-        }
-    except Exception as e:
-        logger.exception(f"Error checking null-only columns: {e}")
-        raise
+    logger.info(f"Loaded and validated {len(df)} rows from {input_path}")
+    return df
+
+
+def read_csv(
+    input_path: str | bytes | IO[bytes], schema: SchemaVersion = DEFAULT_SCHEMA
+) -> pl.DataFrame:
+    """
+    Read CSV data with the expected schema.
+
+    Args:
+        input_path (str | bytes | IO[bytes]): Path to the CSV file, its content, or a buffer.
+        schema (SchemaVersion): The schema of the file.
+
+    Returns:
+        pl.DataFrame: The loaded data.
+    """
+    with stage("load") as measured:
+        try:
+            df = pl.read_csv(
+                input_path, schema=schema.polars_schema, try_parse_dates=True, quote_char='"'
+            )
+            logger.info(f"Loaded {len(df)} rows")
+            measured.rows = len(df)
+            return df
+        except Exception as e:
+            logger.exception(f"Failed to load CSV with Polars: {e}")
+            raise
+
+
+def preflight_csv(sample: bytes, schema: SchemaVersion, complete: bool = False) -> int:
+    """
+    Check the start of a CSV file before it is downloaded: the header must have all
+    columns of the schema and the rows of the sample must parse with its types, so
+    files with the wrong layout are rejected without transferring them.
+
+    Args:
+        sample (bytes): The first bytes of the file.
+        schema (SchemaVersion): The schema the file is routed to.
+        complete (bool): Whether the sample is the whole file; otherwise its last,
+            possibly cut off, record is not checked.
+
+    Returns:
+        int: The number of sample rows that were type-checked.
+    """
+    with stage("preflight") as measured:
+        measured.bytes_in = len(sample)
+        header = read_header(sample)
+        missing_columns = [col for col in schema.columns if col not in header]
+        if missing_columns:
+            for col in missing_columns:
+                logger.error(f"Missing column in the DataFrame: {col}")
+
+            raise ValueError(f"Missing column in the DataFrame: {missing_columns[-1]}")
+
+        records = sample if complete else _complete_records(sample)
+        try:
+            df = pl.read_csv(
+                records, schema=schema.polars_schema, try_parse_dates=True, quote_char='"'
+            )
+        except Exception as e:
+            reason = str(e).splitlines()[0]
+            logger.error(f"Sample rows do not match schema {schema.id}: {reason}")
+            raise ValueError(f"Sample rows do not match schema {schema.id}: {reason}") from e
+
+        measured.rows = len(df)
+        logger.info(f"Preflight passed: header and {len(df)} sample row(s) match {schema.id}")
+        return len(df)
+
+
+def _complete_records(sample: bytes) -> bytes:
+    # A newline only ends a record outside quoted fields, i.e. after an even number of quotes.
+    end = sample.rfind(b"\n")
+    while end != -1 and sample.count(b'"', 0, end) % 2 == 1:
+        end = sample.rfind(b"\n", 0, end)
+    return sample[: end + 1]
+
+
+def validate_dataframe(
+    frame: pl.DataFrame | pl.LazyFrame, rules: Sequence[Rule | SchemaRule] = DEFAULT_RULES
+) -> ValidationReport:
+    """
+    Evaluate the validation rules against the data in a single pass.
 
+    Args:
+        frame (pl.DataFrame | pl.LazyFrame): Data to validate.
+        rules (Sequence[Rule | SchemaRule]): Rules to evaluate, DEFAULT_RULES by default.
+
+    Returns:
+        ValidationReport: Violation counts and sample rows per rule.
+    """
+    report = evaluate_rules(frame, rules)
+    logger.info(f"Validation report: {report.as_dict()}")
+    return report
+
+
+def raise_for_report(report: ValidationReport) -> None:
+    """
+    Raise a ValueError describing the first failure of the report, if any.
+    Null-only columns are reported first, as they were missing from the file.
+    """
+    null_only_columns = [
+        result.rule.column
+        for result in report.failures
+        if isinstance(result.rule, NonNullRule) and result.rule.allow_partial
+    ]
     if null_only_columns:
         for col in null_only_columns:
             logger.error(f"Missing column in the DataFrame: {col}")
 
-        raise ValueError(f"Missing column in the DataFrame: {col}")
+        raise ValueError(f"Missing column in the DataFrame: {null_only_columns[-1]}")
 
-    validate_is_fraud_column(df)
-    validate_zip_column(df)
+    for result in report.failures:
+        rule = result.rule
+        if isinstance(rule, Rule):
+            raise ValueError(f"{rule.message}: {result.sample.get_column(rule.column)}")
+        raise ValueError(f"{rule.message}: {result.violations} column(s) do not match")
 
-    logger.info(f"Loaded and validated {len(df)} rows from {input_path}")
-    return df
 
+def split_invalid_rows(
+    df: pl.DataFrame, max_error_rate: float, rules: Sequence[Rule | SchemaRule] = DEFAULT_RULES
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Validate the data row by row instead of rejecting the whole file for one bad row.
+    Rules that judge the file as a whole, such as missing columns, still raise.
 
-def validate_is_fraud_column(df: pl.DataFrame) -> None:
-    logger.info("Checking is_fraud values")
-    is_fraud_col = df.get_column("is_fraud")
+    Args:
+        df (pl.DataFrame): Data to validate.
+        max_error_rate (float): Largest tolerated share of invalid rows, from 0 to 1.
+        rules (Sequence[Rule | SchemaRule]): Rules to evaluate, DEFAULT_RULES by default.
 
-    try:
-        invalid = is_fraud_col.filter(~is_fraud_col.is_in([0, 1]))
-        logger.info(f"Invalid is_fraud values count: {invalid.len()}")
-    except Exception as e:
-        logger.exception(f"is_fraud column validation failed {e}")
-        raise
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: The valid rows, and the invalid rows with
+            the violated rules in a "reason" column.
+    """
+    row_rules = [rule for rule in rules if isinstance(rule, Rule) and rule.row_level]
+    file_rules = [rule for rule in rules if rule not in row_rules]
+    raise_for_report(validate_dataframe(df, file_rules))
 
-    if invalid.len() > 0:
-        raise ValueError(f"Invalid values found in is_fraud column: {invalid}")
-    else:
-        logger.info("All is_fraud values are valid")
+    valid, invalid = split_rows(df, row_rules)
+    error_rate = len(invalid) / len(df) if len(df) else 0.0
+    if error_rate > max_error_rate:
+        logger.error(f"{len(invalid)} of {len(df)} rows are invalid")
+        raise ValueError(
+            f"Invalid row rate {error_rate:.4%} exceeds the threshold of {max_error_rate:.4%}"
+        )
+
+    logger.info(f"{len(valid)} valid and {len(invalid)} invalid row(s)")
+    return valid, invalid
+
+
+def validate_is_fraud_column(df: pl.DataFrame) -> None:
+    logger.info("Checking is_fraud values")
+    raise_for_report(evaluate_rules(df, [IS_FRAUD_RULE]))
+    logger.info("All is_fraud values are valid")
 
 
 def validate_zip_column(df: pl.DataFrame) -> None:
     logger.info("Checking ZIP codes")
-    try:
-        zip_col = df.get_column("zip")
-        logger.info(f"Zip dtype: {zip_col.dtype}, first values: {zip_col.head(5)}")
+    raise_for_report(evaluate_rules(df, [ZIP_RULE]))
+    logger.info("All ZIP codes are valid")
+
 
-        zip_col_filled = zip_col.cast(str).str.zfill(5)
-        logger.info(f"Zip after zfill: {zip_col_filled.head(5)}")
+def scan_and_validate_csv(
+    input_path: str | IO[bytes],
+    schema: SchemaVersion = DEFAULT_SCHEMA,
+    block_size: int = STREAMING_BLOCK_SIZE,
+) -> pl.LazyFrame:
+    """
+    Lazily scan and validate CSV file.
+    Streaming counterpart of load_and_validate_csv: the file is parsed and validated
+    block by block, keeping only the running violation counts, so the full DataFrame
+    is never materialized in memory.
 
-        contains_pattern = zip_col_filled.cast(str).str.contains(r"^\d{5}(-\d{4})?$")
-        logger.info(f"Result of regex match: {contains_pattern.head(5)}")
+    Args:
+        input_path (str | IO[bytes]): Path to the input CSV file, or an in-memory buffer.
+        schema (SchemaVersion): The schema to read and validate the file with.
+        block_size (int): Approximate size in bytes of the blocks validated at a time.
 
-        invalid = zip_col_filled.filter(~contains_pattern)
-        logger.info(f"Invalid ZIP codes count: {invalid.len()}")
+    Returns:
+        pl.LazyFrame: Validated LazyFrame over the CSV file, ready to be sunk to Parquet.
+    """
+    logger.info(f"Scanning and validating file from: {input_path}")
+    expected_schema = schema.polars_schema
+    try:
+        header = pl.scan_csv(input_path, quote_char='"').collect_schema().names()
+        lf = pl.scan_csv(input_path, schema=expected_schema, try_parse_dates=True, quote_char='"')
     except Exception as e:
-        logger.exception(f"ZIP code validation failed {e}")
+        logger.exception(f"Failed to scan CSV with Polars: {e}")
         raise
 
-    if invalid.len() > 0:
-        raise ValueError(f"Invalid ZIP codes found: {invalid}")
-    else:
-        logger.info("All ZIP codes are valid")
+    missing_columns = [col for col in schema.columns if col not in header]
+    if missing_columns:
+        for col in missing_columns:
+            logger.error(f"Missing column in the DataFrame: {col}")
+
+        raise ValueError(f"Missing column in the DataFrame: {missing_columns[-1]}")
+
+    # The report of the empty file judges a file without records like the eager path.
+    report = evaluate_rules(pl.DataFrame(schema=expected_schema), schema.rules)
+    for index, block in enumerate(_read_blocks(input_path, block_size)):
+        frame = pl.read_csv(
+            block,
+            schema=expected_schema,
+            has_header=index == 0,
+            try_parse_dates=True,
+            quote_char='"',
+        )
+        report = merge_reports([report, evaluate_rules(frame, schema.rules)])
+        del frame
+    logger.info(f"Validation report: {report.as_dict()}")
+    raise_for_report(report)
+
+    logger.info(f"Validated {report.rows} rows from {input_path}")
+    return lf
+
+
+def _read_blocks(input_path: str | IO[bytes], block_size: int) -> Iterator[bytes]:
+    # Blocks end at record boundaries; the header line is part of the first block.
+    with open(input_path, "rb") if isinstance(input_path, str) else nullcontext(input_path) as file:
+        if not isinstance(input_path, str):
+            file.seek(0)
+        rest = b""
+        while chunk := file.read(block_size):
+            data = rest + chunk
+            records = _complete_records(data)
+            rest = data[len(records) :]
+            if records:
+                yield records
+        if rest:
+            yield rest
@@ -0,0 +1,44 @@
+import pytest
+
+from benchmarks.run import compare_with_baseline, percentile
+
+
+@pytest.mark.parametrize(
+    ("pct", "expected"),
+    [(0, 1.0), (50, 2.0), (95, 4.0), (99, 4.0), (100, 4.0)],
+)
+def test_percentile_returns_nearest_rank(pct, expected):
+    assert percentile([4.0, 1.0, 3.0, 2.0], pct) == expected
+
+
+def test_percentile_with_single_sample_returns_it():
+    assert percentile([0.5], 50) == 0.5
+    assert percentile([0.5], 99) == 0.5
+
+
+def _case(p50_seconds, peak_rss_bytes):
+    return {"p50_seconds": p50_seconds, "peak_rss_bytes": peak_rss_bytes}
+
+
+def test_compare_with_baseline_reports_metrics_beyond_tolerance():
+    baseline = {"cases": {"transform@100": _case(1.0, 1000)}}
+    results = {"transform@100": _case(1.5, 1100)}
+
+    regressions = compare_with_baseline(results, baseline, tolerance=0.2)
+
+    assert regressions == ["transform@100 p50_seconds: 1 -> 1.5 (+50%)"]
+
+
+def test_compare_with_baseline_with_results_within_tolerance_returns_nothing():
+    baseline = {"cases": {"transform@100": _case(1.0, 1000)}}
+    results = {"transform@100": _case(1.2, 800)}
+
+    assert compare_with_baseline(results, baseline, tolerance=0.2) == []
+
+
+def test_compare_with_baseline_skips_cases_and_metrics_without_baseline():
+    baseline = {"cases": {"transform@100": _case(0.0, 1000)}}
+    results = {"transform@100": _case(1.0, 1000), "enrich@100": _case(9.0, 9000)}
+
+    assert compare_with_baseline(results, baseline, tolerance=0.2) == []
+    assert compare_with_baseline(results, {}, tolerance=0.2) == []
@@ -0,0 +1,122 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+import handler.cli as cli
+from handler.idempotency import ObjectIdentity
+
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    root = tmp_path / "raw"
+    (root / "2025" / "01" / "02").mkdir(parents=True)
+    (root / "2025" / "01" / "02" / "b.csv").write_text("a,b\n1,2\n")
+    (root / "2025" / "01" / "02" / "notes.txt").write_text("skip me")
+    (root / "2025" / "01" / "a.csv").write_text("a\n")
+    return root
+
+
+def test_discover_objects_with_local_directory_lists_csv_files(raw_dir):
+    result = cli.discover_objects(str(raw_dir))
+
+    assert [identity.key for identity in result] == [
+        "raw/2025/01/02/b.csv",
+        "raw/2025/01/a.csv",
+    ]
+    assert result[0].local_path == str(raw_dir / "2025" / "01" / "02" / "b.csv")
+    assert result[0].size == len("a,b\n1,2\n")
+
+
+@patch("handler.storage.list_objects")
+def test_discover_objects_with_s3_prefix_lists_csv_objects(mock_list_objects):
+    mock_list_objects.return_value = [
+        {"Key": "raw/2025/a.csv", "ETag": '"etag-a"', "Size": 10},
+        {"Key": "raw/2025/_SUCCESS", "ETag": '"etag-b"', "Size": 0},
+    ]
+
+    result = cli.discover_objects("s3://raw-bucket/raw/2025/")
+
+    assert result == [ObjectIdentity("raw-bucket", "raw/2025/a.csv", etag="etag-a", size=10)]
+    mock_list_objects.assert_called_once_with("raw-bucket", "raw/2025/")
+
+
+def test_discover_objects_with_missing_directory_raises(tmp_path):
+    with pytest.raises(ValueError, match="Not an S3 URI or a directory"):
+        cli.discover_objects(str(tmp_path / "missing"))
+
+
+def test_checkpoint_with_retried_failure_counts_as_completed(tmp_path):
+    checkpoint = cli.Checkpoint(str(tmp_path / "checkpoint.jsonl"))
+    assert checkpoint.completed() == set()
+
+    checkpoint.record(["a.csv", "b.csv"], failed={"b.csv"})
+    assert checkpoint.completed() == {"a.csv"}
+
+    checkpoint.record(["b.csv"], failed=set())
+    assert checkpoint.completed() == {"a.csv", "b.csv"}
+
+
+@patch("handler.handler.process_records")
+def test_run_backfill_processes_batches_and_records_checkpoint(mock_process_records, tmp_path):
+    mock_process_records.side_effect = lambda records: {
+        key for key, _ in records if key.endswith("bad.csv")
+    }
+    identities = [
+        ObjectIdentity("bucket", f"raw/{name}.csv", size=100) for name in ("a", "b", "bad", "c")
+    ]
+    checkpoint = cli.Checkpoint(str(tmp_path / "checkpoint.jsonl"))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        report = cli.run_backfill(identities, executor, batch_size=3, checkpoint=checkpoint)
+
+    assert mock_process_records.call_count == 2
+    assert report.objects == 4
+    assert report.size_bytes == 400
+    assert report.failed == ["raw/bad.csv"]
+    assert report.objects_per_second > 0
+    assert checkpoint.completed() == {"raw/a.csv", "raw/b.csv", "raw/c.csv"}
+
+
+@patch("handler.handler.process_records", side_effect=RuntimeError("worker died"))
+def test_run_backfill_with_batch_error_fails_whole_batch(mock_process_records):
+    identities = [ObjectIdentity("bucket", "raw/a.csv"), ObjectIdentity("bucket", "raw/b.csv")]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        report = cli.run_backfill(identities, executor)
+
+    assert report.failed == ["raw/a.csv", "raw/b.csv"]
+
+
+def test_main_with_dry_run_lists_pending_objects(raw_dir, tmp_path, capsys):
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    checkpoint_path.write_text(json.dumps({"key": "raw/2025/01/a.csv", "status": "done"}) + "\n")
+
+    result = cli.main([str(raw_dir), "--dry-run", "--checkpoint", str(checkpoint_path)])
+
+    assert result == 0
+    assert capsys.readouterr().out.splitlines() == ["raw/2025/01/02/b.csv"]
+
+
+@patch("handler.handler.IDEMPOTENCY_ENABLED", True)
+@patch("handler.scratch.scratch")
+def test_init_worker_with_idempotency_disabled_skips_processed_check(mock_scratch):
+    import handler.handler as handler
+
+    mock_scratch.root, mock_scratch.budget_bytes = "/tmp", 1024
+    with patch("handler.cli.setup_logging"), patch("handler.metrics.METRICS_ENABLED", True):
+        cli._init_worker(1, verbose=True, idempotency=False)
+
+    assert handler.IDEMPOTENCY_ENABLED is False
+
+
+@patch("handler.cli.run_backfill")
+@patch("handler.cli.ProcessPoolExecutor")
+def test_main_with_no_idempotency_passes_it_to_workers(mock_executor, mock_run_backfill, raw_dir):
+    mock_run_backfill.return_value = cli.BackfillReport(objects=2)
+
+    result = cli.main([str(raw_dir), "--workers", "1", "--no-idempotency"])
+
+    assert result == 0
+    assert mock_executor.call_args.kwargs["initargs"] == (1, False, False)
@@ -0,0 +1,102 @@
+from unittest.mock import Mock, patch
+
+import polars as pl
+
+from handler.coalescer import Coalescer
+from handler.idempotency import ObjectIdentity
+
+
+def _source(name):
+    return ObjectIdentity("raw-bucket", f"raw/2025/01/01/{name}.csv")
+
+
+def _frame(*amounts):
+    return pl.DataFrame({"amt": list(amounts)}, schema={"amt": pl.Float64})
+
+
+def _writer():
+    return Mock(side_effect=lambda frame, output_key: [output_key])
+
+
+def test_flush_writes_buffered_frames_as_one_file():
+    write = _writer()
+    coalescer = Coalescer(write, max_files=10, max_bytes=1 << 30, max_seconds=60)
+    first, second = _source("a"), _source("b")
+
+    coalescer.add(first, _frame(1.0, 2.0), "refined/2025/01/01")
+    coalescer.add(second, _frame(3.0), "refined/2025/01/01")
+    write.assert_not_called()
+    coalescer.flush()
+
+    frame, output_key = write.call_args.args
+    assert frame.equals(_frame(1.0, 2.0, 3.0))
+    assert output_key.startswith("refined/2025/01/01/coalesced-")
+    assert output_key.endswith(".parquet")
+    assert coalescer.outputs == {first: [output_key], second: [output_key]}
+    assert coalescer.failures == {}
+
+
+def test_add_with_max_files_reached_flushes_window():
+    write = _writer()
+    coalescer = Coalescer(write, max_files=2, max_bytes=1 << 30, max_seconds=60)
+
+    for name in "abc":
+        coalescer.add(_source(name), _frame(1.0), "refined/2025/01/01")
+
+    write.assert_called_once()
+    assert set(coalescer.outputs) == {_source("a"), _source("b")}
+    coalescer.flush()
+    assert write.call_count == 2
+    assert len(coalescer.outputs) == 3
+
+
+def test_add_with_max_bytes_reached_flushes_window():
+    write = _writer()
+    coalescer = Coalescer(write, max_files=10, max_bytes=16, max_seconds=60)
+
+    coalescer.add(_source("a"), _frame(1.0), "refined/2025/01/01")
+    coalescer.add(_source("b"), _frame(2.0), "refined/2025/01/01")
+
+    write.assert_called_once()
+    assert write.call_args.args[0].equals(_frame(1.0, 2.0))
+
+
+@patch("handler.coalescer.time.monotonic")
+def test_add_to_window_open_too_long_flushes_it(mock_monotonic):
+    mock_monotonic.side_effect = [0.0, 61.0]
+    write = _writer()
+    coalescer = Coalescer(write, max_files=10, max_bytes=1 << 30, max_seconds=60)
+
+    coalescer.add(_source("a"), _frame(1.0), "refined/2025/01/01")
+    write.assert_not_called()
+    coalescer.add(_source("b"), _frame(2.0), "refined/2025/01/01")
+
+    write.assert_called_once()
+
+
+def test_flush_keeps_directories_and_columns_apart():
+    write = _writer()
+    coalescer = Coalescer(write, max_files=10, max_bytes=1 << 30, max_seconds=60)
+
+    coalescer.add(_source("a"), _frame(1.0), "refined/2025/01/01")
+    coalescer.add(_source("b"), _frame(2.0), "refined/2025/01/02")
+    coalescer.add(_source("c"), pl.DataFrame({"zip": ["12345"]}), "refined/2025/01/01")
+    coalescer.flush()
+
+    directories = sorted(call.args[1].rsplit("/", 1)[0] for call in write.call_args_list)
+    assert directories == ["refined/2025/01/01", "refined/2025/01/01", "refined/2025/01/02"]
+
+
+def test_flush_with_failed_write_only_fails_sources_of_its_window():
+    def write(frame, output_key):
+        if output_key.startswith("refined/2025/01/02/"):
+            raise Exception("Upload failed")
+        return [output_key]
+
+    coalescer = Coalescer(write, max_files=10, max_bytes=1 << 30, max_seconds=60)
+    coalescer.add(_source("a"), _frame(1.0), "refined/2025/01/01")
+    coalescer.add(_source("b"), _frame(2.0), "refined/2025/01/02")
+    coalescer.flush()
+
+    assert set(coalescer.outputs) == {_source("a")}
+    assert set(coalescer.failures) == {_source("b")}
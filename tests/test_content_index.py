@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import io
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+import handler.content_index as content_index
+from handler.idempotency import ObjectIdentity
+
+CONTENT = b"a,b\n1,2\n"
+OUTPUTS = "transactions/v1;ParquetOptions();enrichment="
+OUTPUTS_DIGEST = hashlib.sha256(OUTPUTS.encode()).hexdigest()[:16]
+SHA256_ID = f"sha256:{hashlib.sha256(CONTENT).hexdigest()}:{len(CONTENT)}:{OUTPUTS_DIGEST}"
+
+
+@pytest.fixture
+def fake_bucket():
+    objects: dict[str, bytes] = {}
+
+    def get(key):
+        if key not in objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not Found"}}, "GetObject")
+        return objects[key]
+
+    with (
+        patch("handler.content_index.put_bytes_to_s3", side_effect=objects.__setitem__),
+        patch("handler.content_index.get_bytes_from_s3", side_effect=get),
+    ):
+        yield objects
+
+
+@pytest.fixture
+def identity():
+    return ObjectIdentity("raw-bucket", "raw/2025/01/02/data.csv")
+
+
+@patch("handler.content_index.get_object_checksum")
+def test_checksum_content_id_with_sha256_checksum_matches_hash(mock_checksum, identity, tmp_path):
+    mock_checksum.return_value = {
+        "ChecksumSHA256": base64.b64encode(hashlib.sha256(CONTENT).digest()).decode(),
+        "ChecksumType": "FULL_OBJECT",
+        "ContentLength": len(CONTENT),
+    }
+    path = tmp_path / "data.csv"
+    path.write_bytes(CONTENT)
+
+    assert content_index.checksum_content_id(identity, OUTPUTS) == SHA256_ID
+    assert content_index.hash_content_id(str(path), OUTPUTS) == SHA256_ID
+
+
+@patch("handler.content_index.get_object_checksum")
+def test_checksum_content_id_with_sha1_checksum_returns_sha1_id(mock_checksum, identity):
+    mock_checksum.return_value = {
+        "ChecksumSHA1": base64.b64encode(b"\x01" * 20).decode(),
+        "ChecksumType": "FULL_OBJECT",
+        "ContentLength": 10,
+    }
+
+    assert (
+        content_index.checksum_content_id(identity, OUTPUTS)
+        == f"sha1:{'01' * 20}:10:{OUTPUTS_DIGEST}"
+    )
+
+
+@patch("handler.content_index.get_object_checksum")
+def test_checksum_content_id_with_only_crc_checksums_returns_none(mock_checksum, identity):
+    mock_checksum.return_value = {
+        "ChecksumCRC64NVME": base64.b64encode(b"\x01" * 8).decode(),
+        "ChecksumCRC32C": base64.b64encode(b"\x01" * 4).decode(),
+        "ChecksumCRC32": base64.b64encode(b"\x01" * 4).decode(),
+        "ChecksumType": "FULL_OBJECT",
+        "ContentLength": 10,
+    }
+
+    assert content_index.checksum_content_id(identity, OUTPUTS) is None
+
+
+@patch("handler.content_index.get_object_checksum")
+def test_checksum_content_id_with_composite_checksum_returns_none(mock_checksum, identity):
+    mock_checksum.return_value = {
+        "ChecksumSHA256": "c2hhMjU2-3",
+        "ChecksumType": "COMPOSITE",
+        "ContentLength": 10,
+    }
+
+    assert content_index.checksum_content_id(identity, OUTPUTS) is None
+
+
+def test_hash_content_id_with_buffer_rewinds_buffer():
+    buffer = io.BytesIO(CONTENT)
+
+    assert content_index.hash_content_id(buffer, OUTPUTS) == SHA256_ID
+    assert buffer.tell() == 0
+
+
+def test_record_and_lookup_round_trip(fake_bucket):
+    assert content_index.lookup(SHA256_ID) is None
+
+    content_index.record(
+        [SHA256_ID, "sha1:01:8:ab"], "raw/data.csv", {"refined/data.parquet": '"etag"'}
+    )
+
+    entry = content_index.lookup("sha1:01:8:ab")
+    assert entry["object_key"] == "raw/data.csv"
+    assert entry["refined_keys"] == ["refined/data.parquet"]
+    assert entry["refined_etags"] == {"refined/data.parquet": '"etag"'}
+    assert len(fake_bucket) == 2
+
+
+def test_content_id_depends_on_outputs(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(CONTENT)
+
+    assert content_index.hash_content_id(str(path), OUTPUTS) != content_index.hash_content_id(
+        str(path), "transactions/v2;ParquetOptions();enrichment="
+    )
+
+
+def test_alias_key_keeps_partition_path():
+    assert (
+        content_index.alias_key(
+            "refined/2025/01/02/new.parquet",
+            "refined/2025/01/01/data.parquet",
+            "refined/2025/01/01/category=travel/data.parquet",
+        )
+        == "refined/2025/01/02/category=travel/new.parquet"
+    )
+    assert (
+        content_index.alias_key(
+            "refined/2025/01/02/new.parquet",
+            "refined/2025/01/01/data.parquet",
+            "refined/2025/01/01/data.parquet",
+        )
+        == "refined/2025/01/02/new.parquet"
+    )
@@ -0,0 +1,70 @@
+from datetime import date, datetime
+
+import polars as pl
+import pytest
+
+import handler.features as features
+
+
+@pytest.fixture
+def transactions():
+    return pl.DataFrame(
+        {
+            "trans_date_trans_time": [
+                datetime(2020, 6, 21, 12, 14),
+                datetime(2020, 6, 21, 23, 5),
+                datetime(2020, 6, 22, 1, 30),
+                datetime(2020, 6, 23, 9, 0),
+            ],
+            "cc_num": [1, 2, 1, 1],
+            "amt": [10.0, 20.0, 5.0, 7.5],
+            "lat": [0.0, 40.7128, 0.0, 0.0],
+            "long": [0.0, -74.006, 0.0, 0.0],
+            "dob": [date(1980, 6, 21), date(1990, 12, 31), date(1980, 6, 21), date(1980, 6, 21)],
+            "unix_time": [1592741640, 1592780700, 1592789400, 1592902800],
+            "merch_lat": [0.0, 34.0522, 1.0, 0.0],
+            "merch_long": [1.0, -118.2437, 0.0, 0.0],
+        }
+    )
+
+
+def test_add_features_derives_every_feature(transactions):
+    result = features.add_features(transactions)
+
+    assert result.columns == [*transactions.columns, *features.FEATURES]
+    assert result["customer_age"].to_list() == [40, 29, 40, 40]
+    assert result["trans_hour"].to_list() == [12, 23, 1, 9]
+    assert result["trans_weekday"].to_list() == [7, 7, 1, 2]
+    assert result["distance_km"][0] == pytest.approx(111.195, abs=0.01)
+    assert result["distance_km"][1] == pytest.approx(3935.75, rel=0.001)
+    assert result["distance_km"][3] == 0.0
+
+
+def test_add_features_windows_per_card_keep_row_order(transactions):
+    result = features.add_features(transactions, window_seconds=24 * 60 * 60)
+
+    assert result["cc_txn_count_window"].to_list() == [1, 1, 2, 1]
+    assert result["cc_amt_sum_window"].to_list() == [10.0, 20.0, 15.0, 7.5]
+
+
+def test_add_features_with_lazyframe_matches_dataframe(transactions):
+    result = features.add_features(transactions.lazy(), ("trans_hour", "cc_txn_count_window"))
+
+    assert isinstance(result, pl.LazyFrame)
+    assert result.collect().equals(
+        features.add_features(transactions, ("trans_hour", "cc_txn_count_window"))
+    )
+
+
+def test_add_features_with_unknown_feature_raises(transactions):
+    with pytest.raises(ValueError, match="Unknown feature"):
+        features.add_features(transactions, ("velocity",))
+
+
+def test_required_columns_of_selected_features():
+    assert features.required_columns(("trans_hour", "cc_amt_sum_window")) == {
+        "trans_date_trans_time",
+        "cc_num",
+        "unix_time",
+        "amt",
+    }
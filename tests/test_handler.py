@@ -1,9 +1,20 @@
+import json
+import os
+import threading
+import time
 from unittest.mock import ANY, Mock, patch
 
 import polars as pl
 import pytest
+from botocore.exceptions import ClientError
 
 import handler.handler as handler
+import handler.storage as storage
+import handler.transform as transform
+from handler.idempotency import ObjectIdentity
+from handler.log_type import LogType
+from handler.schemas import HEADER_SNIFF_BYTES, TRANSACTIONS_V1, SchemaRegistry, SchemaVersion
+from handler.scratch import ScratchSpace
 
 
 @pytest.fixture
@@ -20,6 +31,34 @@ def dummy_event():
     }
 
 
+@pytest.fixture(autouse=True)
+def mock_copy():
+    with patch("handler.storage.copy_object_to_refined_bucket") as mock_copy:
+        yield mock_copy
+
+
+@pytest.fixture(autouse=True)
+def mock_append_log_entries():
+    with patch("handler.log_manager.append_log_entries") as mock_append_log_entries:
+        yield mock_append_log_entries
+
+
+@pytest.fixture(autouse=True)
+def scratch_space(tmp_path):
+    scratch_space = ScratchSpace(str(tmp_path / "scratch"), 1024 * 1024)
+    with patch("handler.handler.scratch", scratch_space):
+        yield scratch_space
+
+
+def _sqs_event(**messages):
+    return {
+        "Records": [
+            {"eventSource": "aws:sqs", "messageId": message_id, "body": json.dumps(body)}
+            for message_id, body in messages.items()
+        ]
+    }
+
+
 @pytest.fixture
 def dummy_context():
     return object()
@@ -30,11 +69,6 @@ def mock_data():
     return pl.DataFrame({"col1": [1, 2], "col2": ["a", "b"]})
 
 
-@pytest.fixture
-def mock_log_data():
-    return {"ingested_files": []}
-
-
 @patch("handler.storage.download_file_from_s3")
 def test_handle_with_no_bucket_name_in_event_raises_error(
     mock_download, dummy_event, dummy_context
@@ -45,44 +79,133 @@ def test_handle_with_no_bucket_name_in_event_raises_error(
 
 
 @patch("handler.storage.download_file_from_s3")
-@patch("handler.log_manager.download_log_file")
-@patch("handler.log_manager.upload_log_file")
 def test_handle_with_download_file_error_raises_error(
-    mock_upload_log, mock_download_log, mock_download, dummy_event, dummy_context
+    mock_download, dummy_event, dummy_context, mock_copy
 ):
     mock_download.side_effect = Exception("Download error")
+
     with pytest.raises(Exception, match="Download error"):
         handler.handle_event(dummy_event, dummy_context)
 
+    mock_copy.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", "quarantine/2025/01/01/data.csv"
+    )
+
+
+@patch("handler.handler.ENRICHMENT_ENABLED", True)
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.features.add_features")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_enrichment_writes_feature_columns(
+    mock_transform,
+    mock_upload,
+    mock_add_features,
+    mock_validate,
+    mock_download,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_add_features.assert_called_once_with(mock_validate.return_value)
+    mock_transform.assert_called_once_with(
+        mock_add_features.return_value, "data.parquet", local_dir=ANY
+    )
+
+
+@patch("handler.transform.PARQUET_OPTIONS", transform.ParquetOptions(compact=True))
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.compact_frame")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_compaction_writes_compacted_frame(
+    mock_transform,
+    mock_upload,
+    mock_compact,
+    mock_validate,
+    mock_download,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_compact.assert_called_once_with(mock_validate.return_value, TRANSACTIONS_V1.compact_types)
+    mock_transform.assert_called_once_with(mock_compact.return_value, "data.parquet", local_dir=ANY)
+
+
+@patch("handler.handler.PREFLIGHT_ENABLED", True)
+@patch("handler.storage.get_object_range", return_value=b"card,is_fraud\n1,0\n")
+@patch("handler.storage.download_file_from_s3")
+def test_handle_with_preflight_rejects_wrong_layout_before_download(
+    mock_download, mock_get_range, dummy_event, dummy_context, mock_copy
+):
+    with pytest.raises(Exception, match="Missing column in the DataFrame"):
+        handler.handle_event(dummy_event, dummy_context)
+
+    mock_get_range.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", 0, handler.PREFLIGHT_BYTES - 1
+    )
+    mock_download.assert_not_called()
+    mock_copy.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", "quarantine/2025/01/01/data.csv"
+    )
+
+
+@patch("handler.handler.PREFLIGHT_ENABLED", True)
+@patch("handler.storage.get_object_range", return_value=b"sample")
+@patch("handler.validator.preflight_csv")
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_preflight_passing_downloads_and_refines(
+    mock_transform,
+    mock_upload,
+    mock_validate,
+    mock_download,
+    mock_preflight,
+    mock_get_range,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_preflight.assert_called_once_with(b"sample", TRANSACTIONS_V1, complete=True)
+    mock_validate.assert_called_once_with("/tmp/data.csv", TRANSACTIONS_V1)
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+
 
 @patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
 @patch("handler.validator.load_and_validate_csv")
-@patch("handler.log_manager.download_log_file")
-@patch("handler.log_manager.upload_log_file")
 def test_handle_with_validation_error_raises_error(
-    mock_upload_log, mock_download_log, mock_validate, mock_download, dummy_event, dummy_context
+    mock_validate, mock_download, dummy_event, dummy_context
 ):
     mock_validate.side_effect = Exception("Validation error")
-    with pytest.raises(Exception):
+
+    with pytest.raises(Exception, match="Validation error"):
         handler.handle_event(dummy_event, dummy_context)
 
 
 @patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
 @patch("handler.validator.load_and_validate_csv")
 @patch("handler.storage.upload_file_to_s3")
-@patch("handler.log_manager.download_log_file")
-@patch("handler.log_manager.upload_log_file")
 def test_handle_with_upload_error_raises_error(
-    mock_upload_log,
-    mock_download_log,
     mock_upload,
     mock_validate,
     mock_download,
     dummy_event,
     dummy_context,
+    mock_data,
 ):
-    mock_validate.return_value = Mock()
+    mock_validate.return_value = mock_data
     mock_upload.side_effect = Exception("Upload error")
+
     with pytest.raises(Exception, match="Upload error"):
         handler.handle_event(dummy_event, dummy_context)
 
@@ -90,19 +213,18 @@ def test_handle_with_upload_error_raises_error(
 @patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
 @patch("handler.validator.load_and_validate_csv")
 @patch("handler.storage.upload_file_to_s3")
-@patch("handler.log_manager.download_log_file")
-@patch("handler.log_manager.upload_log_file")
 def test_handle_with_upload_log_error_raises_error(
-    mock_upload_log,
-    mock_download_log,
     mock_upload,
     mock_validate,
     mock_download,
     dummy_event,
     dummy_context,
+    mock_data,
+    mock_append_log_entries,
 ):
-    mock_validate.return_value = Mock()
-    mock_upload_log.side_effect = Exception("Upload log error")
+    mock_validate.return_value = mock_data
+    mock_append_log_entries.side_effect = Exception("Upload log error")
+
     with pytest.raises(Exception, match="Upload log error"):
         handler.handle_event(dummy_event, dummy_context)
 
@@ -111,11 +233,7 @@ def test_handle_with_upload_log_error_raises_error(
 @patch("handler.storage.upload_file_to_s3")
 @patch("handler.validator.load_and_validate_csv")
 @patch("handler.transform.transform_dataframe_to_parquet")
-@patch("handler.log_manager.download_log_file")
-@patch("handler.log_manager.upload_log_file")
 def test_handle_with_all_steps_succeeding_transforms_and_logs_refinement(
-    mock_upload_log_file,
-    mock_download_log_file,
     mock_transform,
     mock_validate,
     mock_upload,
@@ -123,22 +241,1056 @@ def test_handle_with_all_steps_succeeding_transforms_and_logs_refinement(
     dummy_event,
     dummy_context,
     mock_data,
-    mock_log_data,
+    mock_append_log_entries,
 ):
     mock_download.return_value = "/tmp/dummy.csv"
     mock_validate.return_value = mock_data
     mock_transform.return_value = "/tmp/data.parquet"
     mock_upload.return_value = None
-    mock_download_log_file.return_value = mock_log_data
 
-    handler.handle_event(dummy_event, dummy_context)
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_download.assert_called_once_with("test-bucket", "raw/2025/01/01/data.csv", ANY)
+    mock_validate.assert_called_once_with("/tmp/dummy.csv", TRANSACTIONS_V1)
+    mock_transform.assert_called_once_with(mock_data, "data.parquet", local_dir=ANY)
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        aliases={},
+        sources=[None],
+    )
+
+
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet")
+def test_handle_with_partitioning_uploads_and_logs_every_partition(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+):
+    mock_validate.return_value = pl.DataFrame({"category": ["home", "travel"], "amt": [1.0, 2.0]})
+    mock_transform.side_effect = lambda df, filename, local_dir: f"/tmp/{filename}"
+
+    with patch(
+        "handler.transform.PARQUET_OPTIONS",
+        transform.ParquetOptions(partition_by=("category",)),
+    ):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    expected_keys = [
+        "refined/2025/01/01/category=home/data.parquet",
+        "refined/2025/01/01/category=travel/data.parquet",
+    ]
+    mock_upload.assert_any_call(expected_keys[0], "/tmp/category=home_data.parquet")
+    mock_upload.assert_any_call(expected_keys[1], "/tmp/category=travel_data.parquet")
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json", LogType.REFINEMENT, expected_keys, aliases={}, sources=[None, None]
+    )
+
+
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_partitioning_and_schema_without_partition_columns_writes_one_file(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+):
+    processor = SchemaVersion("processor", 2, {"card": pl.Int64(), "is_fraud": pl.Int8()})
+    mock_validate.return_value = pl.DataFrame({"card": [1, 2], "is_fraud": [0, 1]})
+
+    with (
+        patch(
+            "handler.transform.PARQUET_OPTIONS",
+            transform.ParquetOptions(partition_by=("date", "category")),
+        ),
+        patch("handler.handler._resolve_schema", return_value=processor),
+    ):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_validate.assert_called_once_with("/tmp/data.csv", processor)
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        aliases={},
+        sources=[None],
+    )
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet")
+def test_handle_with_multiple_records_isolates_failures(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_context,
+    mock_data,
+    mock_copy,
+):
+    event = _sqs_event(
+        **{
+            name: {
+                "Records": [
+                    {
+                        "s3": {
+                            "bucket": {"name": "test-bucket"},
+                            "object": {"key": f"raw/{name}.csv"},
+                        }
+                    }
+                ]
+            }
+            for name in ("good", "bad", "other")
+        }
+    )
+    mock_download.side_effect = lambda bucket, key, local_dir: f"/tmp/{key.split('/')[-1]}"
+
+    def validate(path, schema):
+        if "bad" in path:
+            raise ValueError("Invalid ZIP codes found")
+        return mock_data
+
+    mock_validate.side_effect = validate
+    mock_transform.side_effect = lambda df, filename, local_dir: f"/tmp/{filename}"
+
+    result = handler.handle_event(event, dummy_context)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "bad"}]}
+    assert mock_download.call_count == 3
+    mock_upload.assert_any_call("refined/good.parquet", "/tmp/good.parquet")
+    mock_upload.assert_any_call("refined/other.parquet", "/tmp/other.parquet")
+    assert mock_upload.call_count == 2
+    mock_copy.assert_called_once_with("test-bucket", "raw/bad.csv", "quarantine/bad.csv")
+
+
+@patch("handler.storage.download_file_from_s3")
+def test_handle_with_sqs_record_reports_message_id(mock_download, dummy_event, dummy_context):
+    event = {
+        "Records": [
+            {"eventSource": "aws:sqs", "messageId": "message-1", "body": json.dumps(dummy_event)}
+        ]
+    }
+    mock_download.side_effect = Exception("Download error")
+
+    result = handler.handle_event(event, dummy_context)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "message-1"}]}
+    mock_download.assert_called_once_with("test-bucket", "raw/2025/01/01/data.csv", ANY)
+
+
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_malformed_sqs_message_reports_it_and_processes_others(
+    mock_transform, mock_upload, mock_validate, mock_download, dummy_event, dummy_context
+):
+    event = _sqs_event(
+        good=dummy_event,
+        test={"Service": "Amazon S3", "Event": "s3:TestEvent", "Bucket": "test-bucket"},
+        malformed={"Records": [{"s3": {"bucket": {}}}]},
+    )
+    event["Records"].append({"eventSource": "aws:sqs", "messageId": "garbage", "body": "{"})
+
+    result = handler.handle_event(event, dummy_context)
+
+    assert result == {
+        "batchItemFailures": [{"itemIdentifier": "malformed"}, {"itemIdentifier": "garbage"}]
+    }
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+
+
+@patch("handler.handler.STREAMING_ENABLED", True)
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.scan_and_validate_csv", return_value=pl.LazyFrame())
+@patch("handler.transform.sink_lazyframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_streaming_enabled_sinks_lazyframe(
+    mock_sink,
+    mock_scan,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
 
-    mock_download.assert_called_once_with("test-bucket", "raw/2025/01/01/data.csv")
-    mock_validate.assert_called_once_with("/tmp/dummy.csv")
-    mock_transform.assert_called_once_with(mock_data, "data.parquet")
+    assert result == {"batchItemFailures": []}
+    mock_scan.assert_called_once_with("/tmp/data.csv", TRANSACTIONS_V1)
+    mock_sink.assert_called_once_with(mock_scan.return_value, "data.parquet", local_dir=ANY)
     mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
-    mock_download_log_file.assert_called_once_with("refinement-log.json")
-    mock_upload_log_file.assert_called_once_with(
+
+
+@patch("handler.handler.IN_MEMORY_IO_ENABLED", True)
+@patch("handler.storage.download_fileobj_from_s3")
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_to_parquet_buffer")
+def test_handle_with_in_memory_io_uploads_buffer(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_validate.assert_called_once_with(mock_download.return_value, TRANSACTIONS_V1)
+    mock_transform.assert_called_once_with(mock_validate.return_value)
+    mock_upload.assert_called_once_with(
+        "refined/2025/01/01/data.parquet", mock_transform.return_value
+    )
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet")
+def test_handle_uses_and_removes_a_scratch_directory_per_record(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    scratch_space,
+):
+    work_dirs = []
+
+    def download(bucket, key, local_dir):
+        work_dirs.append(local_dir)
+        return f"{local_dir}/data.csv"
+
+    mock_download.side_effect = download
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    assert work_dirs[0].startswith(scratch_space.root)
+    mock_transform.assert_called_once_with(
+        mock_validate.return_value, "data.parquet", local_dir=work_dirs[0]
+    )
+    assert os.listdir(scratch_space.root) == []
+    assert scratch_space.reserved_bytes == 0
+
+
+@patch("handler.handler.ROW_QUARANTINE_ENABLED", True)
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.read_csv")
+@patch("handler.validator.split_invalid_rows")
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_row_quarantine_splits_invalid_rows(
+    mock_transform,
+    mock_upload,
+    mock_upload_fileobj,
+    mock_split,
+    mock_read,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+    mock_copy,
+):
+    valid = pl.DataFrame({"is_fraud": [0]})
+    invalid = pl.DataFrame({"is_fraud": [2], "reason": ["is_fraud:InSetRule"]})
+    mock_split.return_value = (valid, invalid)
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_split.assert_called_once_with(
+        mock_read.return_value, handler.MAX_ROW_ERROR_RATE, TRANSACTIONS_V1.rules
+    )
+    mock_transform.assert_called_once_with(valid, "data.parquet", local_dir=ANY)
+    rows_key, buffer = mock_upload_fileobj.call_args.args
+    assert rows_key == "quarantine/2025/01/01/data.parquet"
+    assert pl.read_parquet(buffer).equals(invalid)
+    mock_copy.assert_not_called()
+    mock_append_log_entries.assert_any_call(
         "refinement-log.json",
-        {"ingested_files": [{"timestamp": ANY, "file": "refined/2025/01/01/data.parquet"}]},
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        aliases={},
+        sources=[None],
+    )
+    mock_append_log_entries.assert_any_call(
+        "quarantine-log.json",
+        LogType.QUARANTINE,
+        ["quarantine/2025/01/01/data.parquet"],
+        aliases={},
+        sources=[None],
+    )
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.ranged_reader.scan_csv_ranges", return_value=pl.LazyFrame())
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.sink_lazyframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_large_object_reads_byte_ranges(
+    mock_transform,
+    mock_upload,
+    mock_ranged_read,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    scratch_space,
+):
+    size = 512 * 1024 * 1024
+    dummy_event["Records"][0]["s3"]["object"]["size"] = size
+    scratch_space.budget_bytes = 2 * size
+
+    with patch("shutil.disk_usage", return_value=Mock(free=2 * size)):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_download.assert_not_called()
+    mock_ranged_read.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", size, TRANSACTIONS_V1
+    )
+    mock_transform.assert_called_once_with(
+        mock_ranged_read.return_value, "data.parquet", local_dir=ANY
+    )
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.storage.get_object_range", return_value=b"card,is_fraud\n1,0\n")
+@patch("handler.ranged_reader.scan_csv_ranges")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.sink_lazyframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_large_object_routes_schema_by_sniffed_header(
+    mock_transform,
+    mock_upload,
+    mock_ranged_read,
+    mock_get_range,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    scratch_space,
+):
+    size = 512 * 1024 * 1024
+    dummy_event["Records"][0]["s3"]["object"]["size"] = size
+    scratch_space.budget_bytes = 2 * size
+    registry = SchemaRegistry(TRANSACTIONS_V1)
+    processor = SchemaVersion("processor", 1, {"card": pl.Int64(), "is_fraud": pl.Int8()})
+    registry.register(processor)
+
+    with (
+        patch("shutil.disk_usage", return_value=Mock(free=2 * size)),
+        patch("handler.schemas.get_registry", return_value=registry),
+    ):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_get_range.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", 0, HEADER_SNIFF_BYTES - 1
+    )
+    mock_ranged_read.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", size, processor
+    )
+
+
+@pytest.mark.parametrize(
+    "mode",
+    [
+        patch("handler.transform.PARQUET_OPTIONS", transform.ParquetOptions(compact=True)),
+        patch("handler.handler.ROW_QUARANTINE_ENABLED", True),
+    ],
+    ids=["compaction", "row_quarantine"],
+)
+@patch("handler.ranged_reader.RANGED_READ_THRESHOLD", 0)
+@patch("handler.ranged_reader.RANGE_SIZE", 16)
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.storage.upload_file_to_s3")
+def test_handle_with_large_object_writes_eager_frame_of_ranged_read(
+    mock_upload, mock_upload_fileobj, mode, dummy_event, dummy_context, mock_copy
+):
+    data = b"card,amt,is_fraud\n" + b"".join(b"%d,1.5,0\n" % i for i in range(10))
+    dummy_event["Records"][0]["s3"]["object"]["size"] = len(data)
+    processor = SchemaVersion.from_dict(
+        {
+            "name": "processor",
+            "version": 1,
+            "columns": {"card": "Int64", "amt": "Float64", "is_fraud": "Int8"},
+            "rules": [{"type": "in_set", "column": "is_fraud", "values": [0, 1]}],
+        }
+    )
+    written = []
+    mock_upload.side_effect = lambda key, path: written.append(pl.read_parquet(path))
+
+    with (
+        mode,
+        patch("handler.handler._resolve_schema", return_value=processor),
+        patch(
+            "handler.storage.get_object_range",
+            side_effect=lambda bucket, key, start, end: data[start : end + 1],
+        ),
+    ):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_copy.assert_not_called()
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", ANY)
+    assert written[0]["card"].to_list() == list(range(10))
+
+
+@patch("handler.handler.STREAMING_ENABLED", True)
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.storage.download_fileobj_from_s3")
+@patch("handler.ranged_reader.scan_csv_ranges", return_value=pl.LazyFrame())
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.transform.transform_to_parquet_buffer")
+def test_handle_over_scratch_budget_falls_back_to_streamed_ranged_read(
+    mock_transform,
+    mock_upload,
+    mock_scan,
+    mock_download_fileobj,
+    mock_download_file,
+    dummy_event,
+    dummy_context,
+):
+    size = 10 * 1024 * 1024
+    dummy_event["Records"][0]["s3"]["object"]["size"] = size
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_download_file.assert_not_called()
+    mock_download_fileobj.assert_not_called()
+    mock_scan.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", size, TRANSACTIONS_V1
+    )
+    mock_transform.assert_called_once_with(mock_scan.return_value)
+    mock_upload.assert_called_once_with(
+        "refined/2025/01/01/data.parquet", mock_transform.return_value
+    )
+
+
+@patch("handler.handler.IN_MEMORY_IO_ENABLED", True)
+@patch("handler.storage.download_fileobj_from_s3")
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.validator.load_and_validate_csv", side_effect=ValueError("Invalid"))
+def test_handle_with_in_memory_io_quarantines_with_server_side_copy(
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+):
+    with pytest.raises(Exception, match="Invalid"):
+        handler.handle_event(dummy_event, dummy_context)
+
+    mock_upload.assert_not_called()
+    mock_copy.assert_called_once_with(
+        "test-bucket", "raw/2025/01/01/data.csv", "quarantine/2025/01/01/data.csv"
+    )
+
+
+@patch("handler.storage.download_file_from_s3", side_effect=Exception("Download error"))
+def test_handle_with_quarantine_error_still_raises_processing_error(
+    mock_download, dummy_event, dummy_context, mock_copy, mock_append_log_entries
+):
+    mock_copy.side_effect = Exception("NoSuchKey")
+
+    with pytest.raises(Exception, match="Download error"):
+        handler.handle_event(dummy_event, dummy_context)
+
+    mock_append_log_entries.assert_not_called()
+
+
+@patch("handler.handler.LEDGER_ENABLED", True)
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+@patch("handler.ledger.append_entry")
+def test_handle_with_ledger_enabled_appends_ledger_entry(
+    mock_append_entry,
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_append_entry.assert_called_once_with(
+        LogType.REFINEMENT, "refined/2025/01/01/data.parquet", None, None
+    )
+    mock_append_log_entries.assert_not_called()
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_multiple_records_batches_log_entries(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    dummy_context,
+    mock_append_log_entries,
+):
+    event = {
+        "Records": [
+            {"s3": {"bucket": {"name": "test-bucket"}, "object": {"key": f"raw/{name}.csv"}}}
+            for name in ("a", "b", "c")
+        ]
+    }
+    mock_validate.side_effect = [Mock(), ValueError("Invalid"), Mock()]
+
+    with pytest.raises(ValueError, match="Invalid"):
+        handler.handle_event(event, dummy_context)
+
+    assert mock_append_log_entries.call_count == 2
+    refinement_call, quarantine_call = mock_append_log_entries.call_args_list
+    assert refinement_call.args[:2] == ("refinement-log.json", LogType.REFINEMENT)
+    assert len(refinement_call.args[2]) == 2
+    assert quarantine_call.args[:2] == ("quarantine-log.json", LogType.QUARANTINE)
+    assert len(quarantine_call.args[2]) == 1
+
+
+@patch("handler.handler.IDEMPOTENCY_ENABLED", True)
+@patch("handler.idempotency.is_processed", return_value=True)
+@patch("handler.storage.download_file_from_s3")
+def test_handle_with_already_processed_record_skips_it(
+    mock_download, mock_is_processed, dummy_event, dummy_context, mock_append_log_entries
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_download.assert_not_called()
+    mock_append_log_entries.assert_not_called()
+
+
+@patch("handler.handler.IDEMPOTENCY_ENABLED", True)
+@patch("handler.idempotency.is_processed", return_value=False)
+@patch("handler.idempotency.mark_processed")
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_refined_record_marks_it_processed(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    mock_mark_processed,
+    mock_is_processed,
+    dummy_event,
+    dummy_context,
+):
+    dummy_event["Records"][0]["s3"]["object"].update({"eTag": "abc123", "versionId": "v1"})
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    identity = ObjectIdentity("test-bucket", "raw/2025/01/01/data.csv", "v1", "abc123")
+    mock_is_processed.assert_called_once_with(identity)
+    mock_mark_processed.assert_called_once_with(identity, "refined/2025/01/01/data.parquet")
+
+
+@patch("handler.idempotency.is_processed")
+@patch("handler.idempotency.mark_processed")
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_idempotency_disabled_by_default_skips_markers(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    mock_mark_processed,
+    mock_is_processed,
+    dummy_event,
+    dummy_context,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_is_processed.assert_not_called()
+    mock_mark_processed.assert_not_called()
+
+
+@patch("handler.handler.IDEMPOTENCY_ENABLED", True)
+@patch("handler.idempotency.mark_processed")
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_log_error_does_not_mark_processed(
+    mock_transform,
+    mock_validate,
+    mock_upload,
+    mock_download,
+    mock_mark_processed,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+):
+    mock_append_log_entries.side_effect = Exception("Upload log error")
+
+    with pytest.raises(Exception, match="Upload log error"):
+        handler.handle_event(dummy_event, dummy_context)
+
+    mock_mark_processed.assert_not_called()
+
+
+@patch("handler.storage.download_file_from_s3")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_process_records_with_local_file_skips_download(
+    mock_transform, mock_upload, mock_load, mock_download, mock_append_log_entries
+):
+    identity = ObjectIdentity("/data", "raw/2025/01/01/data.csv", local_path="/data/data.csv")
+
+    result = handler.process_records([("raw/2025/01/01/data.csv", identity)])
+
+    assert result == {}
+    mock_download.assert_not_called()
+    mock_load.assert_called_once_with("/data/data.csv", TRANSACTIONS_V1)
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+
+
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_process_records_drains_transfer_metrics_of_each_batch(
+    mock_transform, mock_upload, mock_load, mock_append_log_entries
+):
+    mock_upload.side_effect = lambda key, path: storage._record_transfer(
+        "upload", key, 1, time.perf_counter()
+    )
+    identity = ObjectIdentity("/data", "raw/2025/01/01/data.csv", local_path="/data/data.csv")
+
+    for _ in range(3):
+        handler.process_records([("raw/2025/01/01/data.csv", identity)])
+
+    assert mock_upload.call_count == 3
+    assert storage.get_transfer_metrics() == []
+
+
+@patch("handler.validator.load_and_validate_csv", side_effect=ValueError("Invalid ZIP"))
+@patch("handler.storage.upload_file_to_s3")
+def test_process_records_with_invalid_local_file_uploads_it_to_quarantine(
+    mock_upload, mock_load, mock_copy, mock_append_log_entries
+):
+    identity = ObjectIdentity("/data", "raw/2025/01/01/data.csv", local_path="/data/data.csv")
+
+    result = handler.process_records([("raw/2025/01/01/data.csv", identity)])
+
+    assert result.keys() == {"raw/2025/01/01/data.csv"}
+    mock_copy.assert_not_called()
+    mock_upload.assert_called_once_with("quarantine/2025/01/01/data.csv", "/data/data.csv")
+    mock_append_log_entries.assert_called_once_with(
+        "quarantine-log.json",
+        LogType.QUARANTINE,
+        ["quarantine/2025/01/01/data.csv"],
+        aliases={},
+        sources=[None],
+    )
+
+
+@patch("handler.handler.COALESCE_ENABLED", True)
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.storage.upload_file_to_s3")
+def test_process_records_with_coalescing_writes_one_file_and_isolates_failures(
+    mock_upload, mock_upload_fileobj, mock_load, mock_append_log_entries
+):
+    records = [
+        (
+            f"raw/2025/01/01/{name}.csv",
+            ObjectIdentity("/data", f"raw/2025/01/01/{name}.csv", local_path=f"/data/{name}.csv"),
+        )
+        for name in "abc"
+    ]
+    frames = {
+        "/data/a.csv": pl.DataFrame({"amt": [1.0]}),
+        "/data/c.csv": pl.DataFrame({"amt": [2.0, 3.0]}),
+    }
+
+    def load(path, schema):
+        if path not in frames:
+            raise ValueError("Invalid ZIP")
+        return frames[path]
+
+    mock_load.side_effect = load
+
+    result = handler.process_records(records)
+
+    assert result.keys() == {"raw/2025/01/01/b.csv"}
+    mock_upload.assert_called_once_with("quarantine/2025/01/01/b.csv", "/data/b.csv")
+    output_key, buffer = mock_upload_fileobj.call_args.args
+    assert output_key.startswith("refined/2025/01/01/coalesced-")
+    # Records run concurrently, so the files are concatenated in any order.
+    assert pl.read_parquet(buffer).sort("amt").equals(pl.DataFrame({"amt": [1.0, 2.0, 3.0]}))
+    mock_append_log_entries.assert_any_call(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        [output_key, output_key],
+        aliases={},
+        sources=["raw/2025/01/01/a.csv", "raw/2025/01/01/c.csv"],
+    )
+
+
+@patch("handler.handler.COALESCE_ENABLED", True)
+@patch("handler.validator.load_and_validate_csv", return_value=pl.DataFrame({"amt": [1.0]}))
+@patch("handler.storage.upload_fileobj_to_s3", side_effect=Exception("Upload failed"))
+def test_process_records_with_failed_coalesced_write_fails_its_records(
+    mock_upload_fileobj, mock_load, mock_append_log_entries
+):
+    identity = ObjectIdentity("/data", "raw/2025/01/01/data.csv", local_path="/data/data.csv")
+
+    result = handler.process_records([("raw/2025/01/01/data.csv", identity)])
+
+    assert result.keys() == {"raw/2025/01/01/data.csv"}
+    mock_append_log_entries.assert_not_called()
+
+
+@patch("handler.handler.LEDGER_ENABLED", True)
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+@patch("handler.ledger.append_entry", side_effect=Exception("Ledger error"))
+def test_process_records_with_failed_ledger_entry_fails_record_without_quarantine(
+    mock_append_entry, mock_transform, mock_upload, mock_load, mock_copy
+):
+    identity = ObjectIdentity("/data", "raw/2025/01/01/data.csv", local_path="/data/data.csv")
+
+    result = handler.process_records([("raw/2025/01/01/data.csv", identity)])
+
+    assert str(result["raw/2025/01/01/data.csv"]) == "Ledger error"
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_append_entry.assert_called_once_with(
+        LogType.REFINEMENT, "refined/2025/01/01/data.parquet", None, None
+    )
+
+
+@patch("handler.handler.LEDGER_ENABLED", True)
+@patch("handler.handler.COALESCE_ENABLED", True)
+@patch("handler.validator.load_and_validate_csv", return_value=pl.DataFrame({"amt": [1.0]}))
+@patch("handler.storage.upload_fileobj_to_s3")
+@patch("handler.ledger.append_entry")
+def test_process_records_with_failed_coalesced_ledger_entry_fails_only_its_source(
+    mock_append_entry, mock_upload_fileobj, mock_load
+):
+    records = [
+        (
+            f"raw/2025/01/01/{name}.csv",
+            ObjectIdentity("/data", f"raw/2025/01/01/{name}.csv", local_path=f"/data/{name}.csv"),
+        )
+        for name in "ab"
+    ]
+
+    def append_entry(log_type, object_key, alias_of, source):
+        if source == "raw/2025/01/01/a.csv":
+            raise Exception("Ledger error")
+
+    mock_append_entry.side_effect = append_entry
+
+    result = handler.process_records(records)
+
+    assert result.keys() == {"raw/2025/01/01/a.csv"}
+    assert mock_append_entry.call_count == 2
+
+
+@patch("handler.handler.CONTENT_DEDUP_ENABLED", True)
+@patch("handler.storage.REFINED_BUCKET_NAME", "refined-bucket")
+@patch("handler.content_index.checksum_content_id", return_value="sha1:01:8")
+@patch("handler.content_index.lookup")
+@patch("handler.storage.download_file_from_s3")
+def test_handle_with_known_checksum_copies_outputs_without_download(
+    mock_download,
+    mock_lookup,
+    mock_checksum,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+    mock_append_log_entries,
+):
+    mock_lookup.return_value = {
+        "object_key": "raw/2024/12/31/data.csv",
+        "refined_keys": ["refined/2024/12/31/data.parquet"],
+        "refined_etags": {"refined/2024/12/31/data.parquet": '"etag"'},
+    }
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_download.assert_not_called()
+    mock_checksum.assert_called_once_with(ANY, handler._output_description(TRANSACTIONS_V1))
+    mock_copy.assert_called_once_with(
+        "refined-bucket",
+        "refined/2024/12/31/data.parquet",
+        "refined/2025/01/01/data.parquet",
+        if_match='"etag"',
+    )
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        aliases={"refined/2025/01/01/data.parquet": "refined/2024/12/31/data.parquet"},
+        sources=[None],
+    )
+
+
+@patch("handler.handler.CONTENT_DEDUP_ENABLED", True)
+@patch("handler.content_index.checksum_content_id", return_value=None)
+@patch("handler.content_index.hash_content_id", return_value="sha256:ab:8")
+@patch("handler.content_index.lookup", return_value=None)
+@patch("handler.content_index.record")
+@patch("handler.storage.get_object_etag", return_value='"etag"')
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_unknown_content_refines_and_indexes_it(
+    mock_transform,
+    mock_upload,
+    mock_load,
+    mock_download,
+    mock_etag,
+    mock_record,
+    mock_lookup,
+    mock_hash,
+    mock_checksum,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+):
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_hash.assert_called_once_with("/tmp/data.csv", handler._output_description(TRANSACTIONS_V1))
+    mock_lookup.assert_called_once_with("sha256:ab:8")
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_record.assert_called_once_with(
+        ["sha256:ab:8"], "raw/2025/01/01/data.csv", {"refined/2025/01/01/data.parquet": '"etag"'}
+    )
+    mock_copy.assert_not_called()
+
+
+@patch("handler.handler.CONTENT_DEDUP_ENABLED", True)
+@patch("handler.content_index.checksum_content_id", return_value="sha1:01:8")
+@patch("handler.content_index.hash_content_id", return_value="sha256:ab:8")
+@patch("handler.content_index.lookup")
+@patch("handler.content_index.record")
+@patch("handler.storage.get_object_etag", return_value='"etag"')
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_failing_alias_copy_refines_instead(
+    mock_transform,
+    mock_upload,
+    mock_load,
+    mock_download,
+    mock_etag,
+    mock_record,
+    mock_lookup,
+    mock_hash,
+    mock_checksum,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+):
+    mock_lookup.return_value = {
+        "object_key": "raw/2024/12/31/data.csv",
+        "refined_keys": ["refined/2024/12/31/data.parquet"],
+        "refined_etags": {"refined/2024/12/31/data.parquet": '"old"'},
+    }
+    mock_copy.side_effect = Exception("PreconditionFailed")
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_record.assert_called_once_with(
+        ["sha1:01:8", "sha256:ab:8"],
+        "raw/2025/01/01/data.csv",
+        {"refined/2025/01/01/data.parquet": '"etag"'},
+    )
+
+
+@patch("handler.handler.CONTENT_DEDUP_ENABLED", True)
+@patch("handler.content_index.checksum_content_id", return_value="sha1:01:8")
+@patch("handler.content_index.lookup")
+@patch("handler.content_index.record")
+@patch("handler.storage.get_object_etag", return_value='"new"')
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_reuploaded_content_and_changed_output_refines_instead(
+    mock_transform,
+    mock_upload,
+    mock_load,
+    mock_download,
+    mock_etag,
+    mock_record,
+    mock_lookup,
+    mock_checksum,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+    mock_append_log_entries,
+):
+    mock_lookup.return_value = {
+        "object_key": "raw/2025/01/01/data.csv",
+        "refined_keys": ["refined/2025/01/01/data.parquet"],
+        "refined_etags": {"refined/2025/01/01/data.parquet": '"old"'},
+    }
+
+    with patch("handler.content_index.hash_content_id", return_value="sha256:ab:8"):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_copy.assert_not_called()
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        aliases={},
+        sources=[None],
+    )
+
+
+@pytest.mark.parametrize("failing", ["checksum_content_id", "lookup"])
+@patch("handler.handler.CONTENT_DEDUP_ENABLED", True)
+@patch("handler.content_index.hash_content_id", return_value="sha256:ab:8")
+@patch("handler.content_index.record")
+@patch("handler.storage.get_object_etag", return_value='"etag"')
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_failing_content_index_refines_normally(
+    mock_transform,
+    mock_upload,
+    mock_load,
+    mock_download,
+    mock_etag,
+    mock_record,
+    mock_hash,
+    failing,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+):
+    forbidden = ClientError({"Error": {"Code": "403", "Message": "Forbidden"}}, "HeadObject")
+
+    with (
+        patch("handler.content_index.checksum_content_id", return_value="sha1:01:8"),
+        patch("handler.content_index.lookup", return_value=None),
+        patch(f"handler.content_index.{failing}", side_effect=forbidden),
+    ):
+        result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_copy.assert_not_called()
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+
+
+@patch("handler.handler.ASYNC_IO_ENABLED", True)
+@patch("handler.log_manager.download_log_file_with_etag")
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv")
+@patch("handler.storage.upload_file_to_s3")
+@patch("handler.transform.transform_dataframe_to_parquet", return_value="/tmp/data.parquet")
+def test_handle_with_async_io_prefetches_logs_while_processing(
+    mock_transform,
+    mock_upload,
+    mock_load,
+    mock_download,
+    mock_download_log,
+    dummy_event,
+    dummy_context,
+    mock_append_log_entries,
+):
+    record_started, log_prefetched = threading.Event(), threading.Event()
+
+    def load(source, schema):
+        record_started.set()
+        # Only returns if the log is prefetched while the record is processed.
+        assert log_prefetched.wait(timeout=5)
+
+    def download_log(log_key):
+        if log_key == "refinement-log.json":
+            assert record_started.wait(timeout=5)
+            log_prefetched.set()
+        return {"ingested_files": []}, '"etag-1"'
+
+    mock_load.side_effect = load
+    mock_download_log.side_effect = download_log
+
+    result = handler.handle_event(dummy_event, dummy_context)
+
+    assert result == {"batchItemFailures": []}
+    mock_upload.assert_called_once_with("refined/2025/01/01/data.parquet", "/tmp/data.parquet")
+    mock_append_log_entries.assert_called_once_with(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/2025/01/01/data.parquet"],
+        {},
+        ({"ingested_files": []}, '"etag-1"'),
+        [None],
+    )
+
+
+@patch("handler.handler.ASYNC_IO_ENABLED", True)
+@patch("handler.log_manager.download_log_file_with_etag", side_effect=Exception("Access denied"))
+@patch("handler.storage.download_file_from_s3", return_value="/tmp/data.csv")
+@patch("handler.validator.load_and_validate_csv", side_effect=ValueError("Invalid ZIP"))
+def test_handle_with_async_io_and_failed_prefetch_still_logs_quarantine(
+    mock_load,
+    mock_download,
+    mock_download_log,
+    dummy_event,
+    dummy_context,
+    mock_copy,
+    mock_append_log_entries,
+):
+    with pytest.raises(Exception, match="Invalid ZIP"):
+        handler.handle_event(dummy_event, dummy_context)
+
+    mock_copy.assert_called_once()
+    mock_append_log_entries.assert_called_once_with(
+        "quarantine-log.json",
+        LogType.QUARANTINE,
+        ["quarantine/2025/01/01/data.csv"],
+        {},
+        None,
+        [None],
     )
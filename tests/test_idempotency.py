@@ -0,0 +1,73 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+import handler.idempotency as idempotency
+from handler.idempotency import ObjectIdentity, TTLCache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    idempotency._cache.clear()
+
+
+@pytest.fixture
+def identity():
+    return ObjectIdentity("raw-bucket", "raw/data.csv", etag="abc123")
+
+
+def test_ttl_cache_with_expired_entry_returns_false():
+    cache = TTLCache(max_size=10, ttl_seconds=0)
+    cache.add("key")
+
+    assert "key" not in cache
+
+
+def test_ttl_cache_with_full_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.add("a")
+    cache.add("b")
+    assert "a" in cache
+    cache.add("c")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_object_identity_digest_depends_on_etag(identity):
+    other = ObjectIdentity("raw-bucket", "raw/data.csv", etag="def456")
+
+    assert identity.digest != other.digest
+
+
+@patch("handler.idempotency.object_exists")
+def test_is_processed_with_unversioned_identity_returns_false(mock_exists):
+    assert not idempotency.is_processed(ObjectIdentity("raw-bucket", "raw/data.csv"))
+    mock_exists.assert_not_called()
+
+
+@patch("handler.idempotency.object_exists", return_value=True)
+def test_is_processed_with_marker_returns_true_and_caches(mock_exists, identity):
+    assert idempotency.is_processed(identity)
+    assert idempotency.is_processed(identity)
+
+    mock_exists.assert_called_once_with(f"idempotency/{identity.digest}.json")
+
+
+@patch("handler.idempotency.object_exists", return_value=False)
+def test_is_processed_with_unknown_identity_returns_false(mock_exists, identity):
+    assert not idempotency.is_processed(identity)
+
+
+@patch("handler.idempotency.object_exists")
+@patch("handler.idempotency.put_bytes_to_s3")
+def test_mark_processed_writes_marker_and_caches(mock_put, mock_exists, identity):
+    idempotency.mark_processed(identity, "refined/data.parquet")
+
+    marker_key, body = mock_put.call_args.args
+    assert marker_key == f"idempotency/{identity.digest}.json"
+    assert json.loads(body)["refined_key"] == "refined/data.parquet"
+    assert idempotency.is_processed(identity)
+    mock_exists.assert_not_called()
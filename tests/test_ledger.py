@@ -0,0 +1,79 @@
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+import handler.ledger as ledger
+from handler.log_type import LogType
+
+
+@pytest.fixture
+def fake_bucket():
+    objects: dict[str, bytes] = {}
+
+    def delete(keys):
+        for key in keys:
+            del objects[key]
+
+    with (
+        patch("handler.ledger.put_bytes_to_s3", side_effect=objects.__setitem__),
+        patch("handler.ledger.get_bytes_from_s3", side_effect=objects.__getitem__),
+        patch(
+            "handler.ledger.list_object_keys",
+            side_effect=lambda prefix: sorted(key for key in objects if key.startswith(prefix)),
+        ),
+        patch("handler.ledger.delete_objects_from_s3", side_effect=delete),
+    ):
+        yield objects
+
+
+def test_append_entry_writes_one_record_per_entry(fake_bucket):
+    first = ledger.append_entry(LogType.REFINEMENT, "refined/a.parquet")
+    second = ledger.append_entry(LogType.REFINEMENT, "refined/b.parquet")
+
+    assert first["id"] != second["id"]
+    assert len(fake_bucket) == 2
+    assert all(key.startswith("ledger/refinement/records/dt=") for key in fake_bucket)
+
+
+def test_read_ledger_returns_entries_of_requested_log_type(fake_bucket):
+    ledger.append_entry(LogType.REFINEMENT, "refined/a.parquet")
+    ledger.append_entry(LogType.QUARANTINE, "quarantine/b.csv")
+    ledger.append_entry(LogType.REFINEMENT, "refined/c.parquet")
+
+    result = ledger.read_ledger(LogType.REFINEMENT)
+
+    assert [entry["file"] for entry in result] == ["refined/a.parquet", "refined/c.parquet"]
+
+
+def test_compact_ledger_merges_records_into_segment(fake_bucket):
+    entries = [ledger.append_entry(LogType.REFINEMENT, f"refined/{i}.parquet") for i in range(3)]
+    today = date.fromisoformat(entries[0]["timestamp"][:10])
+
+    segment_key = ledger.compact_ledger(LogType.REFINEMENT, today)
+
+    assert list(fake_bucket) == [segment_key]
+    assert segment_key.endswith(".jsonl")
+    assert ledger.read_ledger(LogType.REFINEMENT) == entries
+
+
+def test_compact_ledger_with_no_records_returns_none(fake_bucket):
+    assert ledger.compact_ledger(LogType.QUARANTINE, date(2025, 1, 1)) is None
+
+
+def test_read_ledger_deduplicates_entries_present_in_record_and_segment(fake_bucket):
+    entry = ledger.append_entry(LogType.REFINEMENT, "refined/a.parquet")
+    record_key = next(iter(fake_bucket))
+    record = fake_bucket[record_key]
+    ledger.compact_ledger(LogType.REFINEMENT, date.fromisoformat(entry["timestamp"][:10]))
+    fake_bucket[record_key] = record
+
+    assert ledger.read_ledger(LogType.REFINEMENT) == [entry]
+
+
+def test_read_ledger_filters_by_date_range(fake_bucket):
+    entry = ledger.append_entry(LogType.REFINEMENT, "refined/a.parquet")
+    day = date.fromisoformat(entry["timestamp"][:10])
+
+    assert ledger.read_ledger(LogType.REFINEMENT, start=day, end=day) == [entry]
+    assert ledger.read_ledger(LogType.REFINEMENT, end=date(2000, 1, 1)) == []
@@ -0,0 +1,203 @@
+import hashlib
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+import polars as pl
+import pytest
+from botocore.exceptions import ClientError
+
+import handler.log_index as log_index
+from handler.log_type import LogType
+
+
+@pytest.fixture
+def fake_bucket():
+    objects: dict[str, bytes] = {}
+    segment_reads: list[str] = []
+
+    def get_with_etag(key):
+        if key not in objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": key}}, "GetObject")
+        return objects[key], hashlib.md5(objects[key]).hexdigest()
+
+    def put(key, data, if_match=None, if_none_match=False):
+        current = hashlib.md5(objects[key]).hexdigest() if key in objects else None
+        if (if_match and if_match != current) or (if_none_match and current):
+            raise ClientError(
+                {"Error": {"Code": "PreconditionFailed", "Message": key}}, "PutObject"
+            )
+        objects[key] = data
+        return hashlib.md5(data).hexdigest()
+
+    def get(key):
+        segment_reads.append(key)
+        return objects[key]
+
+    with (
+        patch("handler.log_manager.REFINED_BUCKET_NAME", "test-bucket"),
+        patch("handler.log_manager.get_bytes_with_etag_from_s3", side_effect=get_with_etag),
+        patch("handler.log_manager.put_bytes_to_s3", side_effect=put),
+        patch("handler.log_index.get_bytes_with_etag_from_s3", side_effect=get_with_etag),
+        patch("handler.log_index.put_bytes_to_s3", side_effect=put),
+        patch(
+            "handler.log_index.upload_fileobj_to_s3",
+            side_effect=lambda key, buffer: objects.__setitem__(key, buffer.read()),
+        ),
+        patch("handler.log_index.get_bytes_from_s3", side_effect=get),
+    ):
+        yield objects, segment_reads
+
+
+def _write_log(objects, log_type, entries):
+    key = log_index.LOG_FILE_KEYS[log_type]
+    objects[key] = json.dumps({log_index.LOG_FIELDS[log_type]: entries}).encode()
+
+
+def _entry(day, file, alias_of=None):
+    entry = {"timestamp": f"2025-01-{day:02d}T12:00:00.000001", "file": file}
+    if alias_of:
+        entry["alias_of"] = alias_of
+    return entry
+
+
+@pytest.fixture
+def compacted(fake_bucket):
+    objects, _ = fake_bucket
+    entries = [_entry(day, f"refined/2025/01/{day:02d}/data.parquet") for day in range(1, 6)]
+    entries.append(_entry(5, "refined/copy.parquet", alias_of="refined/2025/01/05/data.parquet"))
+    _write_log(objects, LogType.REFINEMENT, entries)
+    with patch("handler.log_index.LOG_INDEX_BLOCK_ROWS", 2):
+        log_index.compact_log(LogType.REFINEMENT)
+    return entries
+
+
+def test_compact_log_moves_entries_into_segments(fake_bucket, compacted):
+    objects, _ = fake_bucket
+
+    log_data = json.loads(objects["refinement-log.json"])
+    segments = sorted(key for key in objects if key.startswith("log-index/refinement/segments/"))
+    index = pl.read_parquet(objects["log-index/refinement/index.parquet"])
+    by_timestamp = index.filter(pl.col("order") == "timestamp").sort("segment")
+
+    assert log_data == {"ingested_files": []}
+    assert len(segments) == 6
+    assert [len(pl.read_parquet(objects[key])) for key in segments] == [2] * 6
+    assert sorted(index.get_column("segment").to_list()) == segments
+    assert by_timestamp.row(0, named=True)["min_file"] == "refined/2025/01/01/data.parquet"
+    assert by_timestamp.row(0, named=True)["max_file"] == "refined/2025/01/02/data.parquet"
+    assert log_index.lookup(LogType.REFINEMENT) == compacted
+
+
+def test_compact_log_with_no_entries_returns_nothing(fake_bucket):
+    assert log_index.compact_log(LogType.QUARANTINE) == []
+
+
+def test_lookup_by_file_reads_only_segments_with_its_key(fake_bucket, compacted):
+    _, segment_reads = fake_bucket
+
+    result = log_index.lookup(LogType.REFINEMENT, file="refined/2025/01/03/data.parquet")
+
+    assert result == [compacted[2]]
+    assert len(segment_reads) == 1
+
+
+def test_lookup_by_file_with_interleaved_arrivals_reads_one_segment(fake_bucket):
+    objects, segment_reads = fake_bucket
+    # Backfilled days arrive interleaved, so every timestamp-sorted segment spans all keys.
+    entries = [
+        {
+            "timestamp": f"2025-01-10T12:00:{second:02d}.000001",
+            "file": f"refined/2024/12/{second % 10 + 1:02d}/part-{second}.parquet",
+        }
+        for second in range(40)
+    ]
+    _write_log(objects, LogType.REFINEMENT, entries)
+    with patch("handler.log_index.LOG_INDEX_BLOCK_ROWS", 4):
+        log_index.compact_log(LogType.REFINEMENT)
+
+    result = log_index.lookup(LogType.REFINEMENT, file=entries[17]["file"])
+
+    assert result == [entries[17]]
+    assert len(segment_reads) == 1
+
+
+def test_lookup_by_time_range_reads_overlapping_segments(fake_bucket, compacted):
+    _, segment_reads = fake_bucket
+
+    result = log_index.lookup(
+        LogType.REFINEMENT, start=datetime(2025, 1, 5), end=datetime(2025, 1, 6)
+    )
+
+    assert result == compacted[4:]
+    assert len(segment_reads) == 1
+
+
+def test_lookup_merges_entries_not_compacted_yet(fake_bucket, compacted):
+    objects, _ = fake_bucket
+    live = _entry(7, "refined/2025/01/07/data.parquet")
+    _write_log(objects, LogType.REFINEMENT, [compacted[0], live])
+
+    result = log_index.lookup(LogType.REFINEMENT, start=datetime(2025, 1, 1))
+
+    assert result == [*compacted, live]
+
+
+def test_lookup_keeps_entries_of_every_source(fake_bucket):
+    objects, _ = fake_bucket
+    entries = [
+        {**_entry(1, "refined/coalesced.parquet"), "source": f"raw/{name}.csv"} for name in "ab"
+    ]
+    _write_log(objects, LogType.REFINEMENT, entries)
+    log_index.compact_log(LogType.REFINEMENT)
+
+    assert log_index.lookup(LogType.REFINEMENT, file="refined/coalesced.parquet") == entries
+
+
+def test_compact_log_twice_appends_to_index(fake_bucket, compacted):
+    objects, _ = fake_bucket
+    later = _entry(9, "refined/2025/01/09/data.parquet")
+    _write_log(objects, LogType.REFINEMENT, [later])
+
+    log_index.compact_log(LogType.REFINEMENT)
+
+    assert log_index.lookup(LogType.REFINEMENT) == [*compacted, later]
+    assert log_index.lookup(LogType.QUARANTINE) == []
+
+
+def test_compact_log_keeps_entries_logged_during_compaction(fake_bucket):
+    objects, _ = fake_bucket
+    first = _entry(1, "refined/a.parquet")
+    concurrent = _entry(2, "refined/b.parquet")
+    _write_log(objects, LogType.REFINEMENT, [first])
+    upload = log_index.upload_fileobj_to_s3.side_effect
+
+    def upload_while_logging(key, buffer):
+        upload(key, buffer)
+        _write_log(objects, LogType.REFINEMENT, [first, concurrent])
+
+    with patch("handler.log_index.upload_fileobj_to_s3", side_effect=upload_while_logging):
+        log_index.compact_log(LogType.REFINEMENT)
+
+    assert json.loads(objects["refinement-log.json"]) == {"ingested_files": [concurrent]}
+    assert log_index.lookup(LogType.REFINEMENT) == [first, concurrent]
+
+
+@patch("handler.log_index.time.sleep")
+def test_compact_log_with_index_changed_concurrently_retries(mock_sleep, fake_bucket):
+    objects, _ = fake_bucket
+    entries = [_entry(1, "refined/a.parquet")]
+    _write_log(objects, LogType.REFINEMENT, entries)
+    put = log_index.put_bytes_to_s3.side_effect
+    conflicts = iter([True])
+
+    def put_after_other_compaction(key, data, **kwargs):
+        if key.endswith("index.parquet") and next(conflicts, False):
+            objects[key] = log_index._to_parquet(pl.DataFrame(schema=log_index.INDEX_SCHEMA))
+        return put(key, data, **kwargs)
+
+    with patch("handler.log_index.put_bytes_to_s3", side_effect=put_after_other_compaction):
+        log_index.compact_log(LogType.REFINEMENT)
+
+    mock_sleep.assert_called_once()
+    assert log_index.lookup(LogType.REFINEMENT) == entries
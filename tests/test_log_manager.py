@@ -1,11 +1,19 @@
+import asyncio
 import json
-from unittest.mock import mock_open, patch
+from unittest.mock import ANY, mock_open, patch
 
 import pytest
 from botocore.exceptions import ClientError
 
 import handler.log_manager as log_manager
 from handler.log_type import LogType
+from handler.scratch import ScratchSpace
+
+
+@pytest.fixture(autouse=True)
+def scratch_space(tmp_path):
+    with patch("handler.log_manager.scratch", ScratchSpace(str(tmp_path / "scratch"), 1024)):
+        yield
 
 
 @patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
@@ -61,7 +69,7 @@ def test_download_log_file_with_success_returns_dict(mock_open_func, mock_downlo
             {"timestamp": "2025-05-08T21:55:40.592096", "file": "refined/data.parquet"}
         ]
     }
-    mock_download_file.assert_called_once_with("test_bucket", "test_log.json")
+    mock_download_file.assert_called_once_with("test_bucket", "test_log.json", ANY)
     mock_open_func.assert_called_once_with("/tmp/test_log.json", "r")
 
 
@@ -102,11 +110,13 @@ def test_upload_log_file_with_success_returns_none(mock_open_func, mock_upload_f
 
     log_manager.upload_log_file(log_key, log_data)
 
-    mock_open_func.assert_called_once_with("/tmp/refinement-log.json", "w")
+    local_path = mock_open_func.call_args.args[0]
+    assert local_path.endswith("/refinement-log.json")
+    mock_open_func.assert_called_once_with(local_path, "w")
     handle = mock_open_func()
     written_content = "".join(call.args[0] for call in handle.write.call_args_list)
     assert json.loads(written_content) == log_data
-    mock_upload_file.assert_called_once_with(log_key, "/tmp/refinement-log.json")
+    mock_upload_file.assert_called_once_with(log_key, local_path)
 
 
 @patch("handler.log_manager.upload_file_to_s3")
@@ -124,3 +134,142 @@ def test_upload_log_file_with_exception_raises_exception(mock_open_func, mock_up
 
     with pytest.raises(Exception, match="Upload failed"):
         log_manager.upload_log_file(log_key, log_data)
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "PutObject")
+
+
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_with_missing_log_creates_it_conditionally(mock_get, mock_put):
+    mock_get.side_effect = _client_error("NoSuchKey")
+
+    result = log_manager.append_log_entries(
+        "refinement-log.json", LogType.REFINEMENT, ["refined/a.parquet", "refined/b.parquet"]
+    )
+
+    assert [entry["file"] for entry in result["ingested_files"]] == [
+        "refined/a.parquet",
+        "refined/b.parquet",
+    ]
+    mock_put.assert_called_once()
+    assert mock_put.call_args.kwargs == {"if_match": None, "if_none_match": True}
+
+
+@patch("handler.log_manager.time.sleep")
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_with_concurrent_update_retries_on_latest_version(
+    mock_get, mock_put, mock_sleep
+):
+    mock_get.side_effect = [
+        (json.dumps({"ingested_files": []}).encode(), '"etag-1"'),
+        (json.dumps({"ingested_files": [{"file": "refined/other.parquet"}]}).encode(), '"etag-2"'),
+    ]
+    mock_put.side_effect = [_client_error("PreconditionFailed"), '"etag-3"']
+
+    result = log_manager.append_log_entries(
+        "refinement-log.json", LogType.REFINEMENT, ["refined/a.parquet"]
+    )
+
+    assert [entry["file"] for entry in result["ingested_files"]] == [
+        "refined/other.parquet",
+        "refined/a.parquet",
+    ]
+    assert mock_put.call_args_list[0].kwargs["if_match"] == '"etag-1"'
+    assert mock_put.call_args_list[1].kwargs["if_match"] == '"etag-2"'
+    mock_sleep.assert_called_once()
+
+
+@patch("handler.log_manager.MAX_LOG_WRITE_ATTEMPTS", 3)
+@patch("handler.log_manager.time.sleep")
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_with_persistent_conflict_raises_after_max_attempts(
+    mock_get, mock_put, mock_sleep
+):
+    mock_get.return_value = (b"{}", '"etag-1"')
+    mock_put.side_effect = _client_error("ConditionalRequestConflict")
+
+    with pytest.raises(ClientError):
+        log_manager.append_log_entries("refinement-log.json", LogType.REFINEMENT, ["a"])
+
+    assert mock_put.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_with_other_client_error_raises_without_retry(mock_get, mock_put):
+    mock_get.return_value = (b"{}", '"etag-1"')
+    mock_put.side_effect = _client_error("AccessDenied")
+
+    with pytest.raises(ClientError, match="AccessDenied"):
+        log_manager.append_log_entries("refinement-log.json", LogType.REFINEMENT, ["a"])
+
+    mock_put.assert_called_once()
+
+
+def test_update_log_with_alias_records_aliased_output():
+    result = log_manager.update_log(
+        {}, LogType.REFINEMENT, "refined/b.parquet", alias_of="refined/a.parquet"
+    )
+
+    assert result["ingested_files"][0]["alias_of"] == "refined/a.parquet"
+
+
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3", return_value=(b"{}", '"etag-1"'))
+def test_append_log_entries_with_sources_logs_output_once_per_source(mock_get, mock_put):
+    result = log_manager.append_log_entries(
+        "refinement-log.json",
+        LogType.REFINEMENT,
+        ["refined/coalesced.parquet", "refined/coalesced.parquet"],
+        sources=["raw/a.csv", "raw/b.csv"],
+    )
+
+    assert [entry["source"] for entry in result["ingested_files"]] == ["raw/a.csv", "raw/b.csv"]
+    assert {entry["file"] for entry in result["ingested_files"]} == {"refined/coalesced.parquet"}
+
+
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_with_prefetched_log_skips_first_read(mock_get, mock_put):
+    prefetched = ({"ingested_files": [{"file": "refined/other.parquet"}]}, '"etag-1"')
+
+    result = log_manager.append_log_entries(
+        "refinement-log.json", LogType.REFINEMENT, ["refined/a.parquet"], prefetched=prefetched
+    )
+
+    assert len(result["ingested_files"]) == 2
+    mock_get.assert_not_called()
+    assert mock_put.call_args.kwargs == {"if_match": '"etag-1"', "if_none_match": False}
+
+
+@patch("handler.log_manager.time.sleep")
+@patch("handler.log_manager.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.log_manager.put_bytes_to_s3")
+@patch("handler.log_manager.get_bytes_with_etag_from_s3")
+def test_append_log_entries_async_with_stale_prefetch_rereads_log(mock_get, mock_put, mock_sleep):
+    mock_get.return_value = (json.dumps({"ingested_files": []}).encode(), '"etag-2"')
+    mock_put.side_effect = [_client_error("PreconditionFailed"), '"etag-3"']
+
+    result = asyncio.run(
+        log_manager.append_log_entries_async(
+            "refinement-log.json",
+            LogType.REFINEMENT,
+            ["refined/a.parquet"],
+            prefetched=({}, '"etag-1"'),
+        )
+    )
+
+    assert [entry["file"] for entry in result["ingested_files"]] == ["refined/a.parquet"]
+    mock_get.assert_called_once_with("refinement-log.json")
+    assert mock_put.call_args_list[1].kwargs["if_match"] == '"etag-2"'
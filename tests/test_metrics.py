@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import handler.metrics as metrics
+
+
+@pytest.fixture
+def sink():
+    sink = metrics.JsonSink()
+    previous = metrics.set_sink(sink)
+    yield sink
+    metrics.set_sink(previous)
+
+
+def test_stage_emits_measurements(sink):
+    with metrics.stage("load", object_key="raw/a.csv") as measured:
+        measured.rows = 3
+        measured.bytes_in = 42
+
+    (record,) = sink.records
+    assert record.stage == "load"
+    assert record.rows == 3
+    assert record.bytes_in == 42
+    assert record.wall_seconds >= 0
+    assert record.failed is False
+    assert record.properties == {"object_key": "raw/a.csv"}
+
+
+def test_stage_marks_failures_and_reraises(sink):
+    with pytest.raises(ValueError), metrics.stage("validate"):
+        raise ValueError("boom")
+
+    assert sink.records[0].failed is True
+
+
+def test_instrumented_wraps_function(sink):
+    @metrics.instrumented("log_update")
+    def update(value):
+        return value * 2
+
+    assert update(21) == 42
+    assert [record.stage for record in sink.records] == ["log_update"]
+
+
+def test_stage_skipped_when_disabled(sink, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+
+    with metrics.stage("load"):
+        pass
+
+    assert sink.records == []
+
+
+def test_json_sink_appends_lines(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    sink = metrics.JsonSink(str(path))
+
+    sink.emit(metrics.StageMetrics("upload", bytes_out=10))
+    sink.emit(metrics.StageMetrics("download", bytes_in=20))
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["stage"] for line in lines] == ["upload", "download"]
+    assert lines[0]["bytes_out"] == 10
+
+
+def test_emf_sink_prints_embedded_metric_format(capsys):
+    metrics.EmfSink("Test").emit(metrics.StageMetrics("write_parquet", rows=5))
+
+    document = json.loads(capsys.readouterr().out)
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "Test"
+    assert directive["Dimensions"] == [["Stage"]]
+    assert {"Name": "Rows", "Unit": "Count"} in directive["Metrics"]
+    assert document["Stage"] == "write_parquet"
+    assert document["Rows"] == 5
+
+
+def test_emit_errors_do_not_break_stage(monkeypatch):
+    class BrokenSink:
+        def emit(self, _):
+            raise OSError("disk full")
+
+    previous = metrics.set_sink(BrokenSink())
+    try:
+        with metrics.stage("load") as measured:
+            measured.rows = 1
+    finally:
+        metrics.set_sink(previous)
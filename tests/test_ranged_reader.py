@@ -0,0 +1,153 @@
+from unittest.mock import patch
+
+import polars as pl
+import pytest
+
+import handler.ranged_reader as ranged_reader
+import handler.validator as validator
+
+
+def _row(i: int, street: str = "3683 Parrish Circles", is_fraud: int = 0) -> str:
+    return (
+        f"2019-01-20 00:02:{i % 60:02d},676309913934,fraud_Murray-Smitham,grocery_pos,{i}.0,"
+        f"Robert,Martinez,M,{street},Pueblo,CO,81005,38.2352,-104.66,151815,Lecturer,"
+        f"1988-01-04,trans-{i},1327017725,38.994192,-105.02271,{is_fraud}"
+    )
+
+
+@pytest.fixture
+def csv_bytes():
+    header = ",".join(validator.EXPECTED_SCHEMA_MAPPING)
+    rows = [
+        _row(i, street='"Apt. 4\n""Rear"", Parrish\nCircles"' if i % 3 == 0 else "Main Street")
+        for i in range(40)
+    ]
+    return ("\n".join([header, *rows]) + "\n").encode()
+
+
+def _serve(data: bytes):
+    return lambda bucket, key, start, end: data[start : end + 1]
+
+
+def test_plan_ranges_covers_object():
+    assert ranged_reader.plan_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+
+
+def test_find_record_start_skips_newlines_in_quoted_fields():
+    assert ranged_reader.find_record_start(b'a,"x\ny",b\nc', in_quotes=False) == 10
+    assert ranged_reader.find_record_start(b'x\ny",b\nc', in_quotes=True) == 7
+    assert ranged_reader.find_record_start(b"no newline", in_quotes=False) is None
+
+
+@pytest.mark.parametrize("range_size", [7, 50, 128, 1 << 20])
+def test_iter_records_cuts_at_record_boundaries(csv_bytes, range_size):
+    chunks = [
+        csv_bytes[start : end + 1]
+        for start, end in ranged_reader.plan_ranges(len(csv_bytes), range_size)
+    ]
+
+    header, *parts = ranged_reader.iter_records(chunks)
+
+    assert header + b"".join(parts) == csv_bytes
+    for part in parts:
+        assert part.endswith(b"\n")
+        assert part.count(b'"') % 2 == 0
+
+
+@pytest.mark.parametrize("range_size", [64, 300, 1 << 20])
+def test_scan_csv_ranges_matches_single_read(csv_bytes, range_size):
+    with (
+        patch("handler.ranged_reader.RANGE_SIZE", range_size),
+        patch("handler.storage.get_object_range", side_effect=_serve(csv_bytes)),
+    ):
+        result = ranged_reader.scan_csv_ranges("bucket", "raw/big.csv", len(csv_bytes)).collect()
+
+    assert result.equals(validator.read_csv(csv_bytes))
+    assert result["street"][0] == 'Apt. 4\n"Rear", Parrish\nCircles'
+
+
+def test_scan_csv_ranges_looks_up_size(csv_bytes):
+    with (
+        patch("handler.storage.get_object_size", return_value=len(csv_bytes)) as mock_size,
+        patch("handler.storage.get_object_range", side_effect=_serve(csv_bytes)),
+    ):
+        result = ranged_reader.scan_csv_ranges("bucket", "raw/big.csv").collect()
+
+    mock_size.assert_called_once_with("bucket", "raw/big.csv")
+    assert len(result) == 40
+
+
+def test_read_csv_ranges_keeps_invalid_rows(csv_bytes):
+    data = csv_bytes + (_row(99, is_fraud=2) + "\n").encode()
+
+    with (
+        patch("handler.ranged_reader.RANGE_SIZE", 256),
+        patch("handler.storage.get_object_range", side_effect=_serve(data)),
+    ):
+        result = ranged_reader.read_csv_ranges("bucket", "raw/big.csv", len(data))
+
+    assert isinstance(result, pl.DataFrame)
+    assert result["is_fraud"].to_list()[-1] == 2
+
+
+def test_find_record_end_skips_newlines_in_quoted_fields():
+    assert ranged_reader.find_record_end(b'a\nb,"x\ny",c', in_quotes=False) == 2
+    assert ranged_reader.find_record_end(b'x\ny",b\nc', in_quotes=True) == 7
+    assert ranged_reader.find_record_end(b"no newline", in_quotes=False) is None
+
+
+def test_iter_records_yields_parts_before_reading_all_chunks(csv_bytes):
+    read = []
+
+    def chunks():
+        for start, end in ranged_reader.plan_ranges(len(csv_bytes), 64):
+            read.append(start)
+            yield csv_bytes[start : end + 1]
+
+    records = ranged_reader.iter_records(chunks())
+    next(records)
+    next(records)
+
+    assert len(read) < len(ranged_reader.plan_ranges(len(csv_bytes), 64)) / 2
+
+
+def test_parse_ranges_bounds_ranges_fetched_ahead(csv_bytes):
+    with (
+        patch("handler.ranged_reader.RANGE_SIZE", 64),
+        patch("handler.ranged_reader.MAX_RANGE_CONCURRENCY", 2),
+        patch("handler.storage.get_object_range", side_effect=_serve(csv_bytes)) as mock_range,
+    ):
+        parts = ranged_reader._parse_ranges(
+            "bucket", "raw/big.csv", len(csv_bytes), validator.DEFAULT_SCHEMA, validate=True
+        )
+        next(parts)
+        fetched_ahead = mock_range.call_count
+        frames = [frame for frame, _ in parts]
+
+    assert fetched_ahead < mock_range.call_count / 2
+    assert mock_range.call_count == len(ranged_reader.plan_ranges(len(csv_bytes), 64))
+    assert len(frames) > 1
+
+
+def test_scan_csv_ranges_sinks_parts_like_single_read(csv_bytes, tmp_path):
+    with (
+        patch("handler.ranged_reader.RANGE_SIZE", 64),
+        patch("handler.storage.get_object_range", side_effect=_serve(csv_bytes)),
+    ):
+        ranged_reader.scan_csv_ranges("bucket", "raw/big.csv", len(csv_bytes)).sink_parquet(
+            tmp_path / "big.parquet"
+        )
+
+    assert pl.read_parquet(tmp_path / "big.parquet").equals(validator.read_csv(csv_bytes))
+
+
+def test_scan_csv_ranges_with_invalid_row_raises_on_write(csv_bytes, tmp_path):
+    data = csv_bytes + (_row(99, is_fraud=2) + "\n").encode()
+
+    with (
+        patch("handler.ranged_reader.RANGE_SIZE", 256),
+        patch("handler.storage.get_object_range", side_effect=_serve(data)),
+    ):
+        frame = ranged_reader.scan_csv_ranges("bucket", "raw/big.csv", len(data))
+        with pytest.raises(pl.exceptions.ComputeError, match="Invalid values found in is_fraud"):
+            frame.sink_parquet(tmp_path / "big.parquet")
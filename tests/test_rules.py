@@ -0,0 +1,129 @@
+import polars as pl
+import pytest
+
+from handler.rules import (
+    InSetRule,
+    NonNullRule,
+    RangeRule,
+    RegexRule,
+    Rule,
+    SchemaRule,
+    evaluate_rules,
+    merge_reports,
+    split_rows,
+)
+
+
+@pytest.fixture
+def df():
+    return pl.DataFrame(
+        {
+            "zip": ["1234", "12345-6", None, "98765"],
+            "is_fraud": [0, 1, 3, 0],
+            "amt": [10.0, -5.0, 20.0, None],
+            "empty": [None, None, None, None],
+        },
+        schema_overrides={"empty": pl.Utf8},
+    )
+
+
+def test_evaluate_rules_with_valid_data_returns_passing_report(df):
+    rules = [
+        NonNullRule("zip"),
+        InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1, 3)),
+        RangeRule("amt", "Invalid amount", min_value=-10, max_value=100),
+    ]
+
+    report = evaluate_rules(df, rules)
+
+    assert report.passed
+    assert report.rows == 4
+    assert [result.violations for result in report.results] == [1, 0, 0]
+
+
+def test_evaluate_rules_with_violations_returns_counts_and_samples(df):
+    rules = [
+        InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1)),
+        RegexRule("zip", "Invalid ZIP", pattern=r"^\d{5}(-\d{4})?$", zfill=5),
+        RangeRule("amt", "Invalid amount", min_value=0),
+    ]
+
+    report = evaluate_rules(df, rules, sample_size=5)
+
+    assert [result.violations for result in report.failures] == [1, 1, 1]
+    assert report.failures[0].sample.get_column("is_fraud").to_list() == [3]
+    assert report.failures[1].sample.get_column("zip").to_list() == ["12345-6"]
+    assert report.failures[2].sample.get_column("amt").to_list() == [-5.0]
+
+
+def test_evaluate_rules_with_null_only_column_fails_non_null_rule(df):
+    report = evaluate_rules(df, [NonNullRule("empty"), NonNullRule("zip", allow_partial=False)])
+
+    assert [result.failed for result in report.results] == [True, True]
+    assert report.as_dict()["passed"] is False
+
+
+def test_evaluate_rules_with_lazyframe_matches_eager(df):
+    rules = [InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1))]
+
+    eager = evaluate_rules(df, rules)
+    lazy = evaluate_rules(df.lazy(), rules)
+
+    assert lazy.as_dict() == eager.as_dict()
+
+
+def test_evaluate_rules_with_lazyframe_samples_only_failed_rules(df):
+    rules = [InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1)), NonNullRule("zip")]
+
+    report = evaluate_rules(df.lazy(), rules, sample_size=5)
+
+    assert report.results[0].sample.get_column("is_fraud").to_list() == [3]
+    assert report.results[1].sample.is_empty()
+
+
+def test_evaluate_rules_with_schema_mismatch_fails_schema_rule(df):
+    rule = SchemaRule({"zip": pl.Utf8(), "is_fraud": pl.Int8(), "missing": pl.Int64()})
+
+    report = evaluate_rules(df, [rule])
+
+    assert report.failures[0].violations == 2
+
+
+def test_merge_reports_judges_rules_on_totals():
+    rules = [NonNullRule("zip"), InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1))]
+    first = evaluate_rules(pl.DataFrame({"zip": [None, None], "is_fraud": [0, 1]}), rules)
+    second = evaluate_rules(pl.DataFrame({"zip": ["12345", None], "is_fraud": [2, 0]}), rules)
+
+    report = merge_reports([first, second])
+
+    assert report.rows == 4
+    zip_result, is_fraud_result = report.results
+    assert first.results[0].failed
+    assert (zip_result.violations, zip_result.failed) == (3, False)
+    assert (is_fraud_result.violations, is_fraud_result.failed) == (1, True)
+    assert is_fraud_result.sample["is_fraud"].to_list() == [2]
+
+
+def test_split_rows_labels_invalid_rows_with_reasons(df):
+    rules = [
+        InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1)),
+        RegexRule("zip", "Invalid ZIP", pattern=r"^\d{5}$", zfill=5),
+    ]
+
+    valid, invalid = split_rows(df, rules)
+
+    assert valid.columns == df.columns
+    assert valid["zip"].to_list() == ["1234", "98765"]
+    assert invalid["zip"].to_list() == ["12345-6", None]
+    assert invalid["reason"].to_list() == ["zip:RegexRule", "is_fraud:InSetRule"]
+
+
+def test_non_null_rule_is_row_level_only_without_partial_nulls():
+    assert not NonNullRule("zip").row_level
+    assert NonNullRule("zip", allow_partial=False).row_level
+    assert InSetRule("is_fraud", "Invalid is_fraud", values=(0, 1)).row_level
+
+
+def test_rule_without_violation_expr_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        Rule("zip", "Invalid ZIP")  # type: ignore[abstract]
@@ -0,0 +1,181 @@
+import json
+from io import BytesIO
+from unittest.mock import Mock, patch
+
+import polars as pl
+import pytest
+
+import handler.schemas as schemas
+from handler.rules import InSetRule, NonNullRule
+from handler.schemas import TRANSACTIONS_V1, SchemaRegistry, SchemaVersion
+
+
+def _definition(name, version, columns, prefixes=()):
+    return {
+        "name": name,
+        "version": version,
+        "prefixes": list(prefixes),
+        "columns": columns,
+        "rules": [{"type": "in_set", "column": "is_fraud", "values": [0, 1]}],
+    }
+
+
+@pytest.fixture
+def processor_v1():
+    return SchemaVersion.from_dict(
+        _definition(
+            "processor", 1, {"card": "Int64", "is_fraud": "Int8"}, prefixes=["raw/processor/"]
+        )
+    )
+
+
+@pytest.fixture
+def processor_v2():
+    return SchemaVersion.from_dict(
+        _definition(
+            "processor",
+            2,
+            {"card": "Int64", "amount": "Float64", "is_fraud": "Int8"},
+            prefixes=["raw/processor/"],
+        )
+    )
+
+
+@pytest.fixture
+def registry(processor_v1, processor_v2):
+    registry = SchemaRegistry(TRANSACTIONS_V1)
+    registry.register(processor_v1)
+    registry.register(processor_v2)
+    return registry
+
+
+def test_from_dict_builds_columns_and_rules(processor_v2):
+    assert processor_v2.id == "processor/v2"
+    assert processor_v2.polars_schema == pl.Schema(
+        {"card": pl.Int64(), "amount": pl.Float64(), "is_fraud": pl.Int8()}
+    )
+    assert processor_v2.rules == (
+        NonNullRule("card"),
+        NonNullRule("amount"),
+        NonNullRule("is_fraud"),
+        InSetRule("is_fraud", "Invalid values found in is_fraud column", values=(0, 1)),
+    )
+
+
+def test_from_dict_with_unknown_dtype_raises():
+    with pytest.raises(ValueError, match="Unknown data type"):
+        SchemaVersion.from_dict(_definition("processor", 1, {"card": "Decimal"}))
+
+
+def test_from_dict_builds_compact_types():
+    definition = _definition("processor", 1, {"card": "Int64", "shop": "Utf8", "is_fraud": "Int8"})
+    definition["compact"] = {"card": "Int32", "shop": "Categorical"}
+
+    schema = SchemaVersion.from_dict(definition)
+
+    assert schema.compact_types == {"card": pl.Int32(), "shop": pl.Categorical()}
+    assert (
+        SchemaVersion.from_dict(_definition("processor", 1, {"card": "Int64"})).compact_types == {}
+    )
+
+
+def test_from_dict_with_compact_type_of_unknown_column_raises():
+    definition = _definition("processor", 1, {"card": "Int64"})
+    definition["compact"] = {"amount": "Float32"}
+
+    with pytest.raises(ValueError, match="unknown column"):
+        SchemaVersion.from_dict(definition)
+
+
+def test_register_duplicate_version_raises(registry, processor_v1):
+    with pytest.raises(ValueError, match="Schema processor/v1 is already registered"):
+        registry.register(processor_v1)
+
+
+def test_get_returns_latest_version(registry, processor_v1, processor_v2):
+    assert registry.get("processor") is processor_v2
+    assert registry.get("processor", 1) is processor_v1
+    with pytest.raises(ValueError, match="Unknown schema"):
+        registry.get("processor", 3)
+
+
+def test_resolve_outside_all_prefixes_without_header_returns_default(registry):
+    assert registry.resolve("raw/2025/01/01/data.csv") is TRANSACTIONS_V1
+
+
+def test_resolve_selects_version_by_header(registry, processor_v1, processor_v2):
+    key = "raw/processor/2025/01/01/data.csv"
+
+    assert registry.resolve(key, lambda: ["card", "is_fraud"]) is processor_v1
+    assert registry.resolve(key, lambda: ["is_fraud", "amount", "card"]) is processor_v2
+
+
+def test_resolve_with_unmatched_header_falls_back_to_latest_version(registry, processor_v2):
+    result = registry.resolve("raw/processor/data.csv", lambda: ["unknown"])
+
+    assert result is processor_v2
+
+
+def test_resolve_with_single_candidate_does_not_read_header(processor_v1):
+    registry = SchemaRegistry(TRANSACTIONS_V1)
+    registry.register(processor_v1)
+    read_header = Mock()
+
+    assert registry.resolve("raw/processor/data.csv", read_header) is processor_v1
+    read_header.assert_not_called()
+
+
+def test_resolve_prefers_longest_prefix(registry):
+    special = SchemaVersion.from_dict(
+        _definition("special", 1, {"card": "Int64"}, prefixes=["raw/processor/special/"])
+    )
+    registry.register(special)
+
+    assert registry.resolve("raw/processor/special/data.csv") is special
+
+
+def test_resolve_by_header_alone_outside_prefixes(registry):
+    header = list(TRANSACTIONS_V1.columns)
+
+    assert registry.resolve("raw/data.csv", lambda: header) is TRANSACTIONS_V1
+
+
+def test_read_header_from_buffer_keeps_position():
+    buffer = BytesIO(b'\xef\xbb\xbfcard,"is_fraud"\r\n1,0\n')
+
+    assert schemas.read_header(buffer) == ["card", "is_fraud"]
+    assert buffer.tell() == 0
+
+
+def test_read_header_from_bytes_and_path(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"card,is_fraud\n1,0\n")
+
+    assert schemas.read_header(path.read_bytes()) == ["card", "is_fraud"]
+    assert schemas.read_header(str(path)) == ["card", "is_fraud"]
+
+
+def test_load_definitions_from_directory(tmp_path):
+    (tmp_path / "a.json").write_text(
+        json.dumps([_definition("processor", 1, {"card": "Int64", "is_fraud": "Int8"})])
+    )
+    (tmp_path / "b.json").write_text(json.dumps(_definition("other", 1, {"id": "Utf8"})))
+    (tmp_path / "README.md").write_text("not a definition")
+
+    result = schemas.load_definitions(str(tmp_path))
+
+    assert [schema.id for schema in result] == ["processor/v1", "other/v1"]
+
+
+def test_get_registry_loads_definitions_once(tmp_path):
+    path = tmp_path / "schemas.json"
+    path.write_text(json.dumps(_definition("processor", 1, {"card": "Int64", "is_fraud": "Int8"})))
+    schemas.get_registry.cache_clear()
+
+    try:
+        with patch("handler.schemas.SCHEMA_DEFINITIONS_PATH", str(path)):
+            registry = schemas.get_registry()
+            assert schemas.get_registry() is registry
+        assert [schema.id for schema in registry.schemas] == ["transactions/v1", "processor/v1"]
+    finally:
+        schemas.get_registry.cache_clear()
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from handler.scratch import ScratchSpace
+
+
+@pytest.fixture
+def scratch_space(tmp_path):
+    return ScratchSpace(str(tmp_path / "scratch"), budget_bytes=100)
+
+
+def test_task_provides_unique_directories_and_removes_them(scratch_space):
+    with scratch_space.task("data.csv") as first, scratch_space.task("data.csv") as second:
+        assert first != second
+        assert os.path.isdir(first) and os.path.isdir(second)
+        with open(os.path.join(first, "data.csv"), "w") as file:
+            file.write("content")
+        assert scratch_space.disk_usage() == len("content")
+
+    assert os.listdir(scratch_space.root) == []
+
+
+def test_task_removes_directory_on_error(scratch_space):
+    with pytest.raises(RuntimeError), scratch_space.task("data.csv", 10) as directory:
+        raise RuntimeError("boom")
+
+    assert not os.path.exists(directory)
+    assert scratch_space.reserved_bytes == 0
+
+
+def test_task_over_budget_yields_none(scratch_space):
+    with scratch_space.task("big.csv", 60) as first:
+        assert first is not None
+        assert scratch_space.reserved_bytes == 60
+        with scratch_space.task("other.csv", 60) as second:
+            assert second is None
+
+    assert scratch_space.reserved_bytes == 0
+
+
+def test_first_use_removes_leftovers(scratch_space):
+    os.makedirs(os.path.join(scratch_space.root, "stale-task"))
+
+    with scratch_space.task("data.csv"):
+        assert "stale-task" not in os.listdir(scratch_space.root)
+
+    assert os.listdir(scratch_space.root) == []
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from handler import startup
+
+# Imports the entry point and rejects an invalid event in a fresh interpreter, which
+# is what a cold start with a malformed event does.
+COLD_START_SCRIPT = """
+import json, sys
+import handler.main
+try:
+    handler.main.main({"Records": [{}]}, None)
+except ValueError:
+    pass
+from handler.startup import get_startup_report
+print(json.dumps({
+    "modules": sorted(m for m in ("polars", "boto3") if m in sys.modules),
+    "report": get_startup_report(),
+}))
+"""
+
+
+@pytest.fixture(autouse=True)
+def reset_startup():
+    startup.reset()
+    yield
+    startup.reset()
+
+
+def test_record_keeps_first_occurrence_only():
+    startup.record("import", 0.5)
+    startup.record("import", 0.1)
+
+    assert startup.get_startup_report() == {"import": 0.5}
+
+
+def test_timed_records_phase_on_error():
+    with pytest.raises(RuntimeError), startup.timed("s3_client"):
+        raise RuntimeError("boom")
+
+    assert "s3_client" in startup.get_startup_report()
+
+
+def test_cold_start_does_not_import_polars_or_boto3():
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START_SCRIPT],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    output = json.loads(result.stdout.splitlines()[-1])
+    assert output["modules"] == []
+    assert set(output["report"]) == {"import", "first_invocation"}
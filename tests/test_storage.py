@@ -1,6 +1,9 @@
-from unittest.mock import patch
+import io
+import math
+from unittest.mock import ANY, Mock, patch
 
 import pytest
+from botocore.exceptions import ClientError
 
 import handler.storage as storage
 
@@ -33,3 +36,255 @@ def test_upload_file_to_s3_with_success_returns_none(mock_s3):
 
     result = storage.upload_file_to_s3("object_key", "file/path/data.csv")
     assert result is None
+
+
+@patch("handler.storage.s3")
+def test_download_fileobj_from_s3_with_success_returns_buffer(mock_s3):
+    mock_s3.get_object.return_value = {
+        "Body": Mock(iter_chunks=Mock(return_value=[b"a,b\n", b"1,2\n"]))
+    }
+
+    result = storage.download_fileobj_from_s3("bucket", "file.csv")
+
+    assert result.read() == b"a,b\n1,2\n"
+    mock_s3.get_object.assert_called_once_with(Bucket="bucket", Key="file.csv")
+
+
+@patch("handler.storage.s3")
+def test_download_fileobj_from_s3_with_exception_raises_exception(mock_s3):
+    mock_s3.get_object.side_effect = Exception("Download error")
+    with pytest.raises(Exception, match="Download error"):
+        storage.download_fileobj_from_s3("bucket", "file.csv")
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_upload_fileobj_to_s3_with_success_rewinds_buffer(mock_s3):
+    buffer = io.BytesIO(b"parquet")
+    buffer.read()
+
+    storage.upload_fileobj_to_s3("object_key", buffer)
+
+    mock_s3.upload_fileobj.assert_called_once_with(
+        buffer, "test_bucket", "object_key", Config=storage.get_transfer_config(), Callback=ANY
+    )
+    assert buffer.tell() == 0
+
+
+@patch("handler.storage.s3")
+def test_upload_fileobj_to_s3_with_exception_raises_exception(mock_s3):
+    mock_s3.upload_fileobj.side_effect = Exception("Upload error")
+    with pytest.raises(Exception, match="Upload error"):
+        storage.upload_fileobj_to_s3("object_key", io.BytesIO(b"parquet"))
+
+
+@patch("handler.storage.s3")
+def test_download_file_from_s3_with_success_records_transfer_metrics(mock_s3):
+    def download_file(bucket, key, path, Config, Callback):
+        Callback(3 * storage.MB)
+        Callback(storage.MB)
+
+    mock_s3.download_file.side_effect = download_file
+    storage.reset_transfer_metrics()
+
+    storage.download_file_from_s3("bucket", "raw/file.csv")
+
+    mock_s3.download_file.assert_called_once_with(
+        "bucket",
+        "raw/file.csv",
+        "/tmp/file.csv",
+        Config=storage.get_transfer_config(),
+        Callback=ANY,
+    )
+    [metrics] = storage.get_transfer_metrics()
+    assert metrics.operation == "download"
+    assert metrics.object_key == "raw/file.csv"
+    assert metrics.size_bytes == 4 * storage.MB
+    assert metrics.throughput_mb_per_second > 0
+
+
+@patch("handler.storage.s3")
+def test_drain_transfer_metrics_returns_and_resets_them(mock_s3):
+    storage.reset_transfer_metrics()
+    storage.download_file_from_s3("bucket", "raw/file.csv")
+
+    [metrics] = storage.drain_transfer_metrics()
+
+    assert metrics.object_key == "raw/file.csv"
+    assert storage.get_transfer_metrics() == []
+
+
+def test_transfer_config_matches_connection_pool():
+    assert storage.get_transfer_config().max_request_concurrency == storage.MAX_CONCURRENCY
+    assert storage.get_s3_client().meta.config.max_pool_connections == storage.MAX_POOL_CONNECTIONS
+    assert storage.MAX_POOL_CONNECTIONS >= storage.MAX_CONCURRENCY
+
+
+@patch("handler.storage.s3", None)
+@patch("boto3.client")
+def test_get_s3_client_creates_client_once(mock_client):
+    assert storage.get_s3_client() is mock_client.return_value
+    assert storage.get_s3_client() is mock_client.return_value
+    mock_client.assert_called_once()
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_copy_object_to_refined_bucket_with_small_object_uses_copy_object(mock_s3):
+    mock_s3.head_object.return_value = {"ContentLength": 1024}
+
+    storage.copy_object_to_refined_bucket("raw_bucket", "raw/file.csv", "quarantine/file.csv")
+
+    mock_s3.copy_object.assert_called_once_with(
+        Bucket="test_bucket",
+        Key="quarantine/file.csv",
+        CopySource={"Bucket": "raw_bucket", "Key": "raw/file.csv"},
+    )
+    mock_s3.create_multipart_upload.assert_not_called()
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_copy_object_to_refined_bucket_with_large_object_uses_multipart_copy(mock_s3):
+    size = storage.MAX_COPY_OBJECT_SIZE + 1
+    mock_s3.head_object.return_value = {"ContentLength": size}
+    mock_s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    mock_s3.upload_part_copy.side_effect = lambda **kwargs: {
+        "CopyPartResult": {"ETag": f"etag-{kwargs['PartNumber']}"}
+    }
+
+    storage.copy_object_to_refined_bucket("raw_bucket", "raw/file.csv", "quarantine/file.csv")
+
+    part_count = math.ceil(size / storage.COPY_PART_SIZE)
+    assert mock_s3.upload_part_copy.call_count == part_count
+    ranges = {
+        call.kwargs["PartNumber"]: call.kwargs["CopySourceRange"]
+        for call in mock_s3.upload_part_copy.call_args_list
+    }
+    assert ranges[part_count].endswith(f"-{size - 1}")
+    parts = mock_s3.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert [part["PartNumber"] for part in parts] == list(range(1, part_count + 1))
+    mock_s3.copy_object.assert_not_called()
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_copy_object_to_refined_bucket_with_if_match_copies_only_that_etag(mock_s3):
+    mock_s3.head_object.return_value = {"ContentLength": 1024}
+
+    storage.copy_object_to_refined_bucket(
+        "test_bucket", "refined/a.parquet", "refined/b.parquet", if_match='"etag"'
+    )
+
+    mock_s3.head_object.assert_called_once_with(
+        Bucket="test_bucket", Key="refined/a.parquet", IfMatch='"etag"'
+    )
+    mock_s3.copy_object.assert_called_once_with(
+        Bucket="test_bucket",
+        Key="refined/b.parquet",
+        CopySource={"Bucket": "test_bucket", "Key": "refined/a.parquet"},
+        CopySourceIfMatch='"etag"',
+    )
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_copy_object_to_refined_bucket_with_part_error_aborts_upload(mock_s3):
+    mock_s3.head_object.return_value = {"ContentLength": storage.MAX_COPY_OBJECT_SIZE + 1}
+    mock_s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    mock_s3.upload_part_copy.side_effect = Exception("Copy error")
+
+    with pytest.raises(Exception, match="Copy error"):
+        storage.copy_object_to_refined_bucket("raw_bucket", "raw/file.csv", "quarantine/file.csv")
+
+    mock_s3.abort_multipart_upload.assert_called_once_with(
+        Bucket="test_bucket", Key="quarantine/file.csv", UploadId="upload-1"
+    )
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_list_object_keys_with_pages_returns_all_keys(mock_s3):
+    mock_s3.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": "ledger/a.json"}, {"Key": "ledger/b.json"}]},
+        {},
+    ]
+
+    result = storage.list_object_keys("ledger/")
+
+    assert result == ["ledger/a.json", "ledger/b.json"]
+    mock_s3.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="test_bucket", Prefix="ledger/"
+    )
+
+
+@patch("handler.storage.s3")
+def test_delete_objects_from_s3_with_many_keys_deletes_in_batches(mock_s3):
+    storage.delete_objects_from_s3([f"key-{i}" for i in range(storage.MAX_DELETE_BATCH + 1)])
+
+    assert mock_s3.delete_objects.call_count == 2
+
+
+@patch("handler.storage.s3")
+def test_get_bytes_from_s3_with_exception_raises_exception(mock_s3):
+    mock_s3.get_object.side_effect = Exception("Read error")
+    with pytest.raises(Exception, match="Read error"):
+        storage.get_bytes_from_s3("ledger/a.json")
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_put_bytes_to_s3_with_conditions_passes_preconditions(mock_s3):
+    mock_s3.put_object.return_value = {"ETag": '"etag-2"'}
+
+    result = storage.put_bytes_to_s3("log.json", b"{}", if_match='"etag-1"')
+
+    assert result == '"etag-2"'
+    mock_s3.put_object.assert_called_once_with(
+        Bucket="test_bucket", Key="log.json", Body=b"{}", IfMatch='"etag-1"'
+    )
+
+
+@patch("handler.storage.REFINED_BUCKET_NAME", "test_bucket")
+@patch("handler.storage.s3")
+def test_put_bytes_to_s3_with_if_none_match_only_creates(mock_s3):
+    storage.put_bytes_to_s3("log.json", b"{}", if_none_match=True)
+
+    mock_s3.put_object.assert_called_once_with(
+        Bucket="test_bucket", Key="log.json", Body=b"{}", IfNoneMatch="*"
+    )
+
+
+@patch("handler.storage.s3")
+def test_object_exists_with_missing_object_returns_false(mock_s3):
+    mock_s3.head_object.side_effect = ClientError(
+        {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject"
+    )
+
+    assert storage.object_exists("idempotency/marker.json") is False
+
+
+@patch("handler.storage.s3")
+def test_object_exists_with_existing_object_returns_true(mock_s3):
+    assert storage.object_exists("idempotency/marker.json") is True
+
+
+@patch("handler.storage.s3")
+def test_get_object_checksum_returns_checksum_fields(mock_s3):
+    mock_s3.head_object.return_value = {
+        "ContentLength": 8,
+        "ChecksumCRC64NVME": "AQEBAQEBAQE=",
+        "ChecksumType": "FULL_OBJECT",
+        "ETag": '"etag"',
+    }
+
+    result = storage.get_object_checksum("bucket", "raw/file.csv")
+
+    assert result == {
+        "ContentLength": 8,
+        "ChecksumCRC64NVME": "AQEBAQEBAQE=",
+        "ChecksumType": "FULL_OBJECT",
+    }
+    mock_s3.head_object.assert_called_once_with(
+        Bucket="bucket", Key="raw/file.csv", ChecksumMode="ENABLED"
+    )
@@ -1,3 +1,4 @@
+from datetime import datetime
 from unittest.mock import patch
 
 import polars as pl
@@ -15,7 +16,9 @@ def test_transform_dataframe_to_parquet__with_succes_returns_path(mock_write_par
     result_path = transform.transform_dataframe_to_parquet(df, filename)
 
     assert result_path == "/tmp/data.parquet"
-    mock_write_parquet.assert_called_once_with("/tmp/data.parquet")
+    mock_write_parquet.assert_called_once_with(
+        "/tmp/data.parquet", **transform.PARQUET_OPTIONS.write_kwargs()
+    )
 
 
 @patch("handler.transform.pl.DataFrame.write_parquet")
@@ -26,3 +29,171 @@ def test_transform_dataframe_to_parquet_with_exception_raises_exception(mock_wri
 
     with pytest.raises(Exception, match="Failed to write Parquet file"):
         transform.transform_dataframe_to_parquet(df, filename)
+
+
+def test_sink_lazyframe_to_parquet_with_success_returns_path():
+    lf = pl.LazyFrame({"col1": [1, 2, 3], "col2": ["a", "b", "c"]})
+
+    result_path = transform.sink_lazyframe_to_parquet(lf, "streamed.parquet")
+
+    assert result_path == "/tmp/streamed.parquet"
+    assert pl.read_parquet(result_path).equals(lf.collect())
+
+
+@patch("handler.transform.pl.LazyFrame.sink_parquet")
+def test_sink_lazyframe_to_parquet_with_exception_raises_exception(mock_sink_parquet):
+    mock_sink_parquet.side_effect = Exception("Failed to sink Parquet file")
+    lf = pl.LazyFrame({"col1": [1, 2, 3]})
+
+    with pytest.raises(Exception, match="Failed to sink Parquet file"):
+        transform.sink_lazyframe_to_parquet(lf, "streamed.parquet")
+
+
+def test_transform_to_parquet_buffer_with_dataframe_returns_buffer():
+    df = pl.DataFrame({"col1": [1, 2, 3], "col2": ["a", "b", "c"]})
+
+    buffer = transform.transform_to_parquet_buffer(df)
+
+    assert pl.read_parquet(buffer).equals(df)
+
+
+def test_transform_to_parquet_buffer_with_lazyframe_returns_buffer():
+    lf = pl.LazyFrame({"col1": [1, 2, 3]})
+
+    buffer = transform.transform_to_parquet_buffer(lf)
+
+    assert pl.read_parquet(buffer).equals(lf.collect())
+
+
+def test_parquet_options_are_applied():
+    df = pl.DataFrame({"col1": list(range(100)), "col2": ["a", "b"] * 50})
+    options = transform.ParquetOptions(
+        compression="lz4", row_group_size=10, dictionary_columns=("col2",)
+    )
+
+    buffer = transform.transform_to_parquet_buffer(df, options)
+
+    written = pl.read_parquet(buffer)
+    assert written.schema["col2"] == pl.Categorical
+    assert written.with_columns(pl.col("col2").cast(pl.Utf8)).equals(df)
+
+
+def test_parquet_options_from_env(monkeypatch):
+    monkeypatch.setenv("PARQUET_COMPRESSION", "zstd")
+    monkeypatch.setenv("PARQUET_COMPRESSION_LEVEL", "9")
+    monkeypatch.setenv("PARQUET_ROW_GROUP_SIZE", "65536")
+    monkeypatch.setenv("PARQUET_STATISTICS", "false")
+    monkeypatch.setenv("PARQUET_PARTITION_BY", "date, category")
+    monkeypatch.setenv("PARQUET_COMPACT", "true")
+
+    options = transform.ParquetOptions.from_env()
+
+    assert options.write_kwargs() == {
+        "compression": "zstd",
+        "compression_level": 9,
+        "row_group_size": 65536,
+        "statistics": False,
+    }
+    assert options.partition_by == ("date", "category")
+    assert options.compact
+
+
+def test_parquet_options_with_unknown_partition_key_raises():
+    with pytest.raises(ValueError, match="Unknown partition key"):
+        transform.ParquetOptions(partition_by=("merchant",))
+
+
+def test_partition_frame_splits_by_date_and_category():
+    df = pl.DataFrame(
+        {
+            "trans_date_trans_time": [
+                datetime(2020, 6, 21, 12),
+                datetime(2020, 6, 21, 13),
+                datetime(2020, 6, 22, 9),
+            ],
+            "category": ["travel", "home", "travel"],
+            "amt": [1.0, 2.0, 3.0],
+        }
+    )
+    options = transform.ParquetOptions(partition_by=("date", "category"))
+
+    partitions = transform.partition_frame(df.lazy(), options)
+
+    assert sorted(partitions) == [
+        "trans_date=2020-06-21/category=home",
+        "trans_date=2020-06-21/category=travel",
+        "trans_date=2020-06-22/category=travel",
+    ]
+    travel = partitions["trans_date=2020-06-21/category=travel"]
+    assert travel.columns == ["trans_date_trans_time", "amt"]
+    assert travel["amt"].to_list() == [1.0]
+
+
+def test_partition_input_columns_lists_columns_of_partition_keys():
+    options = transform.ParquetOptions(partition_by=("date", "category"))
+
+    assert transform.partition_input_columns(options) == {"trans_date_trans_time", "category"}
+
+
+def test_partition_frame_with_null_keys_uses_hive_default_partition():
+    df = pl.DataFrame(
+        {
+            "trans_date_trans_time": [datetime(2020, 6, 21, 12), None],
+            "category": [None, "travel"],
+            "amt": [1.0, 2.0],
+        }
+    )
+    options = transform.ParquetOptions(partition_by=("date", "category"))
+
+    partitions = transform.partition_frame(df, options)
+
+    assert sorted(partitions) == [
+        "trans_date=2020-06-21/category=__HIVE_DEFAULT_PARTITION__",
+        "trans_date=__HIVE_DEFAULT_PARTITION__/category=travel",
+    ]
+
+
+@pytest.fixture
+def compactable_df():
+    return pl.DataFrame(
+        {
+            "category": ["travel", "travel", "home", "travel"],
+            "trans_num": ["a", "b", "c", "d"],
+            "city_pop": [100, 2_000_000, 5_000, 40],
+            "amt": [1.5, 2.25, 0.5, 8.0],
+        }
+    )
+
+
+COMPACT_TYPES = {"category": pl.Categorical(), "city_pop": pl.Int32(), "zip": pl.Int32()}
+
+
+def test_compact_frame_keeps_values_and_writes_compact_types(compactable_df):
+    result = transform.compact_frame(compactable_df, COMPACT_TYPES)
+    buffer = transform.transform_to_parquet_buffer(result)
+
+    assert result.schema["category"] == pl.Categorical()
+    assert result.schema["city_pop"] == pl.Int32()
+    assert result.schema["trans_num"] == pl.String()
+    assert result.cast(dict(compactable_df.schema)).equals(compactable_df)
+    assert pl.read_parquet_schema(buffer) == result.schema
+
+
+def test_compact_frame_gives_files_of_a_schema_the_same_types(compactable_df):
+    small = compactable_df.with_columns(pl.col("city_pop") // 1000)
+
+    schemas = [
+        pl.read_parquet_schema(
+            transform.transform_to_parquet_buffer(transform.compact_frame(frame, COMPACT_TYPES))
+        )
+        for frame in (compactable_df, small, compactable_df.lazy())
+    ]
+
+    assert schemas[0] == schemas[1] == schemas[2]
+
+
+def test_compact_frame_with_value_outside_compact_type_raises(compactable_df):
+    frame = compactable_df.with_columns(city_pop=pl.lit(2**40))
+
+    with pytest.raises(pl.exceptions.InvalidOperationError, match="city_pop"):
+        transform.compact_frame(frame, COMPACT_TYPES)
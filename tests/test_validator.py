@@ -1,4 +1,4 @@
-from io import StringIO
+from io import BytesIO, StringIO
 from unittest.mock import patch
 
 import polars as pl
@@ -144,3 +144,140 @@ def test_load_and_validate_csv_with_valid_csv_returns_dataframe(mock_read_csv, i
 
     result = validator.load_and_validate_csv(input_path)
     assert result.equals(mock_data)
+
+
+@pytest.fixture
+def valid_csv_path(tmp_path):
+    header = ",".join(validator.EXPECTED_SCHEMA_MAPPING)
+    rows = [
+        "2019-01-20 00:00:23,4935858973307492,fraud_Miller-Hauck,grocery_pos,100.0,Lance,Wagner,"
+        'M,"6003 Brady Shoal Apt. 449",Irwinton,GA,31042,32.8088,-83.174,1841,Film/video editor,'
+        "1975-06-01,77993e691b6dc1739db700be27fb9adf,1327017623,32.886358,-83.371659,0",
+        "2019-01-20 00:02:05,676309913934,fraud_Murray-Smitham,grocery_pos,50.0,Robert,Martinez,"
+        "M,3683 Parrish Circles,Pueblo,CO,81005,38.2352,-104.66,151815,Further education lecturer,"
+        "1988-01-04,fa6d1757257185718850f6dd308a609d,1327017725,38.994192,-105.02271,1",
+    ]
+    path = tmp_path / "valid.csv"
+    path.write_text("\n".join([header, *rows]) + "\n")
+    return path
+
+
+def test_scan_and_validate_csv_with_valid_csv_returns_lazyframe(valid_csv_path):
+    result = validator.scan_and_validate_csv(str(valid_csv_path))
+
+    assert isinstance(result, pl.LazyFrame)
+    assert result.collect().equals(validator.load_and_validate_csv(str(valid_csv_path)))
+
+
+def test_scan_and_validate_csv_with_missing_columns(missing_columns_csv, tmp_path):
+    temp_csv_path = tmp_path / "missing_columns.csv"
+    temp_csv_path.write_text(missing_columns_csv.getvalue())
+
+    with pytest.raises(ValueError, match="Missing column in the DataFrame: is_fraud"):
+        validator.scan_and_validate_csv(str(temp_csv_path))
+
+
+def test_scan_and_validate_csv_with_invalid_fraud_value_raises_exception(valid_csv_path):
+    valid_csv_path.write_text(valid_csv_path.read_text().replace(",1\n", ",3\n"))
+
+    with pytest.raises(ValueError, match="Invalid values found in is_fraud column"):
+        validator.scan_and_validate_csv(str(valid_csv_path))
+
+
+def test_scan_and_validate_csv_with_zip_value_raises_exception(valid_csv_path):
+    valid_csv_path.write_text(valid_csv_path.read_text().replace(",81005,", ",81005-6,"))
+
+    with pytest.raises(ValueError, match="Invalid ZIP codes found"):
+        validator.scan_and_validate_csv(str(valid_csv_path))
+
+
+def test_scan_and_validate_csv_with_small_blocks_validates_every_block(valid_csv_path):
+    valid_csv_path.write_text(valid_csv_path.read_text().replace(",81005,", ",81005-6,"))
+
+    # Every record is a block of its own, the invalid ZIP code is in the last one.
+    with pytest.raises(ValueError, match="Invalid ZIP codes found"):
+        validator.scan_and_validate_csv(str(valid_csv_path), block_size=16)
+
+
+def test_scan_and_validate_csv_with_small_blocks_keeps_quoted_newlines(valid_csv_path):
+    valid_csv_path.write_text(
+        valid_csv_path.read_text().replace('"6003 Brady Shoal Apt. 449"', '"6003 Brady\nShoal"')
+    )
+
+    result = validator.scan_and_validate_csv(str(valid_csv_path), block_size=16)
+
+    assert result.collect().get_column("street").to_list()[0] == "6003 Brady\nShoal"
+
+
+def test_read_blocks_ends_blocks_at_record_boundaries():
+    data = b'a,b\n1,"x\ny"\n2,z\n3,w'
+
+    blocks = list(validator._read_blocks(BytesIO(data), block_size=4))
+
+    assert b"".join(blocks) == data
+    assert blocks == [b"a,b\n", b'1,"x\ny"\n', b"2,z\n", b"3,w"]
+
+
+def test_load_and_validate_csv_with_buffer_matches_path(valid_csv_path):
+    buffer = BytesIO(valid_csv_path.read_bytes())
+
+    result = validator.load_and_validate_csv(buffer)
+
+    assert result.equals(validator.load_and_validate_csv(str(valid_csv_path)))
+
+
+def test_scan_and_validate_csv_with_buffer_returns_lazyframe(valid_csv_path):
+    buffer = BytesIO(valid_csv_path.read_bytes())
+
+    result = validator.scan_and_validate_csv(buffer)
+
+    assert result.collect().height == 2
+
+
+@pytest.fixture
+def loaded_df(valid_csv_path):
+    return validator.read_csv(str(valid_csv_path))
+
+
+def test_split_invalid_rows_moves_invalid_rows_out(loaded_df):
+    df = loaded_df.with_columns(pl.Series("is_fraud", [0, 2], dtype=pl.Int8))
+
+    valid, invalid = validator.split_invalid_rows(df, max_error_rate=0.5)
+
+    assert valid.equals(df.head(1))
+    assert invalid["reason"].to_list() == ["is_fraud:InSetRule"]
+
+
+def test_split_invalid_rows_above_error_rate_raises(loaded_df):
+    df = loaded_df.with_columns(pl.Series("zip", ["abc", "def"]))
+
+    with pytest.raises(ValueError, match="Invalid row rate 100.0000% exceeds"):
+        validator.split_invalid_rows(df, max_error_rate=0.5)
+
+
+def test_split_invalid_rows_with_missing_column_raises(loaded_df):
+    df = loaded_df.with_columns(pl.lit(None, dtype=pl.Utf8).alias("merchant"))
+
+    with pytest.raises(ValueError, match="Missing column in the DataFrame: merchant"):
+        validator.split_invalid_rows(df, max_error_rate=1.0)
+
+
+def test_preflight_csv_checks_complete_records_of_sample(valid_csv_path):
+    data = valid_csv_path.read_bytes()
+
+    assert validator.preflight_csv(data[:-40], validator.DEFAULT_SCHEMA) == 1
+    assert validator.preflight_csv(data, validator.DEFAULT_SCHEMA, complete=True) == 2
+
+
+def test_preflight_csv_with_missing_columns_raises(missing_columns_csv):
+    sample = missing_columns_csv.getvalue().encode()
+
+    with pytest.raises(ValueError, match="Missing column in the DataFrame: is_fraud"):
+        validator.preflight_csv(sample, validator.DEFAULT_SCHEMA)
+
+
+def test_preflight_csv_with_wrong_types_raises(valid_csv_path):
+    sample = valid_csv_path.read_bytes().replace(b",100.0,", b",n/a,")
+
+    with pytest.raises(ValueError, match="Sample rows do not match schema transactions/v1"):
+        validator.preflight_csv(sample, validator.DEFAULT_SCHEMA, complete=True)